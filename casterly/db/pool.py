@@ -0,0 +1,157 @@
+"""
+Pools of idle database connections, kept by every worker process so its
+requests reuse the connections the ones before left instead of opening
+new ones. They don't know about any database in particular: whoever makes
+a pool gives it the functions for checking, resetting and closing its
+connections.
+"""
+import os
+import threading
+import time
+
+
+POOL_SIZE = 5
+MAX_IDLE_SECONDS = 300
+CHECK_AFTER_SECONDS = 30
+
+COUNTERS = (
+    ("hits", "Connections taken from the pool"),
+    ("misses", "Connections opened because the pool had none"),
+    ("discarded", "Pooled connections closed for being idle too long or "
+                  "broken"),
+    ("overflow", "Connections closed because the pool was full"),
+)
+
+
+class ConnectionPool(object):
+    """
+    Idle connections, up to size of them, in the order they were returned.
+    The last one returned is the first one taken, so the least used ones
+    are the ones reaching max_idle seconds and being closed when the load
+    goes down. A connection idle for longer than check_after seconds is
+    only taken if check says it still works; reset is called on every
+    returned one and has to leave it ready for the next user, returning
+    False if it can't.
+    """
+
+    def __init__(self, check, reset, close, size=POOL_SIZE,
+                 max_idle=MAX_IDLE_SECONDS, check_after=CHECK_AFTER_SECONDS,
+                 labels=None):
+        self.check = check
+        self.reset = reset
+        self.close = close
+        self.size = size
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.labels = labels or {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.idle = []
+        self.counts = dict.fromkeys([name for name, _ in COUNTERS], 0)
+
+    def _forked(self):
+        # The connections inherited from the parent process are dropped
+        # without closing them, as that would close them for the parent too
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.idle = []
+            self.counts = dict.fromkeys(self.counts, 0)
+
+    def get(self):
+        """
+        Returns an idle connection, or None if there isn't any usable one,
+        in which case the caller has to open a new one.
+        """
+        while True:
+            with self.lock:
+                self._forked()
+                if not self.idle:
+                    self.counts["misses"] += 1
+                    return None
+                connection, returned = self.idle.pop()
+            idle = time.time() - returned
+            if idle <= self.max_idle and (
+                    idle <= self.check_after or self.check(connection)):
+                with self.lock:
+                    self.counts["hits"] += 1
+                return connection
+            self.discard([connection])
+
+    def put(self, connection):
+        """
+        Takes back a connection, closing it if it can't be reset or the
+        pool is full. The ones idle for too long are closed too.
+        """
+        if not self.reset(connection):
+            self.discard([connection])
+            return
+
+        now = time.time()
+        with self.lock:
+            self._forked()
+            stale = 0
+            while stale < len(self.idle) and (
+                    now - self.idle[stale][1] > self.max_idle):
+                stale += 1
+            closing = [idle for idle, _ in self.idle[:stale]]
+            del self.idle[:stale]
+            self.counts["discarded"] += stale
+            if len(self.idle) < self.size:
+                self.idle.append((connection, now))
+            else:
+                self.counts["overflow"] += 1
+                closing.append(connection)
+        for connection in closing:
+            self.close(connection)
+
+    def discard(self, connections):
+        with self.lock:
+            self.counts["discarded"] += len(connections)
+        for connection in connections:
+            self.close(connection)
+
+    def clear(self):
+        """
+        Closes all the idle connections.
+        """
+        with self.lock:
+            self._forked()
+            closing = [connection for connection, _ in self.idle]
+            self.idle = []
+        for connection in closing:
+            self.close(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, **options):
+    """
+    Returns the pool for the given key, making it with the given
+    ConnectionPool options the first time.
+    """
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(**options)
+    return pool
+
+
+def render():
+    """
+    The counters of all the pools of this process, in the Prometheus text
+    format.
+    """
+    with _pools_lock:
+        pools = sorted(_pools.items())
+    lines = []
+    for counter, help_text in COUNTERS:
+        name = "casterly_db_pool_%s_total" % counter
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s counter" % name)
+        for _, pool in pools:
+            labels = ",".join('%s="%s"' % item
+                              for item in sorted(pool.labels.items()))
+            lines.append("%s{%s} %d" % (name, labels, pool.counts[counter]))
+    return "\n".join(lines) + "\n"
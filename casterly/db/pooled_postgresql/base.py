@@ -0,0 +1,107 @@
+"""
+PostgreSQL backend keeping the connections open between requests. When
+Django closes a connection at the end of a request it goes back to a pool
+of the worker process, and the next request takes it from there instead of
+opening a new one.
+
+It's used as 'ENGINE': 'casterly.db.pooled_postgresql', with the settings
+of django.db.backends.postgresql_psycopg2 plus these optional ones:
+
+    'POOL_SIZE': idle connections kept by every worker process.
+    'POOL_MAX_IDLE': seconds a connection can be idle before it's closed.
+    'POOL_CHECK_AFTER': seconds a connection can be idle before it has to
+        answer a query to be reused.
+
+The connection_created signal is only sent for new connections, as the
+pooled ones were already set up when they were opened.
+"""
+from django.db.backends.postgresql_psycopg2 import base
+from django.db.backends.postgresql_psycopg2.base import *
+
+from casterly.db.pool import (get_pool, POOL_SIZE, MAX_IDLE_SECONDS,
+                              CHECK_AFTER_SECONDS)
+
+
+def check(connection):
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+        connection.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+def reset(connection):
+    """
+    Rolls back whatever the connection was left doing, as closing it would
+    have done.
+    """
+    if connection.closed:
+        return False
+    try:
+        if (connection.get_transaction_status() !=
+                psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+            connection.rollback()
+    except Database.Error:
+        return False
+    return (connection.get_transaction_status() ==
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+
+def close(connection):
+    try:
+        connection.close()
+    except Database.Error:
+        pass
+
+
+def connection_pool(alias, settings_dict):
+    return get_pool(
+        (alias, settings_dict["NAME"], settings_dict["USER"],
+         settings_dict["HOST"], settings_dict["PORT"]),
+        check=check, reset=reset, close=close,
+        size=settings_dict.get("POOL_SIZE", POOL_SIZE),
+        max_idle=settings_dict.get("POOL_MAX_IDLE", MAX_IDLE_SECONDS),
+        check_after=settings_dict.get("POOL_CHECK_AFTER",
+                                      CHECK_AFTER_SECONDS),
+        labels={"alias": alias, "database": settings_dict["NAME"]})
+
+
+class DatabaseCreation(base.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # A database can't be dropped while there are connections to it
+        connection_pool(self.connection.alias, dict(
+            self.connection.settings_dict, NAME=test_database_name)).clear()
+        super(DatabaseCreation, self)._destroy_test_db(test_database_name,
+                                                       verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.creation = DatabaseCreation(self)
+
+    @property
+    def pool(self):
+        # Looked up every time, as the tests change the NAME
+        return connection_pool(self.alias, self.settings_dict)
+
+    def _cursor(self):
+        if self.connection is None:
+            connection = self.pool.get()
+            if connection is not None:
+                # Leaving transaction management may have changed it
+                connection.set_isolation_level(self.isolation_level)
+                self.connection = connection
+        return super(DatabaseWrapper, self)._cursor()
+
+    def close(self):
+        self.validate_thread_sharing()
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        self.pool.put(connection)
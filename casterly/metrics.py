@@ -0,0 +1,179 @@
+"""
+In-process request metrics: latency, number of SQL queries and SQL time per
+URL name, kept as histograms and exposed in the Prometheus text format.
+
+Every worker process keeps its own numbers, so the metrics endpoint shows
+the ones of the worker that answered the request.
+"""
+from bisect import bisect_left
+import threading
+import time
+
+from django.core.urlresolvers import resolve, Resolver404
+from django.db import connections
+
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram(object):
+    """
+    Cumulative histogram with a fixed set of upper bounds. Only the count
+    of the first bucket an observation fits in is increased; the
+    cumulative counts are computed when rendering.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        bounds = [repr(float(bound)) for bound in self.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d' % (
+                name, labels, bound, cumulative))
+        lines.append('%s_sum{%s} %s' % (name, labels, repr(self.sum)))
+        lines.append('%s_count{%s} %d' % (name, labels, cumulative))
+        return lines
+
+
+METRICS = (
+    ("casterly_request_seconds", "Time spent answering the request",
+     SECONDS_BUCKETS),
+    ("casterly_request_queries", "SQL queries run by the request",
+     QUERIES_BUCKETS),
+    ("casterly_request_sql_seconds", "Time spent in SQL queries",
+     SECONDS_BUCKETS),
+)
+
+
+class Registry(object):
+    """
+    Histograms of the metrics per view and status class.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, view, status, *values):
+        key = (view, status)
+        with self.lock:
+            histograms = self.histograms.get(key)
+            if histograms is None:
+                histograms = self.histograms[key] = [
+                    Histogram(buckets) for _, _, buckets in METRICS]
+            for histogram, value in zip(histograms, values):
+                histogram.observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for i, (name, help_text, _) in enumerate(METRICS):
+                lines.append("# HELP %s %s" % (name, help_text))
+                lines.append("# TYPE %s histogram" % name)
+                for (view, status), histograms in sorted(
+                        self.histograms.items()):
+                    labels = 'view="%s",status="%s"' % (view, status)
+                    lines.extend(histograms[i].render(name, labels))
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+
+class CountingCursorWrapper(object):
+    """
+    Cursor wrapper counting the queries and the time spent on them into
+    the stats of its connection. Unlike the debug cursor it doesn't keep
+    the SQL, so it's cheap enough for production.
+    """
+
+    def __init__(self, cursor, stats):
+        self.cursor = cursor
+        self.stats = stats
+
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.stats[0] += 1
+            self.stats[1] += time.time() - start
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.stats[0] += 1
+            self.stats[1] += time.time() - start
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def count_queries(connection):
+    """
+    Makes the cursors of the connection count their queries, returning
+    the [queries, seconds] stats they are counted into.
+    """
+    stats = getattr(connection, "query_stats", None)
+    if stats is None:
+        stats = connection.query_stats = [0, 0.0]
+        cursor = connection.cursor
+        connection.cursor = lambda: CountingCursorWrapper(cursor(), stats)
+    return stats
+
+
+def view_name(request):
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return "unresolved"
+    if match.app_name == "admin":
+        return "admin"
+    return match.url_name or match.func.__name__
+
+
+class MetricsMiddleware(object):
+    """
+    Records the metrics of every request. It should go first in the
+    middleware classes, so the time of the rest of them is included.
+    """
+
+    def process_request(self, request):
+        request._metrics_start = time.time()
+        request._metrics_queries = [
+            list(count_queries(connection))
+            for connection in connections.all()]
+
+    def process_response(self, request, response):
+        start = getattr(request, "_metrics_start", None)
+        if start is None:
+            return response
+        seconds = time.time() - start
+        queries, sql_seconds = 0, 0.0
+        for connection, before in zip(connections.all(),
+                                      request._metrics_queries):
+            stats = count_queries(connection)
+            queries += stats[0] - before[0]
+            sql_seconds += stats[1] - before[1]
+        registry.observe(view_name(request), "%dxx" % (
+            response.status_code / 100), seconds, queries, sql_seconds)
+        return response
@@ -0,0 +1,129 @@
+"""
+Routing of the heavy read-only queries, like the movement lists, the
+statistics and the exports, to a read replica.
+
+Only the code run inside replica_reads reads from the replica, so anything
+else, like the imports reading what they are about to write, keeps using
+the primary. Reads are pinned to the primary for the rest of the request
+after a write, and for REPLICA_PIN_SECONDS after it in the following
+requests of the same browser, so its user doesn't miss their own changes
+while the replica catches up.
+"""
+from functools import wraps
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+PIN_COOKIE = "replica_pin"
+
+_state = threading.local()
+
+
+def replica_alias():
+    """
+    The alias reads go to at this point: the replica inside replica_reads,
+    unless there is no replica configured or reads are pinned to the
+    primary.
+    """
+    replica = getattr(settings, "REPLICA_DATABASE", None)
+    if (replica is None or not getattr(_state, "replica_reads", 0) or
+            getattr(_state, "pinned", False)):
+        return DEFAULT_DB_ALIAS
+    return replica
+
+
+def reading_replica():
+    return replica_alias() != DEFAULT_DB_ALIAS
+
+
+def pin_seconds():
+    return getattr(settings, "REPLICA_PIN_SECONDS", 5)
+
+
+def pin_to_primary():
+    _state.pinned = True
+
+
+def pinned_to_primary():
+    return getattr(_state, "pinned", False)
+
+
+class replica_reads(object):
+    """
+    Context manager and decorator sending the reads of the code it wraps
+    to the replica. Code run after its request is over, like the generator
+    of a streamed response, passes whether the request was pinned to the
+    primary, as the middleware has forgotten it by then.
+    """
+
+    def __init__(self, pinned=None):
+        self.pinned = pinned
+
+    def __enter__(self):
+        _state.replica_reads = getattr(_state, "replica_reads", 0) + 1
+        if self.pinned is not None:
+            self.was_pinned = pinned_to_primary()
+            _state.pinned = self.pinned
+
+    def __exit__(self, *exc_info):
+        _state.replica_reads -= 1
+        if self.pinned is not None:
+            _state.pinned = self.was_pinned
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class ReplicaRouter(object):
+    """
+    Writes go to the primary, reads to the alias given by replica_alias.
+    Any write pins the reads that follow to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return replica_alias()
+
+    def db_for_write(self, model, **hints):
+        _state.written = True
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases have the same data
+        return True
+
+    def allow_syncdb(self, db, model):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinMiddleware(object):
+    """
+    Pins the reads to the primary for the requests of a browser that wrote
+    something in the last REPLICA_PIN_SECONDS, by means of a cookie.
+    """
+
+    def process_request(self, request):
+        _state.written = False
+        _state.pinned = False
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        if pinned_until > time.time():
+            pin_to_primary()
+
+    def process_response(self, request, response):
+        if getattr(_state, "written", False):
+            seconds = pin_seconds()
+            response.set_cookie(PIN_COOKIE, repr(time.time() + seconds),
+                                max_age=seconds, httponly=True)
+        _state.written = False
+        _state.pinned = False
+        return response
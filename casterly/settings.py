@@ -14,6 +14,9 @@ ADMINS = (
 
 MANAGERS = ADMINS
 
+# Addresses allowed to see the debug toolbar and the metrics
+INTERNAL_IPS = ('127.0.0.1',)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2', # Add 'postgresql_psycopg2', 'mysql', 'sqlite3' or 'oracle'.
@@ -25,6 +28,36 @@ DATABASES = {
     }
 }
 
+# 'ENGINE': 'casterly.db.pooled_postgresql' keeps the connections open
+# between requests in a pool per worker process, sized with 'POOL_SIZE' and
+# emptied of the ones idle for 'POOL_MAX_IDLE' seconds. The connections idle
+# for 'POOL_CHECK_AFTER' seconds are checked with a query before reusing
+# them. Its counters are shown by the metrics page
+
+# Alias of a read replica for the heavy read-only pages (lists, statistics
+# and exports), or None for reading everything from 'default'. The
+# 'replica' alias is the same database as 'default' until there is a real
+# one, so the routing can be tried locally, and the tests read through it
+# as a mirror of their database
+DATABASES['replica'] = dict(DATABASES['default'], TEST_MIRROR='default')
+REPLICA_DATABASE = None
+# Seconds the reads of a browser stay on 'default' after it writes, so it
+# doesn't miss its own changes while the replica catches up
+REPLICA_PIN_SECONDS = 5
+DATABASE_ROUTERS = ('casterly.routers.ReplicaRouter',)
+
+# The cached pages depend on versions bumped by whichever process changes
+# the movements (the web workers, the import jobs and the management
+# commands), so the cache has to be shared by all of them. With a cache of
+# its own for every process, like Django's default one, nothing computed
+# from the movements is cached
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+    }
+}
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -89,13 +122,14 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'casterly.metrics.MetricsMiddleware',
+    'casterly.routers.ReplicaPinMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 )
 
 ROOT_URLCONF = 'casterly.urls'
@@ -115,7 +149,6 @@ INSTALLED_APPS = (
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.admin',
-    'debug_toolbar',
     'south',
     'gunicorn',
     'money',
@@ -147,6 +180,12 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        # Failed import jobs, with their tracebacks
+        'money.jobs': {
+            'handlers': ['mail_admins'],
+            'level': 'ERROR',
+            'propagate': True,
+        },
     }
 }
 
@@ -154,3 +193,8 @@ try:
     from local_settings import *
 except ImportError:
     pass
+
+# The toolbar slows every request down, so it's only enabled when debugging
+if DEBUG_TOOLBAR:
+    MIDDLEWARE_CLASSES += ('debug_toolbar.middleware.DebugToolbarMiddleware',)
+    INSTALLED_APPS += ('debug_toolbar',)
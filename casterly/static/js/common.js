@@ -1,12 +1,54 @@
-$(".categoryInline").change(function(event){
-	var movement = $("#id_movement", this).attr("value");
-	var category = $(this).find("option:selected").attr("value");
+var pendingCategories = {};
+var pendingTimeout = null;
+
+function sendCategories(url){
+	var categories = pendingCategories;
+	pendingCategories = {};
+	pendingTimeout = null;
 	$.ajax({
 		type: "POST",
-		url: "/banking/movement/edit/category/",
-		data: {
-			movement: movement,
-			category: category
+		url: url,
+		contentType: "application/json",
+		data: JSON.stringify(categories),
+		headers: {
+			"X-CSRFToken": $("input[name=csrfmiddlewaretoken]").val()
+		},
+		dataType: "json",
+		success: function(data){
+			$.each(data.results, function(movement, result){
+				$(".categoryInline input[name=movement][value=" + movement + "]")
+					.closest(".categoryInline")
+					.toggleClass("error", result != "updated" && result != "unchanged");
+			});
+		}
+	});
+}
+
+// The category changes are sent in batches, once no other one is made
+// for a moment
+$(".categoryInline").change(function(event){
+	var movement = $("input[name=movement]", this).val();
+	var category = $(this).find("option:selected").attr("value");
+	pendingCategories[movement] = category == "None" ? null : category;
+	if (pendingTimeout !== null) {
+		clearTimeout(pendingTimeout);
+	}
+	var url = $(this).closest("table").data("categories-url");
+	pendingTimeout = setTimeout(function(){ sendCategories(url); }, 500);
+});
+
+function refreshImportJob(job){
+	$.getJSON(job.data("url"), function(data){
+		$(".status", job).text(data.status);
+		$(".parsed", job).text(data.rows_parsed);
+		$(".imported", job).text(data.rows_imported);
+		$(".rejected", job).text(data.rows_rejected);
+		if (data.status == "pending" || data.status == "running") {
+			setTimeout(function(){ refreshImportJob(job); }, 2000);
 		}
-	})
-});
\ No newline at end of file
+	});
+}
+
+$("#import-job").each(function(){
+	refreshImportJob($(this));
+});
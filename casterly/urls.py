@@ -6,6 +6,7 @@ admin.autodiscover()
 
 urlpatterns = patterns('',
     url(r'^$', 'casterly.views.home', name='home'),
+    url(r'^metrics$', 'casterly.views.metrics', name='metrics'),
     url(r'^banking/', include('money.urls')),
     url(r'^admin/', include(admin.site.urls)),
 )
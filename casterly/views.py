@@ -1,5 +1,19 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
 from django.shortcuts import render
 
+from casterly.db import pool
+from casterly.metrics import registry
+
 
 def home(request):
 	return render(request, "casterly/home.html", {})
+
+
+def metrics(request):
+	if not (request.user.is_staff or
+			request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS):
+		raise PermissionDenied
+	return HttpResponse(registry.render() + pool.render(),
+			content_type="text/plain; version=0.0.4; charset=utf-8")
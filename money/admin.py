@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.utils.translation import ugettext_lazy as _, ungettext
 
 from money.models import BankAccount, MovementCategory, CategorySuggestion
 
@@ -12,9 +13,19 @@ class MovementCategoryAdmin(admin.ModelAdmin):
 
 
 class CategorySuggestionAdmin(admin.ModelAdmin):
-    pass
+    actions = ["apply_to_movements"]
+
+    def apply_to_movements(self, request, queryset):
+        for suggestion, count in CategorySuggestion.objects.apply_to_movements(
+                queryset.select_related("category")):
+            self.message_user(request, ungettext(
+                u"%(suggestion)s: %(count)d movement categorized",
+                u"%(suggestion)s: %(count)d movements categorized",
+                count) % {"suggestion": suggestion, "count": count})
+    apply_to_movements.short_description = _(
+        u"Categorize the uncategorized movements")
 
 
 admin.site.register(BankAccount, BankAccountAdmin)
 admin.site.register(MovementCategory, MovementCategoryAdmin)
-admin.site.register(CategorySuggestion, CategorySuggestionAdmin)
\ No newline at end of file
+admin.site.register(CategorySuggestion, CategorySuggestionAdmin)
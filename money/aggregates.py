@@ -0,0 +1,25 @@
+from django.db.models import Aggregate
+from django.db.models.sql.aggregates import Aggregate as SQLAggregate
+
+
+class SQLConditionalSum(SQLAggregate):
+    sql_function = 'SUM'
+    sql_template = ('%(function)s(CASE WHEN %(field)s %(condition)s '
+                    'THEN %(field)s ELSE 0 END)')
+
+
+class ConditionalSum(Aggregate):
+    """
+    Sum of the values of a field that fulfil a condition over that same
+    field, like ConditionalSum("amount", condition="< 0"). It allows getting
+    several partial sums from a single query.
+    """
+    name = 'ConditionalSum'
+
+    def __init__(self, lookup, condition, **extra):
+        super(ConditionalSum, self).__init__(
+            lookup, condition=condition, **extra)
+
+    def add_to_query(self, query, alias, col, source, is_summary):
+        query.aggregates[alias] = SQLConditionalSum(
+            col, source=source, is_summary=is_summary, **self.extra)
@@ -0,0 +1,191 @@
+"""
+Benchmarks for the hot paths of the statement imports and the statistics,
+run through the benchmark management command.
+"""
+from contextlib import contextmanager
+import csv
+from datetime import date, timedelta
+import os
+import random
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.creation import TEST_DATABASE_PREFIX
+
+from money.models import (BankAccount, Movement, MovementCategory,
+                          CategorySuggestion)
+from money.parser import iter_csv, iter_columns, import_movements
+from money.parser.banks import LloydsParser
+
+
+KEYWORDS = [
+    "SAINSBURY", "TESCO", "TFL", "AMAZON", "SALARY", "RENT", "BOOTS", "PRET",
+    "NETFLIX", "VIRGIN", "EASYJET", "UBER", "COSTA", "ARGOS", "WAITROSE",
+]
+
+
+def generate_statement(rows, seed=0):
+    """
+    Writes a Lloyd's CSV statement with the given number of rows, newest
+    first as the bank exports them, into a temporary file.
+    """
+    rand = random.Random(seed)
+    statement = tempfile.TemporaryFile()
+    statement.write("Transaction Date,Transaction Type,Sort Code,"
+        "Account Number,Transaction Description,Debit Amount,"
+        "Credit Amount,Balance\n")
+    per_day = max(1, rows / 3650)
+    day = date(2012, 12, 31)
+    balance = 0.0
+    for i in xrange(rows):
+        if i and i % per_day == 0:
+            day -= timedelta(days=1)
+        amount = round(rand.uniform(-150, 100), 2)
+        balance += amount
+        description = "%s %d" % (rand.choice(KEYWORDS), rand.randint(1, 500))
+        statement.write("%s,DEB,'00-00-00,00000000,%s,%s,%s,%.2f\n" % (
+            day.strftime("%d/%m/%Y"), description,
+            "%.2f" % -amount if amount < 0 else "",
+            "%.2f" % amount if amount >= 0 else "", balance))
+    statement.seek(0)
+    return statement
+
+
+def is_throwaway(alias):
+    """
+    Tells whether a database is only meant for tests, so a benchmark can
+    write to it: Django's test databases and in-memory SQLite ones.
+    """
+    name = connections.databases[alias]["NAME"] or ""
+    return (name == ":memory:" or
+            os.path.basename(name).startswith(TEST_DATABASE_PREFIX))
+
+
+@contextmanager
+def use_database(alias):
+    """
+    Makes the given database the default one of this thread while it
+    lasts, so everything benchmarked uses it, transactions included.
+    """
+    default = connections[DEFAULT_DB_ALIAS]
+    connections[DEFAULT_DB_ALIAS] = connections[alias]
+    try:
+        yield
+    finally:
+        connections[DEFAULT_DB_ALIAS] = default
+
+
+class Benchmark(object):
+    """
+    Times every stage for a statement of a given size. The data is created
+    in a bank account, categories and user of its own, all of them removed
+    by cleanup, or when creating them fails.
+    """
+
+    def __init__(self, rows, rules=300, seed=0):
+        self.rows = rows
+        self.statement = generate_statement(rows, seed)
+        self.raw_rows = None
+        self.user = self.bank_account = None
+        self.created_user = False
+        self.categories = []
+        self.rules = []
+
+        rand = random.Random(seed)
+        try:
+            self.user, self.created_user = User.objects.get_or_create(
+                username="benchmark")
+            self.bank_account = BankAccount.objects.create(owner=self.user,
+                description="Benchmark", last_digits="0000",
+                entity="lloyds")
+            for keyword in KEYWORDS:
+                self.categories.append(MovementCategory.objects.create(
+                    name="Benchmark %s" % keyword))
+            for i in xrange(rules):
+                self.rules.append(CategorySuggestion.objects.create(
+                    expression="%s %d" % (rand.choice(KEYWORDS),
+                                          rand.randint(1, 500)),
+                    category=rand.choice(self.categories)))
+        except:
+            self.cleanup()
+            raise
+
+    def cleanup(self):
+        """
+        Removes everything the benchmark created. The movements, rollups
+        and suggestions go with their account and categories.
+        """
+        self.statement.close()
+        if self.bank_account is not None:
+            self.bank_account.delete()
+        for category in self.categories:
+            category.delete()
+        if self.created_user:
+            self.user.delete()
+
+    def timed(self, stage):
+        start = time.time()
+        stage()
+        return time.time() - start
+
+    def run(self):
+        self.statement.seek(0)
+        self.raw_rows = list(csv.reader(self.statement))[1:]
+
+        results = {}
+        for name in ("parse_row", "suggest", "parse_csv", "parse_columns",
+                     "import_movements", "aggregates"):
+            # Every stage starts with a cold suggestions matcher
+            CategorySuggestion.objects.invalidate()
+            self.statement.seek(0)
+            results[name] = self.timed(getattr(self, "stage_%s" % name))
+        return results
+
+    def stage_parse_row(self):
+        for row in self.raw_rows:
+            LloydsParser.parse_row(row)
+
+    def stage_suggest(self):
+        suggest = CategorySuggestion.objects.suggest
+        for row in self.raw_rows:
+            suggest(row[4])
+
+    def stage_parse_csv(self):
+        for chunk in iter_csv(self.statement, parser=LloydsParser,
+                              header_lines=1, reverse_order=True):
+            pass
+
+    def stage_parse_columns(self):
+        for chunk in iter_columns(self.statement, parser=LloydsParser,
+                                  header_lines=1, reverse_order=True):
+            pass
+
+    def stage_import_movements(self):
+        for chunk in iter_columns(self.statement, parser=LloydsParser,
+                                  header_lines=1, reverse_order=True):
+            import_movements(chunk, self.bank_account)
+
+    def stage_aggregates(self):
+        movements = Movement.objects.filter(bank_account=self.bank_account)
+        movements.summary()
+        movements.get_expenses().summary()
+        for month in range(1, 13):
+            movements.per_month(2012, month).summary()
+        for week in range(1, 53):
+            movements.per_week(2012, week).summary()
+
+
+def compare(results, baseline, margin):
+    """
+    Returns the stages of the results that are slower than in the baseline
+    by more than the given margin, as (size, stage, seconds, baseline).
+    """
+    regressions = []
+    for size, stages in sorted(results.items()):
+        for stage, seconds in sorted(stages.items()):
+            expected = baseline.get(size, {}).get(stage)
+            if expected is not None and seconds > expected * (1 + margin):
+                regressions.append((size, stage, seconds, expected))
+    return regressions
@@ -0,0 +1,148 @@
+"""
+Versions of the movements data, used in the cache keys of whatever is
+computed from the movements. Changing the movements bumps the versions, so
+the entries made before are no longer looked up and expire by themselves.
+
+There is a version for all the movements, used by the statistics, one per
+account and month, used by the rendered rows, and one for the categories,
+as every row shows all of them in its select. The category suggestions
+have their own version too, so every process knows when to compile them
+again.
+
+All of this needs a cache shared by every process, as the versions are
+bumped by the one changing the data. With a cache of each process, every
+version read is a new one and nothing depending on them is cached.
+"""
+import hashlib
+from itertools import count
+import time
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+
+from casterly.routers import reading_replica, pin_seconds
+
+
+VERSION_KEY = "money:movements:version"
+CATEGORIES_VERSION_KEY = "money:categories:version"
+SUGGESTIONS_VERSION_KEY = "money:suggestions:version"
+MONTH_VERSION_KEY = "money:movements:version:%s:%d-%02d"
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+ROWS_TIMEOUT = 60 * 60 * 24
+
+_local_versions = count()
+
+
+def shared_cache():
+    return not isinstance(cache, LocMemCache)
+
+
+def _versions(keys):
+    if not shared_cache():
+        # Another process may have changed anything in the meantime
+        version = next(_local_versions)
+        return dict((key, version) for key in keys)
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # Starting from the current time instead of from 1 keeps the
+        # entries of a version the cache lost from being taken as fresh
+        for key in missing:
+            cache.add(key, int(time.time() * 1000), VERSION_TIMEOUT)
+        versions.update(cache.get_many(missing))
+    return versions
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not there, so a new version will be started when it's needed
+        pass
+
+
+def cache_timeout(timeout=None):
+    """
+    Timeout for an entry computed from the movements. What is read from a
+    replica may be behind the version in its key, so it's only kept for as
+    long as the reads of whoever changed the data stay on the primary.
+    """
+    if timeout is None:
+        timeout = cache.default_timeout
+    if reading_replica():
+        return min(timeout, pin_seconds())
+    return timeout
+
+
+def movements_version():
+    return _versions([VERSION_KEY])[VERSION_KEY]
+
+
+def invalidate_movements(months=()):
+    """
+    Bumps the version of all the movements and the ones of the given
+    (bank account id, year, month) tuples.
+    """
+    _bump(VERSION_KEY)
+    for month in set(months):
+        _bump(MONTH_VERSION_KEY % month)
+
+
+def suggestions_version():
+    return _versions([SUGGESTIONS_VERSION_KEY])[SUGGESTIONS_VERSION_KEY]
+
+
+def invalidate_suggestions():
+    _bump(SUGGESTIONS_VERSION_KEY)
+
+
+def invalidate_categories():
+    _bump(CATEGORIES_VERSION_KEY)
+    _bump(VERSION_KEY)
+
+
+class RowBlock(object):
+    """
+    Consecutive movements of a list from the same account and month, which
+    are rendered and cached together. The key changes as soon as any of
+    the movements of that account and month does.
+    """
+
+    def __init__(self, month, movements):
+        self.month = month
+        self.movements = movements
+        self.key = None
+        self.html = None
+
+
+def row_blocks(movements):
+    """
+    Splits a list of movements into RowBlock, with their already rendered
+    HTML if it's in the cache. It takes two cache requests whatever the
+    number of blocks. Without a shared cache the blocks have no key, so
+    they are always rendered.
+    """
+    blocks = []
+    for movement in movements:
+        month = (movement.bank_account_id, movement.date.year,
+                 movement.date.month)
+        if not blocks or blocks[-1].month != month:
+            blocks.append(RowBlock(month, []))
+        blocks[-1].movements.append(movement)
+    if not blocks or not shared_cache():
+        return blocks
+
+    version_keys = [CATEGORIES_VERSION_KEY] + [
+        MONTH_VERSION_KEY % block.month for block in blocks]
+    versions = _versions(version_keys)
+    for block in blocks:
+        ids = ",".join(str(movement.pk) for movement in block.movements)
+        block.key = "money:rows:%s:%s:%s" % (
+            versions[CATEGORIES_VERSION_KEY],
+            versions[MONTH_VERSION_KEY % block.month],
+            hashlib.md5(ids).hexdigest())
+
+    rendered = cache.get_many([block.key for block in blocks])
+    for block in blocks:
+        block.html = rendered.get(block.key)
+    return blocks
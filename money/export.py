@@ -0,0 +1,97 @@
+"""
+Exports of whole movement histories as CSV or JSON Lines, generated chunk
+by chunk so they can be streamed whatever their size.
+"""
+import csv
+import cStringIO
+import json
+
+from django.db.models import Q
+from django.utils.encoding import smart_str
+
+from money.fields import Money
+from money.models import Movement
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+FIELDS = ("id", "bank_account", "date", "description", "category", "amount",
+          "current_balance")
+COLUMNS = ("id", "bank_account", "date", "description", "category__name",
+           "amount", "current_balance")
+
+
+def filter_movements(bank_accounts=None, date_from=None, date_to=None,
+                     categories=None):
+    movements = Movement.objects.all()
+    if bank_accounts:
+        movements = movements.filter(bank_account__in=bank_accounts)
+    if date_from is not None:
+        movements = movements.filter(date__gte=date_from)
+    if date_to is not None:
+        movements = movements.filter(date__lte=date_to)
+    if categories:
+        movements = movements.filter(category__in=categories)
+    return movements
+
+
+def iter_rows(movements, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the FIELDS of the movements as tuples, in (date, id) order.
+    They are read in chunks of keyset pages, as Movement.objects.page
+    does, so only one chunk is in memory at a time and every query costs
+    the same however far the export is. The amounts are Money.
+    """
+    movements = movements.order_by("date", "id").values_list(*COLUMNS)
+    chunk = list(movements[:chunk_size])
+    while chunk:
+        for (pk, bank_account_id, day, description, category, amount,
+                balance) in chunk:
+            yield (pk, bank_account_id, day, description, category,
+                   Money.from_pence(amount),
+                   None if balance is None else Money.from_pence(balance))
+        if len(chunk) < chunk_size:
+            break
+        day, pk = chunk[-1][2], chunk[-1][0]
+        chunk = list(movements.filter(
+            Q(date__gt=day) | Q(date=day, id__gt=pk))[:chunk_size])
+
+
+def export_csv(movements, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the movements as UTF-8 CSV, a string per chunk.
+    """
+    buf = cStringIO.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(FIELDS)
+    for i, row in enumerate(iter_rows(movements, chunk_size), 1):
+        writer.writerow([
+            "" if value is None else smart_str(value) for value in row])
+        if i % chunk_size == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def export_jsonl(movements, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the movements as JSON Lines, a string per chunk. The amounts
+    are written as strings, so they don't go through floats.
+    """
+    lines = []
+    for row in iter_rows(movements, chunk_size):
+        data = dict(zip(FIELDS, row))
+        data["date"] = data["date"].strftime("%Y-%m-%d")
+        lines.append(json.dumps(data, default=unicode))
+        if len(lines) == chunk_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+FORMATS = {
+    "csv": (export_csv, "text/csv; charset=utf-8"),
+    "jsonl": (export_jsonl, "application/x-ndjson"),
+}
@@ -1,22 +1,203 @@
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 
+from django import forms
 from django.db import models
+from django.db.models import signals
 
 
-class CurrencyField(models.DecimalField):
+class Money(object):
     """
-    Custom field for a proper working with currencies. Using Decimal is not
-    enough because it returns the value as a normal Python float, which
-    is problematic when doing a lot of operations.
+    Exact amount of money, kept as an integer number of pence. Adding up
+    amounts is plain integer arithmetic, so no rounding errors build up
+    however many of them are added.
+
+    Other values are converted with Money.coerce, which takes numbers and
+    strings as pounds. Stored values are converted with Money.from_pence.
     """
-    __metaclass__ = models.SubfieldBase
+    __slots__ = ("pence", )
 
-    def to_python(self, value):
+    def __init__(self, pence=0):
+        self.pence = pence
+
+    @classmethod
+    def from_pence(cls, pence):
+        # Sums are returned by PostgreSQL as Decimal
+        return cls(int(pence))
+
+    @classmethod
+    def coerce(cls, value):
+        if isinstance(value, Money):
+            return value
+        if isinstance(value, (int, long)):
+            return cls(value * 100)
+        if isinstance(value, float):
+            # repr gives the shortest string for the float, so 0.285 is
+            # rounded as 0.285 and not as 0.28499999999999998
+            value = repr(value)
+        pence = (Decimal(value) * 100).to_integral_value(ROUND_HALF_UP)
+        return cls(int(pence))
+
+    def __add__(self, other):
+        return Money(self.pence + Money.coerce(other).pence)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(self.pence - Money.coerce(other).pence)
+
+    def __rsub__(self, other):
+        return Money(Money.coerce(other).pence - self.pence)
+
+    def __mul__(self, factor):
+        return Money(int(round(self.pence * factor)))
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-self.pence)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Money(abs(self.pence))
+
+    def _compare(self, other):
         try:
-            return float(super(CurrencyField, self).to_python(
-                value).quantize(Decimal("0.01")))
-        except AttributeError:
+            return cmp(self.pence, Money.coerce(other).pence)
+        except Exception:
+            return NotImplemented
+
+    def __eq__(self, other):
+        result = self._compare(other)
+        return result is not NotImplemented and result == 0
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        result = self._compare(other)
+        return result if result is NotImplemented else result < 0
+
+    def __le__(self, other):
+        result = self._compare(other)
+        return result if result is NotImplemented else result <= 0
+
+    def __gt__(self, other):
+        result = self._compare(other)
+        return result if result is NotImplemented else result > 0
+
+    def __ge__(self, other):
+        result = self._compare(other)
+        return result if result is NotImplemented else result >= 0
+
+    def __hash__(self):
+        # The same as the numbers it's equal to
+        pounds, pence = divmod(self.pence, 100)
+        return hash(float(self)) if pence else hash(pounds)
+
+    def __nonzero__(self):
+        return self.pence != 0
+
+    def __float__(self):
+        return self.pence / 100.0
+
+    def __reduce__(self):
+        return (Money, (self.pence, ))
+
+    def __unicode__(self):
+        sign = u"-" if self.pence < 0 else u""
+        return u"%s%d.%02d" % ((sign, ) + divmod(abs(self.pence), 100))
+
+    def __str__(self):
+        return str(unicode(self))
+
+    def __repr__(self):
+        return "Money('%s')" % self
+
+
+class CurrencyDescriptor(object):
+    """
+    Attribute of a CurrencyField, which turns what's assigned to it into
+    Money. Model.__init__ is given pence when loading a row and pounds
+    otherwise, so the values it gets are converted on first use, once the
+    queryset has marked whether the instance comes from the database.
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            raise AttributeError('Can only be accessed via an instance.')
+        value = instance.__dict__[self.field.name]
+        if value is not None and value.__class__ is not Money:
+            if instance._state.adding:
+                value = self.field.to_python(value)
+            else:
+                value = Money.from_pence(value)
+            instance.__dict__[self.field.name] = value
+        return value
+
+    def __set__(self, instance, value):
+        if instance.__dict__.get("_currency_ready"):
+            value = self.field.to_python(value)
+        instance.__dict__[self.field.name] = value
+
+
+def currency_ready(sender, instance, **kwargs):
+    # Values assigned from now on are pounds
+    if getattr(sender, "_has_currency", False):
+        instance.__dict__["_currency_ready"] = True
+
+signals.post_init.connect(currency_ready)
+
+
+class CurrencyField(models.BigIntegerField):
+    """
+    Custom field for a proper working with currencies. The amounts are
+    stored as a whole number of pence and returned as Money, so loading
+    them is just wrapping an integer and adding them up is exact.
+    Assigned values are pounds, whether they're integers or not.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # The migrations from when it was a DecimalField still pass these
+        kwargs.pop('max_digits', None)
+        kwargs.pop('decimal_places', None)
+        super(CurrencyField, self).__init__(*args, **kwargs)
+
+    def contribute_to_class(self, cls, name):
+        super(CurrencyField, self).contribute_to_class(cls, name)
+        cls._has_currency = True
+        setattr(cls, self.name, CurrencyDescriptor(self))
+
+    def to_python(self, value):
+        if value is None or value.__class__ is Money:
+            return value
+        return Money.coerce(value)
+
+    def get_prep_value(self, value):
+        if value is None:
             return None
+        return Money.coerce(value).pence
+
+    def get_prep_lookup(self, lookup_type, value):
+        # IntegerField rounds float values up for some lookups, but here
+        # they are pounds to be converted
+        return models.Field.get_prep_lookup(self, lookup_type, value)
+
+    def value_to_string(self, obj):
+        value = self._get_val_from_obj(obj)
+        return None if value is None else unicode(value)
+
+    def formfield(self, **kwargs):
+        defaults = {
+            'form_class': forms.DecimalField,
+            'decimal_places': 2,
+        }
+        defaults.update(kwargs)
+        return models.Field.formfield(self, **defaults)
 
 
 # We need to give South some instructions about how to make
@@ -1,10 +1,10 @@
 from django import forms
 from django.conf import settings
+from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext as _
 
-from money.models import BankAccount, AVAILABLE_ENTITIES, MovementCategory, Movement
-from money.parser import parse_csv, import_movements
-from money.parser.banks import ENTITY_TO_PARSER
+from money.models import (BankAccount, AVAILABLE_ENTITIES, MovementCategory,
+                          Movement, ImportJob)
 
 
 class UploadCSVstatementForm(forms.Form):
@@ -18,29 +18,57 @@ class UploadCSVstatementForm(forms.Form):
         ]
 
     def save(self, *args, **kwargs):
+        """
+        Stores the statement and queues it for being imported by
+        the run_import_jobs command
+        """
         if self.is_valid():
-            parser = ENTITY_TO_PARSER[BankAccount.objects.get(
-                pk=self.cleaned_data['bank_account']).entity]
-            data = parse_csv(
-                self.cleaned_data["estatement"],
-                parser=parser,
-                header_lines=1,
-                reverse_order=True,
+            return ImportJob.objects.create(
+                bank_account_id=self.cleaned_data["bank_account"],
+                statement=self.cleaned_data["estatement"],
             )
 
-            bank_account = BankAccount.objects.get(
-                pk=self.cleaned_data["bank_account"])
-            import_movements(data, bank_account)
+
+class CategoryChoices(object):
+    """
+    Choices for the inline category select, loaded from the database and
+    rendered only once so all the rows of a list can share them.
+    """
+    def __init__(self):
+        widget = forms.Select()
+        self.choices = [(None, _("None"))] + [
+            (cat.id, cat) for cat in MovementCategory.objects.all()]
+        self.rendered = [
+            (force_unicode(value), label,
+             widget.render_option(set(), value, label))
+            for value, label in self.choices]
+
+
+class CategorySelect(forms.Select):
+    """
+    Select for the categories which reuses the options already rendered by
+    CategoryChoices, only rendering again the selected one.
+    """
+    def __init__(self, categories, attrs=None):
+        super(CategorySelect, self).__init__(attrs)
+        self.categories = categories
+
+    def render_options(self, choices, selected_choices):
+        selected_choices = set(force_unicode(v) for v in selected_choices)
+        return u'\n'.join([
+            self.render_option(selected_choices, value, label)
+            if value in selected_choices else rendered
+            for value, label, rendered in self.categories.rendered])
 
 
 class InlineCategoryForm(forms.ModelForm):
     movement = forms.IntegerField()
 
     def __init__(self, *args, **kwargs):
+        categories = kwargs.pop("categories", None) or CategoryChoices()
         super(InlineCategoryForm, self).__init__(*args, **kwargs)
         self.fields["movement"].widget = forms.widgets.HiddenInput()
-        categories = [(None, _("None"))] + [
-            (cat.id, cat) for cat in MovementCategory.objects.all()]
+        self.fields["category"].widget = CategorySelect(categories)
 
     class Meta:
         model = Movement
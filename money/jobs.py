@@ -0,0 +1,198 @@
+import csv
+from datetime import date, timedelta
+import logging
+import time
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.encoding import force_unicode
+
+from money.models import BankAccount, Movement, ImportJob
+from money.parser import (MovementColumns, iter_columns, import_movements,
+                          CSV_CHUNK_SIZE)
+from money.parser.banks import ENTITY_TO_PARSER
+from money.parser.formats import detect_parser
+
+
+# A running job whose worker hasn't reported any progress for this long is
+# taken as dead, as it would have at least finished a chunk otherwise
+JOB_TIMEOUT = 60 * 10
+ERROR_LENGTH = 200
+
+logger = logging.getLogger(__name__)
+
+
+def close_connection():
+    """
+    Database connections can't be shared with forked processes, so this
+    has to be called before creating a pool and as its initializer.
+    """
+    connection.close()
+
+
+def fail_stale_import_jobs(timeout=JOB_TIMEOUT):
+    """
+    Marks as failed the running jobs whose worker hasn't reported for the
+    given seconds, so they don't stay running forever when it dies.
+    Returns how many there were.
+    """
+    now = timezone.now()
+    return ImportJob.objects.filter(
+        Q(heartbeat__lt=now - timedelta(seconds=timeout)) |
+        Q(heartbeat=None), status=ImportJob.RUNNING).update(
+        status=ImportJob.FAILED, error=u"The import stopped responding",
+        finished=now)
+
+
+def claim_import_jobs(limit=None):
+    """
+    Marks pending jobs as running and returns their ids. A job is only
+    claimed by one worker even if several of them are polling at once.
+    The jobs of dead workers are failed first.
+    """
+    fail_stale_import_jobs()
+    pending = ImportJob.objects.filter(
+        status=ImportJob.PENDING).values_list("pk", flat=True)
+    if limit is not None:
+        pending = pending[:limit]
+
+    claimed = []
+    for pk in pending:
+        if ImportJob.objects.filter(pk=pk, status=ImportJob.PENDING).update(
+                status=ImportJob.RUNNING, heartbeat=timezone.now()):
+            claimed.append(pk)
+    return claimed
+
+
+def error_message(exception):
+    """
+    Short description of the error of a job, for showing it to the user.
+    The whole traceback goes to the log instead.
+    """
+    message = u"%s: %s" % (exception.__class__.__name__,
+                           force_unicode(exception, errors="replace"))
+    return message[:ERROR_LENGTH]
+
+
+@transaction.commit_on_success
+def repair_imported_balances(bank_account_id, since):
+    # Locking the account keeps other imports into it from running meanwhile
+    list(BankAccount.objects.select_for_update().filter(
+        pk=bank_account_id).values_list("pk"))
+    Movement.objects.repair_balances(bank_account_id, since)
+
+
+def run_import_job(job_id, chunk_size=CSV_CHUNK_SIZE):
+    """
+    Parses and imports the statement of a job. Every chunk is imported in
+    its own transaction and the job counters and heartbeat are updated
+    after it, so the progress can be followed while the job runs. The
+    balances are repaired once at the end, from the earliest date
+    imported, rather than after every chunk older than the ones before,
+    as all of them are for statements sorted newest first. The job is left
+    as it is if it stops running meanwhile, like when it's taken as dead
+    by fail_stale_import_jobs.
+    """
+    job = ImportJob.objects.select_related("bank_account").get(pk=job_id)
+    jobs = ImportJob.objects.filter(pk=job.pk)
+    running = jobs.filter(status=ImportJob.RUNNING)
+    if not jobs.filter(status__in=[ImportJob.PENDING, ImportJob.RUNNING]
+                       ).update(status=ImportJob.RUNNING,
+                                heartbeat=timezone.now()):
+        return job.status
+
+    status, error = ImportJob.DONE, u""
+    since = None
+    try:
+        job.statement.open("rb")
+        # OFX and QIF statements are told apart by their contents, CSV
+        # ones depend on the bank
+        parser = detect_parser(job.statement,
+                               ENTITY_TO_PARSER[job.bank_account.entity])
+        for chunk in iter_columns(job.statement, parser=parser,
+                header_lines=1, reverse_order=parser.NEWEST_FIRST,
+                chunk_size=chunk_size):
+            imported, rejected = import_movements(chunk, job.bank_account,
+                                                  repair=False)
+            if imported:
+                earliest = date.fromordinal(min(chunk.dates))
+                since = earliest if since is None else min(since, earliest)
+            if not running.update(
+                    rows_parsed=F("rows_parsed") + len(chunk),
+                    rows_imported=F("rows_imported") + imported,
+                    rows_rejected=F("rows_rejected") + len(rejected),
+                    heartbeat=timezone.now()):
+                return ImportJob.FAILED
+        if since is not None:
+            repair_imported_balances(job.bank_account.pk, since)
+    except Exception, exception:
+        logger.exception("Import job %d failed", job.pk)
+        status, error = ImportJob.FAILED, error_message(exception)
+    finally:
+        job.statement.close()
+
+    running.update(status=status, error=error, finished=timezone.now())
+    return status
+
+
+def statement_bank_account(path, header_lines=1):
+    """
+    Finds the bank account of a statement, matching the last digits of the
+    account number of its first movement. Returns None if there isn't
+    exactly one account with those digits, or if the statement doesn't
+    tell its account number, as QIF ones.
+    """
+    with open(path, "rb") as raw:
+        parser = detect_parser(raw, None)
+        if parser is None:
+            reader = csv.reader(raw, delimiter=',', quotechar='"')
+            numbers = (row[3] for row in reader
+                       if reader.line_num > header_lines and row)
+        else:
+            numbers = (row[3] for row in parser.read_rows(raw, header_lines))
+        for number in numbers:
+            if number:
+                accounts = BankAccount.objects.filter(
+                    last_digits=number.strip()[-4:])
+                if len(accounts) == 1:
+                    return accounts[0]
+            break
+    return None
+
+
+def parse_statement(path):
+    """
+    Parses a whole statement file, returning its path, the id of its bank
+    account, the rows and the seconds it took.
+    """
+    start = time.time()
+    bank_account = statement_bank_account(path)
+    rows = MovementColumns()
+    if bank_account is not None:
+        with open(path, "rb") as raw:
+            parser = detect_parser(raw,
+                                   ENTITY_TO_PARSER[bank_account.entity])
+            for chunk in iter_columns(raw, parser=parser, header_lines=1,
+                                      reverse_order=parser.NEWEST_FIRST):
+                rows.extend(chunk)
+    return (path, bank_account and bank_account.pk, rows,
+            time.time() - start)
+
+
+def import_statements(bank_account_id, statements):
+    """
+    Imports parsed statements of the same bank account one after another,
+    oldest first. Returns the path, imported and rejected rows and the
+    seconds it took for each of them. Empty statements have nothing to
+    import, so they're just reported.
+    """
+    bank_account = BankAccount.objects.get(pk=bank_account_id)
+    results = [(path, 0, 0, 0.0) for path, rows in statements if not rows]
+    for path, rows in sorted([statement for statement in statements
+                              if statement[1]],
+                             key=lambda (path, rows): min(rows.dates)):
+        start = time.time()
+        imported, rejected = import_movements(rows, bank_account)
+        results.append((path, imported, len(rejected), time.time() - start))
+    return results
@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from money.managers import SUGGESTIONS_CHUNK_SIZE
+from money.models import BankAccount, CategorySuggestion
+
+
+class Command(BaseCommand):
+    args = "[suggestion_id suggestion_id ...]"
+    help = ("Categorizes the uncategorized movements with the given category "
+            "suggestions, or with all of them")
+    option_list = BaseCommand.option_list + (
+        make_option('--account', type='int', action='append', default=[],
+            dest='accounts', help='Bank account to categorize the '
+            'movements of (can be given more than once)'),
+        make_option('--chunk-size', type='int',
+            default=SUGGESTIONS_CHUNK_SIZE,
+            help='Movements updated per transaction'),
+    )
+
+    def handle(self, *args, **options):
+        suggestions = CategorySuggestion.objects.select_related("category")
+        if args:
+            suggestions = suggestions.filter(pk__in=args)
+        bank_accounts = None
+        if options["accounts"]:
+            bank_accounts = BankAccount.objects.filter(
+                pk__in=options["accounts"])
+
+        total = 0
+        for suggestion, count in CategorySuggestion.objects.apply_to_movements(
+                suggestions, bank_accounts, options["chunk_size"]):
+            total += count
+            self.stdout.write("%s: %d movements\n" % (
+                unicode(suggestion).encode("utf-8"), count))
+        self.stdout.write("%d movements categorized\n" % total)
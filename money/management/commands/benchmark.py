@@ -0,0 +1,75 @@
+from optparse import make_option
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from money.benchmark import Benchmark, compare, is_throwaway, use_database
+
+
+class Command(BaseCommand):
+    help = ("Times parsing, category suggestion, import and aggregates with "
+            "generated statements, optionally checking them against a "
+            "baseline, like the ones in the benchmarks directory. Only test "
+            "databases are written to, unless forced")
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', default='1000',
+            help='Comma separated statement sizes, like 1000,100000,1000000'),
+        make_option('--rules', type='int', default=300,
+            help='Number of category suggestions'),
+        make_option('--output',
+            help='File for writing the results as JSON'),
+        make_option('--baseline',
+            help='JSON results of a previous run to compare with'),
+        make_option('--margin', type='float', default=0.25,
+            help='Allowed slowdown over the baseline, 0.25 meaning 25%%'),
+        make_option('--database', default=DEFAULT_DB_ALIAS,
+            help='Database to use, one whose name starts with "test_" or '
+                 'an in-memory SQLite one'),
+        make_option('--force', action='store_true', default=False,
+            help='Use the database even if it is not a test one'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("Sizes must be numbers")
+
+        using = options["database"]
+        if using not in connections.databases:
+            raise CommandError("Unknown database %s" % using)
+        if not is_throwaway(using) and not options["force"]:
+            raise CommandError("%s is not a test database, use --force for "
+                               "writing to it anyway" % using)
+
+        results = {}
+        with use_database(using):
+            for size in sizes:
+                benchmark = Benchmark(size, rules=options["rules"])
+                try:
+                    results[str(size)] = benchmark.run()
+                finally:
+                    benchmark.cleanup()
+                for stage, seconds in sorted(results[str(size)].items()):
+                    rate = size / seconds if seconds else 0
+                    self.stdout.write("%8d rows  %-18s %8.3fs  %10.0f rows/s\n"
+                                      % (size, stage, seconds, rate))
+
+        output = {"database": connections[using].vendor,
+                  "rules": options["rules"], "results": results}
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                json.dump(output, output_file, indent=2, sort_keys=True)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline_file:
+                baseline = json.load(baseline_file)["results"]
+            regressions = compare(results, baseline, options["margin"])
+            for size, stage, seconds, expected in regressions:
+                self.stderr.write(
+                    "%s rows %s: %.3fs, baseline %.3fs\n" % (
+                        size, stage, seconds, expected))
+            if regressions:
+                raise CommandError("%d stages slower than the baseline" %
+                                   len(regressions))
@@ -0,0 +1,130 @@
+from datetime import date, timedelta
+from optparse import make_option
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from money.models import BankAccount, Movement
+from money.parser import IMPORT_BATCH_SIZE
+
+
+DESCRIPTIONS = [
+    "SAINSBURY'S S/MKTS", "TESCO STORES", "TFL.GOV.UK", "AMAZON UK",
+    "SALARY", "RENT", "CASH MACHINE", "BOOTS", "PRET A MANGER", "NETFLIX",
+]
+
+
+class Command(BaseCommand):
+    help = ("Shows the query plans of the main movement queries, optionally "
+            "generating synthetic movements first. Everything is rolled back "
+            "at the end")
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=0,
+            help='Synthetic movements to create before explaining'),
+        make_option('--account', type='int', default=None,
+            help='Bank account to explain the queries for'),
+        make_option('--database', default=DEFAULT_DB_ALIAS,
+            help='Database to use'),
+    )
+
+    def handle(self, *args, **options):
+        if not options["rows"] and not options["account"]:
+            raise CommandError("Either --rows or --account is needed")
+        using = options["database"]
+        connection = connections[using]
+        # The synthetic movements are only there for the plans, so they're
+        # never committed. Python's sqlite3 commits before running anything
+        # like EXPLAIN, so there the transaction is begun by hand instead
+        with transaction.commit_manually(using=using):
+            connection.cursor()
+            if connection.vendor == "sqlite":
+                isolation_level = connection.connection.isolation_level
+                connection.connection.isolation_level = None
+                connection.cursor().execute("BEGIN")
+            try:
+                self.explain_all(options, using)
+            finally:
+                transaction.rollback(using=using)
+                if connection.vendor == "sqlite":
+                    connection.connection.isolation_level = isolation_level
+
+    def explain_all(self, options, using):
+        if options["rows"]:
+            bank_account = self.generate(options["rows"], using)
+        else:
+            bank_account = BankAccount.objects.using(using).get(
+                pk=options["account"])
+
+        movements = Movement.objects.using(using).filter(
+            bank_account=bank_account)
+        last = movements.order_by("-date", "-id")[0]
+        middle = last.date - timedelta(days=365)
+        # Movements made by hand, like the synthetic ones, have none
+        fingerprints = list(movements.exclude(fingerprint=None).values_list(
+            "fingerprint", flat=True)[:IMPORT_BATCH_SIZE]) or [""]
+        queries = [
+            ("Page of an account", movements.order_by("date", "id").filter(
+                date__gt=middle)[:101]),
+            ("Month of an account", movements.filter(
+                date__gte=middle.replace(day=1),
+                date__lte=middle.replace(day=28)).values_list("amount")),
+            ("Month of all the accounts", Movement.objects.using(using).filter(
+                date__gte=middle.replace(day=1),
+                date__lte=middle.replace(day=28)).values_list("amount")),
+            ("Import lookup", Movement.objects.using(using).filter(
+                fingerprint__in=fingerprints).values_list(
+                "fingerprint", flat=True).order_by()),
+        ]
+        for title, queryset in queries:
+            self.stdout.write("%s\n%s\n\n" % (
+                title, self.explain(queryset, using)))
+
+    def explain(self, queryset, using):
+        connection = connections[using]
+        sql, params = queryset.query.get_compiler(using).as_sql()
+        if connection.vendor == "sqlite":
+            sql = "EXPLAIN QUERY PLAN " + sql
+        else:
+            sql = "EXPLAIN ANALYZE " + sql
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        return "\n".join(
+            "  " + " ".join(unicode(column) for column in row)
+            for row in cursor.fetchall())
+
+    def generate(self, rows, using):
+        """
+        Creates a bank account with the given number of random movements,
+        spread over the last ten years. Only the movements are written, so
+        the account balance and the rollups aren't kept up to date.
+        """
+        user, _ = User.objects.using(using).get_or_create(
+            username="explain_movements")
+        bank_account = BankAccount.objects.using(using).create(
+            owner=user, description="Synthetic movements",
+            last_digits="0000")
+        per_day = max(1, rows / 3650)
+        day = date.today()
+        batch = []
+        for i in xrange(rows):
+            if i % per_day == 0:
+                day -= timedelta(days=1)
+            batch.append(Movement(
+                bank_account=bank_account,
+                description=random.choice(DESCRIPTIONS),
+                amount=round(random.uniform(-200, 100), 2),
+                date=day,
+            ))
+            if len(batch) == IMPORT_BATCH_SIZE:
+                Movement.objects.using(using).bulk_create(batch)
+                batch = []
+        Movement.objects.using(using).bulk_create(batch)
+
+        # The planner has to know about the new rows, which ANALYZE sees
+        # even before they are committed
+        connection = connections[using]
+        connection.cursor().execute("ANALYZE %s" % connection.ops.quote_name(
+            Movement._meta.db_table))
+        return bank_account
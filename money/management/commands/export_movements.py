@@ -0,0 +1,55 @@
+from datetime import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from casterly.routers import replica_reads
+from money.export import EXPORT_CHUNK_SIZE, FORMATS, filter_movements
+
+
+def _date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+
+class Command(BaseCommand):
+    help = ("Writes the movements, optionally only the ones of some accounts, "
+            "dates or categories, as CSV or JSON Lines")
+    option_list = BaseCommand.option_list + (
+        make_option('--format', default='csv', choices=sorted(FORMATS),
+            help='Output format: csv or jsonl'),
+        make_option('--account', type='int', action='append', default=[],
+            dest='accounts', help='Bank account to export the movements of '
+            '(can be given more than once)'),
+        make_option('--category', type='int', action='append', default=[],
+            dest='categories', help='Category to export the movements of '
+            '(can be given more than once)'),
+        make_option('--from', dest='date_from',
+            help='First date to export, as YYYY-MM-DD'),
+        make_option('--to', dest='date_to',
+            help='Last date to export, as YYYY-MM-DD'),
+        make_option('--output',
+            help='File to write into instead of the standard output'),
+        make_option('--chunk-size', type='int', default=EXPORT_CHUNK_SIZE,
+            help='Movements read per query'),
+    )
+
+    @replica_reads()
+    def handle(self, *args, **options):
+        try:
+            date_from = _date(options["date_from"])
+            date_to = _date(options["date_to"])
+        except ValueError:
+            raise CommandError("Dates must be given as YYYY-MM-DD")
+        movements = filter_movements(options["accounts"], date_from, date_to,
+                                     options["categories"])
+        export, content_type = FORMATS[options["format"]]
+
+        output = self.stdout
+        if options["output"]:
+            output = open(options["output"], "wb")
+        try:
+            for chunk in export(movements, options["chunk_size"]):
+                output.write(chunk)
+        finally:
+            if options["output"]:
+                output.close()
@@ -0,0 +1,82 @@
+import itertools
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from money.jobs import close_connection, parse_statement, import_statements
+
+
+# Files taken as statements, whose format is then told by their contents
+STATEMENT_EXTENSIONS = (".csv", ".ofx", ".qif")
+
+def _import_statements(item):
+    bank_account_id, statements = item
+    return import_statements(bank_account_id, statements)
+
+
+class Command(BaseCommand):
+    args = "<directory>"
+    help = ("Imports all the CSV, OFX and QIF statements of a directory, "
+            "finding the bank account of each one by its account number. "
+            "Files are parsed in parallel, and so are the imports of "
+            "different accounts.")
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', default=cpu_count(),
+            help='Number of worker processes, 1 for doing it all in this one'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or not os.path.isdir(args[0]):
+            raise CommandError("A directory with the statements is needed")
+        paths = sorted(
+            os.path.join(args[0], name) for name in os.listdir(args[0])
+            if name.lower().endswith(STATEMENT_EXTENSIONS))
+
+        start = time.time()
+        # A single process does everything itself, without forking
+        pool = None
+        imap, map_ = itertools.imap, map
+        if options["processes"] > 1:
+            close_connection()
+            pool = Pool(options["processes"], initializer=close_connection)
+            imap = pool.imap_unordered
+            map_ = lambda func, items: pool.map(func, items, 1)
+        try:
+            statements = {}
+            parse_times = {}
+            for path, bank_account_id, rows, seconds in imap(
+                    parse_statement, paths):
+                parse_times[path] = seconds
+                if bank_account_id is None:
+                    self.stderr.write("%s: unknown bank account\n" % path)
+                elif rows:
+                    statements.setdefault(bank_account_id, []).append(
+                        (path, rows))
+
+            # The statements of the same account are imported by the same
+            # process, so its movements are still imported in order
+            results = map_(_import_statements, statements.items())
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        total_rows = 0
+        for path, imported, rejected, seconds in sorted(
+                result for account_results in results
+                for result in account_results):
+            rows = imported + rejected
+            total_rows += rows
+            self.stdout.write(
+                "%s: %d imported, %d rejected, parsed in %.2fs, imported "
+                "in %.2fs (%.0f rows/s)\n" % (
+                    path, imported, rejected, parse_times[path], seconds,
+                    rows / seconds if seconds else 0))
+
+        elapsed = time.time() - start
+        self.stdout.write("%d rows from %d files in %.2fs (%.0f rows/s)\n" % (
+            total_rows, len(paths), elapsed,
+            total_rows / elapsed if elapsed else 0))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from money.models import BankAccount, MovementRollup
+
+
+class Command(BaseCommand):
+    args = "[bank_account_id bank_account_id ...]"
+    help = ("Recalculates the weekly and monthly rollups from the movements "
+            "of the given bank accounts, or of all of them")
+
+    @transaction.commit_on_success
+    def handle(self, *args, **options):
+        bank_accounts = None
+        if args:
+            bank_accounts = BankAccount.objects.filter(pk__in=args)
+        MovementRollup.objects.rebuild(bank_accounts)
+        self.stdout.write("%d rollups rebuilt\n" % (
+            MovementRollup.objects.count() if bank_accounts is None else
+            MovementRollup.objects.filter(
+                bank_account__in=bank_accounts).count()))
@@ -0,0 +1,44 @@
+from datetime import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from money.managers import BALANCES_CHUNK_SIZE
+from money.models import BankAccount, Movement
+
+
+class Command(BaseCommand):
+    args = "[bank_account_id bank_account_id ...]"
+    help = ("Recomputes the running balances of the movements of the given "
+            "bank accounts, or of all of them, optionally only from a date on")
+    option_list = BaseCommand.option_list + (
+        make_option('--since',
+            help='First date with wrong balances, as YYYY-MM-DD'),
+        make_option('--chunk-size', type='int', default=BALANCES_CHUNK_SIZE,
+            help='Movements read per query'),
+    )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            try:
+                since = datetime.strptime(options["since"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("The date must be given as YYYY-MM-DD")
+
+        bank_accounts = BankAccount.objects.order_by("pk")
+        if args:
+            bank_accounts = bank_accounts.filter(pk__in=args)
+        for pk in bank_accounts.values_list("pk", flat=True):
+            changed = self.repair(pk, since, options["chunk_size"])
+            self.stdout.write("Bank account %d: %d balances repaired\n" % (
+                pk, changed))
+
+    @transaction.commit_on_success
+    def repair(self, bank_account_id, since, chunk_size):
+        # Locking the account keeps imports into it from running meanwhile
+        list(BankAccount.objects.select_for_update().filter(
+            pk=bank_account_id).values_list("pk"))
+        return Movement.objects.repair_balances(bank_account_id, since,
+                                                chunk_size)
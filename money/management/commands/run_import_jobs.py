@@ -0,0 +1,42 @@
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand
+
+from money.jobs import claim_import_jobs, close_connection, run_import_job
+
+
+class Command(BaseCommand):
+    help = "Runs the pending statement imports using a pool of processes"
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', default=cpu_count(),
+            help='Number of worker processes'),
+        make_option('--interval', type='float', default=2.0,
+            help='Seconds to wait between checks for new jobs'),
+        make_option('--once', action='store_true', default=False,
+            help='Run the pending jobs and exit'),
+    )
+
+    def handle(self, *args, **options):
+        processes = options["processes"]
+        close_connection()
+        pool = Pool(processes, initializer=close_connection)
+        running = []
+        try:
+            while True:
+                running = [result for result in running if not result.ready()]
+                free = processes - len(running)
+                job_ids = claim_import_jobs(free) if free > 0 else []
+                close_connection()
+                for job_id in job_ids:
+                    self.stdout.write("Running import job %d\n" % job_id)
+                    running.append(
+                        pool.apply_async(run_import_job, (job_id, )))
+
+                if options["once"] and not job_ids and not running:
+                    break
+                time.sleep(options["interval"])
+        finally:
+            pool.close()
+            pool.join()
@@ -1,13 +1,155 @@
 from calendar import monthrange
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 import re
 
-from django.db import models
+from django.db import models, connections, transaction, IntegrityError
+from django.db.models import Count, F, Q, Sum
 from django.db.models.query import QuerySet
 from isoweek import Week
 
+from money.aggregates import ConditionalSum
+from money.caching import (invalidate_movements, invalidate_suggestions,
+                           suggestions_version)
+from money.fields import Money
+
+
+MOVEMENTS_PAGE_SIZE = 100
+CATEGORIES_CHUNK_SIZE = 500
+BALANCES_CHUNK_SIZE = 500
+SUGGESTIONS_CHUNK_SIZE = 1000
+
+# Backends matching the suggestion expressions in the database, which is
+# only right when it uses Python's re module, as Django does for SQLite.
+# PostgreSQL's regular expressions differ (\b is a backspace there, and the
+# classes and flags aren't the same), so for the rest the movements are
+# matched in Python and only the updates are done in the database
+REGEX_VENDORS = ("sqlite", )
+
+# Lookups that can be answered by the rollups, as they share these relations
+# with the movements
+ROLLUP_LOOKUPS = ("bank_account", "bank_account_id", "category", "category_id")
+
+# SQL for the first day of the week (ISO, starting on Monday), month or year
+# of a date column, per database vendor
+PERIOD_START_SQL = {
+    "postgresql": {
+        "week": "date_trunc('week', {date})::date",
+        "month": "date_trunc('month', {date})::date",
+        "year": "date_trunc('year', {date})::date",
+    },
+    "sqlite": {
+        "week": "date({date}, '-' || ((strftime('%%w', {date}) + 6) %% 7) "
+                "|| ' days')",
+        "month": "strftime('%%Y-%%m-01', {date})",
+        "year": "strftime('%%Y-01-01', {date})",
+    },
+    "mysql": {
+        "week": "DATE_SUB({date}, INTERVAL WEEKDAY({date}) DAY)",
+        "month": "DATE_FORMAT({date}, '%%Y-%%m-01')",
+        "year": "DATE_FORMAT({date}, '%%Y-01-01')",
+    },
+}
+
+
+def _currency(value):
+    # Sums of the pence columns
+    return Money.from_pence(value or 0)
+
+
+class BankAccountManager(models.Manager):
+
+    def add_to_balance(self, pk, amount):
+        """
+        Adds the amount to the current balance of the account in the
+        database, without reading it first, and returns the new balance.
+        It's meant to be used inside a transaction, as the row remains
+        locked until it finishes, so concurrent movements don't get lost.
+        """
+        connection = connections[self.db]
+        field = self.model._meta.get_field("current_balance")
+        amount = field.get_db_prep_save(amount, connection=connection)
+
+        if connection.vendor == "postgresql":
+            qn = connection.ops.quote_name
+            cursor = connection.cursor()
+            cursor.execute(
+                "UPDATE %(table)s SET %(column)s = %(column)s + %%s "
+                "WHERE %(pk)s = %%s RETURNING %(column)s" % {
+                    "table": qn(self.model._meta.db_table),
+                    "column": qn(field.column),
+                    "pk": qn(self.model._meta.pk.column),
+                }, [amount, pk])
+            balance = cursor.fetchone()[0]
+        else:
+            self.filter(pk=pk).update(
+                current_balance=F("current_balance") + amount)
+            balance = self.filter(pk=pk).values_list(
+                "current_balance", flat=True)[0]
+        return Money.from_pence(balance)
+
 
 class MovementQuerySet(QuerySet):
+    """
+    Besides the movement filters, the queryset keeps track of whether its
+    totals can be read from the rollups: that's the case while it's only
+    filtered by a period (per_month or per_week) and by account or category.
+    """
+
+    def __init__(self, model=None, query=None, using=None):
+        super(MovementQuerySet, self).__init__(model, query, using)
+        self._rollup = {} if query is None else None
+
+    def _keep_rollup(self, clone, **lookups):
+        if self._rollup is not None and not set(self._rollup) & set(lookups):
+            clone._rollup = dict(self._rollup, **lookups)
+        return clone
+
+    def all(self):
+        return self._keep_rollup(super(MovementQuerySet, self).all())
+
+    def order_by(self, *field_names):
+        return self._keep_rollup(
+            super(MovementQuerySet, self).order_by(*field_names))
+
+    def select_related(self, *fields, **kwargs):
+        return self._keep_rollup(
+            super(MovementQuerySet, self).select_related(*fields, **kwargs))
+
+    def using(self, alias):
+        return self._keep_rollup(super(MovementQuerySet, self).using(alias))
+
+    def filter(self, *args, **kwargs):
+        clone = super(MovementQuerySet, self).filter(*args, **kwargs)
+        if args or [key for key in kwargs
+                    if key.split("__")[0] not in ROLLUP_LOOKUPS]:
+            return clone
+        return self._keep_rollup(clone, **kwargs)
+
+    def _per_period(self, period, year, number, first_day, last_day):
+        clone = super(MovementQuerySet, self).filter(
+            date__gte=first_day, date__lte=last_day)
+        return self._keep_rollup(
+            clone, period=period, year=year, number=number)
+
+    def page(self, cursor=None, size=MOVEMENTS_PAGE_SIZE):
+        """
+        Keyset pagination over (date, id): returns the movements following
+        the (date, id) cursor and the cursor for the next page, or None if
+        this is the last one. Neither OFFSET nor COUNT are needed, so every
+        page costs the same no matter how deep into the history it is.
+        """
+        movements = self.order_by("date", "id")
+        if cursor is not None:
+            day, pk = cursor
+            movements = movements.filter(
+                Q(date__gt=day) | Q(date=day, id__gt=pk))
+        movements = list(movements[:size + 1])
+
+        next_cursor = None
+        if len(movements) > size:
+            movements = movements[:size]
+            next_cursor = (movements[-1].date, movements[-1].pk)
+        return movements, next_cursor
 
     def get_expenses(self):
         return self.filter(amount__lt=0.0)
@@ -17,25 +159,72 @@ class MovementQuerySet(QuerySet):
 
     def per_month(self, year, month):
         _, last_day = monthrange(year, month)
-        return self.filter(date__gte=date(year, month, 1),
-            date__lte=date(year, month, last_day))
+        return self._per_period("month", year, month,
+            date(year, month, 1), date(year, month, last_day))
 
     def per_week(self, year, week):
         monday = Week(year, week).monday()
         sunday = monday + timedelta(6)
-        return self.filter(date__gte=monday, date__lte=sunday)
+        return self._per_period("week", year, week, monday, sunday)
+
+    def summary(self):
+        """
+        Returns the expenses, earnings, balance and number of movements
+        of the queryset, all of them calculated by the database in a
+        single query. Amounts are returned as Money.
+        """
+        if self._rollup and "period" in self._rollup:
+            rollups = models.get_model("money", "MovementRollup").objects
+            return rollups.filter(**self._rollup).summary()
 
-    def _amount(self):
-        return float(sum([value[0] for value in self.values_list("amount")]))
+        result = self.order_by().aggregate(
+            expenses=ConditionalSum("amount", condition="< 0"),
+            earnings=ConditionalSum("amount", condition="> 0"),
+            balance=Sum("amount"),
+            count=Count("id"),
+        )
+        for key in ("expenses", "earnings", "balance"):
+            result[key] = _currency(result[key])
+        result["expenses"] = abs(result["expenses"])
+        return result
+
+    def period_totals(self, period):
+        """
+        Expenses, earnings and number of movements per category and per
+        week, month or year, grouped by the database in a single query.
+        Returns (first day of the period, category id, category name,
+        expenses, earnings, count) tuples.
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        period_start = PERIOD_START_SQL[connection.vendor][period].format(
+            date="%s.%s" % (qn(self.model._meta.db_table), qn("date")))
+
+        totals = []
+        for values in self.order_by().extra(
+                select={"period_start": period_start}).values(
+                "period_start", "category", "category__name").annotate(
+                expenses=ConditionalSum("amount", condition="< 0"),
+                earnings=ConditionalSum("amount", condition="> 0"),
+                count=Count("id")):
+            day = values["period_start"]
+            if isinstance(day, basestring):
+                day = datetime.strptime(day, "%Y-%m-%d").date()
+            elif isinstance(day, datetime):
+                day = day.date()
+            totals.append((day, values["category"], values["category__name"],
+                           abs(_currency(values["expenses"])),
+                           _currency(values["earnings"]), values["count"]))
+        return totals
 
     def expenses(self):
-        return abs(self.get_expenses()._amount())
+        return self.summary()["expenses"]
 
     def earnings(self):
-        return abs(self.get_earnings()._amount())
+        return self.summary()["earnings"]
 
     def balance(self):
-        return self.all()._amount()
+        return self.summary()["balance"]
 
 
 class MovementManager(models.Manager):
@@ -61,6 +250,131 @@ class MovementManager(models.Manager):
     def balance(self):
         return self.get_query_set().balance()
 
+    def summary(self):
+        return self.get_query_set().summary()
+
+    def period_totals(self, period):
+        return self.get_query_set().period_totals(period)
+
+    def set_categories(self, categories):
+        """
+        Changes the categories of many movements at once, given as a
+        dictionary of movement id to category id (or None). Only the
+        category is written, with an UPDATE per category, and the rollups
+        are fixed. Returns the result for every movement id: "updated",
+        "unchanged", "missing" for unknown movements or "invalid" for
+        unknown categories.
+        """
+        category_model = models.get_model("money", "MovementCategory")
+        rollup_model = models.get_model("money", "MovementRollup")
+        results = dict((pk, "missing") for pk in categories)
+        wanted = set(categories.values()) - set([None])
+        known = set(category_model.objects.filter(
+            pk__in=wanted).values_list("pk", flat=True)) if wanted else set()
+
+        changes, deltas, months = {}, {}, set()
+        ids = sorted(categories)
+        with transaction.commit_on_success(using=self.db):
+            for start in xrange(0, len(ids), CATEGORIES_CHUNK_SIZE):
+                rows = self.filter(
+                    pk__in=ids[start:start + CATEGORIES_CHUNK_SIZE]
+                ).select_for_update().values_list("pk", "bank_account",
+                    "category", "date", "amount")
+                for pk, bank_account_id, previous, day, amount in rows:
+                    category_id = categories[pk]
+                    if category_id is not None and category_id not in known:
+                        results[pk] = "invalid"
+                        continue
+                    if category_id == previous:
+                        results[pk] = "unchanged"
+                        continue
+                    results[pk] = "updated"
+                    changes.setdefault(category_id, []).append(pk)
+                    account_deltas = deltas.setdefault(bank_account_id, {})
+                    rollup_model.objects.collect(
+                        account_deltas, previous, day, int(amount), -1)
+                    rollup_model.objects.collect(
+                        account_deltas, category_id, day, int(amount))
+                    months.add((bank_account_id, day.year, day.month))
+
+            for category_id, pks in changes.items():
+                for start in xrange(0, len(pks), CATEGORIES_CHUNK_SIZE):
+                    self.filter(
+                        pk__in=pks[start:start + CATEGORIES_CHUNK_SIZE]
+                    ).update(category=category_id)
+            for bank_account_id, account_deltas in deltas.items():
+                rollup_model.objects.apply(bank_account_id, account_deltas)
+
+        if months:
+            # Updates don't send the save signals
+            invalidate_movements(months)
+        return results
+
+    def repair_balances(self, bank_account_id, since=None,
+                        chunk_size=BALANCES_CHUNK_SIZE):
+        """
+        Recomputes the running balances of the movements of an account
+        from the given date on, starting from the balance of the movement
+        just before it, or from the initial balance of the account. The
+        movements are read in keyset chunks and the changed balances are
+        fixed with an UPDATE per difference found in the chunk, so moving
+        all the later balances by the same amount, as a backdated movement
+        does, takes one per chunk. Returns how many movements changed.
+
+        It's meant to be used inside a transaction, with the account
+        locked.
+        """
+        account_model = models.get_model("money", "BankAccount")
+        movements = self.filter(bank_account=bank_account_id)
+        balance = None
+        if since is not None:
+            previous = movements.filter(date__lt=since).order_by(
+                "-date", "-id").values_list("current_balance", flat=True)[:1]
+            if previous and previous[0] is not None:
+                balance = int(previous[0])
+                movements = movements.filter(date__gte=since)
+        if balance is None:
+            balance = int(account_model.objects.filter(
+                pk=bank_account_id).values_list("initial_balance",
+                flat=True)[0])
+
+        rows = movements.order_by("date", "id").values_list(
+            "pk", "date", "amount", "current_balance")
+        changed = 0
+        months = set()
+        chunk = list(rows[:chunk_size])
+        while chunk:
+            differences, missing = {}, []
+            for pk, day, amount, current_balance in chunk:
+                balance += int(amount)
+                if current_balance is None:
+                    missing.append((pk, balance))
+                elif int(current_balance) != balance:
+                    differences.setdefault(
+                        balance - int(current_balance), []).append(pk)
+                else:
+                    continue
+                months.add((bank_account_id, day.year, day.month))
+                changed += 1
+
+            for difference, pks in differences.items():
+                self.filter(pk__in=pks).update(
+                    current_balance=F("current_balance") + difference)
+            for pk, current_balance in missing:
+                self.filter(pk=pk).update(
+                    current_balance=Money.from_pence(current_balance))
+
+            if len(chunk) < chunk_size:
+                break
+            day, pk = chunk[-1][1], chunk[-1][0]
+            chunk = list(rows.filter(
+                Q(date__gt=day) | Q(date=day, id__gt=pk))[:chunk_size])
+
+        if months:
+            # Updates don't send the save signals
+            invalidate_movements(months)
+        return changed
+
     def get_query_set(self):
         return MovementQuerySet(self.model)
 
@@ -68,11 +382,308 @@ class MovementManager(models.Manager):
         return getattr(self.get_query_set(), name)
 
 
-class SuggestionManager(models.Manager):
+class RollupQuerySet(QuerySet):
+
+    def summary(self):
+        """
+        Same as MovementQuerySet.summary, but adding up the rollups
+        """
+        result = self.order_by().aggregate(
+            expenses=Sum("expenses"),
+            earnings=Sum("earnings"),
+            count=Sum("count"),
+        )
+        for key in ("expenses", "earnings"):
+            result[key] = _currency(result[key])
+        result["balance"] = result["earnings"] - result["expenses"]
+        result["count"] = result["count"] or 0
+        return result
+
+
+class RollupManager(models.Manager):
+    """
+    Keeps the per week and per month totals of every account and
+    category up to date.
+    """
+
+    def get_query_set(self):
+        return RollupQuerySet(self.model)
+
+    def summary(self):
+        return self.get_query_set().summary()
+
+    @staticmethod
+    def periods(day):
+        iso_year, iso_week, _ = day.isocalendar()
+        return [("week", iso_year, iso_week), ("month", day.year, day.month)]
+
+    def collect(self, deltas, category_id, day, amount, count=1):
+        """
+        Adds a movement to a dictionary of pending changes, as accepted by
+        apply. A negative count takes the movement out of the totals. The
+        amount is Money, or pence as read with values_list, and the totals
+        are kept in pence.
+        """
+        if isinstance(amount, Money):
+            amount = amount.pence
+        expenses, earnings = (-amount, 0) if amount < 0 else (0, amount)
+        if count < 0:
+            expenses, earnings = -expenses, -earnings
+        for period in self.periods(day):
+            totals = deltas.setdefault((category_id, ) + period, [0, 0, 0])
+            totals[0] += expenses
+            totals[1] += earnings
+            totals[2] += count
+        return deltas
+
+    def add(self, bank_account_id, category_id, day, amount, count=1):
+        self.apply(bank_account_id,
+            self.collect({}, category_id, day, amount, count))
+
+    def apply(self, bank_account_id, deltas):
+        """
+        Applies the pending changes to the rollups of an account. The
+        deltas are a dictionary with (category_id, period, year, number)
+        as key and [expenses, earnings, count] as value, with the amounts
+        in pence.
+        """
+        for (category_id, period, year, number), totals in deltas.items():
+            expenses, earnings, count = totals
+            rollups = self.filter(bank_account=bank_account_id,
+                category=category_id, period=period, year=year,
+                number=number)
+            if rollups.update(expenses=F("expenses") + expenses,
+                              earnings=F("earnings") + earnings,
+                              count=F("count") + count):
+                continue
+
+            sid = transaction.savepoint(using=self.db)
+            try:
+                self.create(bank_account_id=bank_account_id,
+                    category_id=category_id, period=period, year=year,
+                        number=number, expenses=Money.from_pence(expenses),
+                    earnings=Money.from_pence(earnings), count=count)
+                transaction.savepoint_commit(sid, using=self.db)
+            except IntegrityError:
+                # Someone else created it in the meantime
+                transaction.savepoint_rollback(sid, using=self.db)
+                rollups.update(expenses=F("expenses") + expenses,
+                               earnings=F("earnings") + earnings,
+                               count=F("count") + count)
+
+    def rebuild(self, bank_accounts=None):
+        """
+        Recalculates the rollups from the movements, for the given bank
+        accounts or for all of them.
+        """
+        movements = models.get_model("money", "Movement").objects.all()
+        rollups = self.all()
+        if bank_accounts is not None:
+            movements = movements.filter(bank_account__in=bank_accounts)
+            rollups = rollups.filter(bank_account__in=bank_accounts)
+        rollups.delete()
+
+        deltas = {}
+        for values in movements.order_by().values(
+                "bank_account", "category", "date").annotate(
+                expenses=ConditionalSum("amount", condition="< 0"),
+                earnings=ConditionalSum("amount", condition="> 0"),
+                count=Count("id")):
+            account_deltas = deltas.setdefault(values["bank_account"], {})
+            self.collect(account_deltas, values["category"], values["date"],
+                int(values["expenses"] or 0), values["count"])
+            self.collect(account_deltas, values["category"], values["date"],
+                int(values["earnings"] or 0), 0)
+
+        self.bulk_create([
+            self.model(bank_account_id=bank_account_id,
+                category_id=category_id, period=period, year=year,
+                number=number, expenses=Money.from_pence(expenses),
+                earnings=Money.from_pence(earnings), count=count)
+            for bank_account_id, account_deltas in deltas.items()
+            for (category_id, period, year, number), (
+                expenses, earnings, count) in account_deltas.items()
+        ])
+
+
+class SuggestionMatcher(object):
+    """
+    Compiled form of a set of category suggestions, tried in order: the
+    first one whose expression is found in a description wins. The
+    expressions are combined into as few patterns as possible, with an
+    alternative per suggestion that looks for it from the start of the
+    description, so the alternatives are tried in the order of the
+    suggestions and the named group after the one that matched tells which
+    it was. Expressions with flags or references to their own groups only
+    make sense on their own, so they get a pattern of their own. The
+    category found for every description is remembered, as statements
+    repeat the same ones a lot.
+    """
+    MAX_MEMO = 10000
+    # Python can't compile patterns with more groups than this
+    MAX_GROUPS = 99
+    ALONE = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?\(")
+
+    def __init__(self, suggestions, version=None):
+        self.version = version
+        self.patterns = []
+        alternatives, categories, groups = [], {}, 0
+        for i, obj in enumerate(suggestions):
+            pattern = re.compile(obj.expression)
+            if pattern.flags or self.ALONE.search(obj.expression):
+                self._combine(alternatives, categories)
+                alternatives, categories, groups = [], {}, 0
+                self.patterns.append((pattern, {None: obj.category}))
+                continue
+            if groups + pattern.groups + 1 > self.MAX_GROUPS:
+                self._combine(alternatives, categories)
+                alternatives, categories, groups = [], {}, 0
+            name = "s%d" % i
+            alternatives.append(
+                r"(?=[\s\S]*?(?:%s))(?P<%s>)" % (obj.expression, name))
+            categories[name] = obj.category
+            groups += pattern.groups + 1
+        self._combine(alternatives, categories)
+        self.memo = {}
+
+    def _combine(self, alternatives, categories):
+        if alternatives:
+            self.patterns.append(
+                (re.compile("|".join(alternatives)), categories))
 
     def suggest(self, suggested):
-        for obj in self.all():
-            expression = ".*%s.*" % obj.expression
-            if re.match(expression, suggested):
-                return obj.category
-        return None
+        try:
+            return self.memo[suggested]
+        except KeyError:
+            pass
+
+        category = None
+        for pattern, categories in self.patterns:
+            if len(categories) == 1 and None in categories:
+                if pattern.search(suggested):
+                    category = categories[None]
+                    break
+            else:
+                match = pattern.match(suggested)
+                if match:
+                    category = categories[match.lastgroup]
+                    break
+
+        if len(self.memo) >= self.MAX_MEMO:
+            self.memo.clear()
+        self.memo[suggested] = category
+        return category
+
+
+class SuggestionManager(models.Manager):
+    _matcher = None
+
+    def matcher(self, refresh=True):
+        """
+        Returns the compiled matcher for all the suggestions. It's kept by
+        the process until the version of the suggestions in the cache
+        changes, so the changes made by any process reach all of them.
+        The version is only read when refreshing, so the parsers do it once
+        per batch of rows instead of for every row.
+        """
+        matcher = SuggestionManager._matcher
+        if matcher is not None and not refresh:
+            return matcher
+        version = suggestions_version()
+        if matcher is None or matcher.version != version:
+            matcher = SuggestionMatcher(
+                self.select_related("category").order_by("pk"), version)
+            SuggestionManager._matcher = matcher
+        return matcher
+
+    def invalidate(self):
+        SuggestionManager._matcher = None
+        invalidate_suggestions()
+
+    def suggest(self, suggested, refresh=True):
+        return self.matcher(refresh).suggest(suggested)
+
+    def suggest_many(self, descriptions):
+        """
+        Suggests the categories of a list of descriptions, in the same
+        order.
+        """
+        return map(self.matcher().suggest, descriptions)
+
+    def apply_to_movements(self, suggestions=None, bank_accounts=None,
+                           chunk_size=SUGGESTIONS_CHUNK_SIZE):
+        """
+        Categorizes the existing uncategorized movements with the given
+        suggestions, or with all of them, the first one that matches
+        winning as when importing. The movements are updated in chunks,
+        with an UPDATE per suggestion and chunk, and their rollups fixed.
+        Returns a list of (suggestion, categorized movements).
+        """
+        movement_model = models.get_model("money", "Movement")
+        rollup_model = models.get_model("money", "MovementRollup")
+        if suggestions is None:
+            suggestions = self.all()
+        suggestions = list(suggestions.order_by("pk"))
+        counts = [0] * len(suggestions)
+
+        movements = movement_model.objects.using(self.db).filter(
+            category__isnull=True)
+        if bank_accounts is not None:
+            movements = movements.filter(bank_account__in=bank_accounts)
+        in_database = connections[self.db].vendor in REGEX_VENDORS
+        patterns = [re.compile(suggestion.expression)
+                    for suggestion in suggestions]
+
+        months = set()
+        last_pk = 0
+        while suggestions:
+            with transaction.commit_on_success(using=self.db):
+                rows = list(movements.filter(pk__gt=last_pk).order_by(
+                    "pk").select_for_update().values_list("pk",
+                    "bank_account", "date", "amount", "description")[
+                    :chunk_size])
+                if not rows:
+                    break
+                chunk = movements.filter(pk__range=(rows[0][0], rows[-1][0]))
+                last_pk = rows[-1][0]
+
+                if in_database:
+                    for i, suggestion in enumerate(suggestions):
+                        counts[i] += chunk.filter(
+                            description__regex=suggestion.expression).update(
+                            category=suggestion.category_id)
+                else:
+                    matched = {}
+                    for pk, _, _, _, description in rows:
+                        for i, pattern in enumerate(patterns):
+                            if pattern.search(description):
+                                matched.setdefault(i, []).append(pk)
+                                break
+                    for i, pks in sorted(matched.items()):
+                        counts[i] += chunk.filter(pk__in=pks).update(
+                            category=suggestions[i].category_id)
+
+                # The rows are locked, so whatever has a category now got
+                # it from the suggestions
+                categories = dict(movement_model.objects.using(
+                    self.db).filter(pk__range=(rows[0][0], last_pk)).exclude(
+                    category=None).values_list("pk", "category"))
+                deltas = {}
+                for pk, bank_account_id, day, amount, _ in rows:
+                    category_id = categories.get(pk)
+                    if category_id is None:
+                        continue
+                    account_deltas = deltas.setdefault(bank_account_id, {})
+                    rollup_model.objects.collect(
+                        account_deltas, None, day, int(amount), -1)
+                    rollup_model.objects.collect(
+                        account_deltas, category_id, day, int(amount))
+                    months.add((bank_account_id, day.year, day.month))
+                for bank_account_id, account_deltas in deltas.items():
+                    rollup_model.objects.db_manager(self.db).apply(
+                        bank_account_id, account_deltas)
+
+        if months:
+            # Updates don't send the save signals
+            invalidate_movements(months)
+        return zip(suggestions, counts)
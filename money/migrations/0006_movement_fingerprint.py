@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+from django.utils.encoding import smart_str
+
+
+UNIQUE_INDEX = 'money_movement_fingerprint_uniq'
+
+
+def fingerprint(bank_account_id, day, amount, description, balance):
+    # Same as money.parser.movement_fingerprint when this was written
+    return hashlib.sha1("%d|%d|%d|%s|%s" % (
+        bank_account_id, day.toordinal(), amount, smart_str(description),
+        "" if balance is None else balance)).hexdigest()
+
+
+class Migration(SchemaMigration):
+    """
+    Adds the fingerprints of the imported rows, replacing the index used
+    for looking up the already imported movements by a unique one on them.
+    Existing movements get theirs computed, except for repeated ones, which
+    only the first of them gets.
+    """
+
+    def forwards(self, orm):
+        # Adding field 'Movement.fingerprint'
+        db.add_column('money_movement', 'fingerprint',
+                      self.gf('django.db.models.fields.CharField')(max_length=40, null=True, blank=True),
+                      keep_default=False)
+
+        if not db.dry_run:
+            seen = set()
+            for pk, bank_account_id, day, amount, description, balance in \
+                    orm['money.Movement'].objects.order_by('pk').values_list(
+                    'pk', 'bank_account', 'date', 'amount', 'description',
+                    'current_balance').iterator():
+                value = fingerprint(bank_account_id, day, int(amount),
+                                    description, balance)
+                if value in seen:
+                    continue
+                seen.add(value)
+                orm['money.Movement'].objects.filter(pk=pk).update(
+                    fingerprint=value)
+
+        db.execute('CREATE UNIQUE INDEX %s ON %s (%s)' % (
+            db.quote_name(UNIQUE_INDEX), db.quote_name('money_movement'),
+            db.quote_name('fingerprint')))
+
+        if db.backend_name == 'sqlite3':
+            self.restore_indexes(lookup_index=False)
+        else:
+            # Removing index on 'Movement', fields ['bank_account', 'date', 'amount', 'description']
+            db.delete_index('money_movement', ['bank_account_id', 'date', 'amount', 'description'])
+
+    def backwards(self, orm):
+        # Deleting field 'Movement.fingerprint', along with its index
+        db.delete_column('money_movement', 'fingerprint')
+
+        if db.backend_name == 'sqlite3':
+            self.restore_indexes(lookup_index=True)
+        else:
+            # Adding index on 'Movement', fields ['bank_account', 'date', 'amount', 'description']
+            db.create_index('money_movement', ['bank_account_id', 'date', 'amount', 'description'])
+
+    def restore_indexes(self, lookup_index):
+        # SQLite can't add or drop columns here, so South copies the whole
+        # table into a new one, leaving the indexes behind
+        db.create_index('money_movement', ['bank_account_id'])
+        db.create_index('money_movement', ['category_id'])
+        db.create_index('money_movement', ['bank_account_id', 'date', 'id'])
+        db.create_index('money_movement', ['date', 'id'])
+        if lookup_index:
+            db.create_index('money_movement', ['bank_account_id', 'date', 'amount', 'description'])
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'money.bankaccount': {
+            'Meta': {'object_name': 'BankAccount'},
+            'current_balance': ('money.fields.CurrencyField', [], {'default': '0.0'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'entity': ('django.db.models.fields.CharField', [], {'default': '(\'lloyds\', "Lloyd\'s")', 'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'initial_balance': ('money.fields.CurrencyField', [], {'default': '0.0'}),
+            'last_digits': ('django.db.models.fields.CharField', [], {'max_length': '4'}),
+            'owner': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'bank_accounts'", 'to': "orm['auth.User']"})
+        },
+        'money.categorysuggestion': {
+            'Meta': {'object_name': 'CategorySuggestion'},
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['money.MovementCategory']"}),
+            'expression': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'money.importjob': {
+            'Meta': {'ordering': "('created',)", 'object_name': 'ImportJob'},
+            'bank_account': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'import_jobs'", 'to': "orm['money.BankAccount']"}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'rows_imported': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'rows_parsed': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'rows_rejected': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'statement': ('django.db.models.fields.files.FileField', [], {'max_length': '100'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'pending'", 'max_length': '10'})
+        },
+        'money.movement': {
+            'Meta': {'ordering': "('date',)", 'object_name': 'Movement'},
+            'amount': ('money.fields.CurrencyField', [], {}),
+            'bank_account': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'movements'", 'to': "orm['money.BankAccount']"}),
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'movements'", 'null': 'True', 'to': "orm['money.MovementCategory']"}),
+            'current_balance': ('money.fields.CurrencyField', [], {'null': 'True', 'blank': 'True'}),
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'fingerprint': ('django.db.models.fields.CharField', [], {'max_length': '40', 'unique': 'True', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'money.movementcategory': {
+            'Meta': {'object_name': 'MovementCategory'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        'money.movementrollup': {
+            'Meta': {'unique_together': "(('bank_account', 'category', 'period', 'year', 'number'),)", 'object_name': 'MovementRollup'},
+            'bank_account': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'rollups'", 'to': "orm['money.BankAccount']"}),
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'rollups'", 'null': 'True', 'to': "orm['money.MovementCategory']"}),
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'earnings': ('money.fields.CurrencyField', [], {'default': '0.0'}),
+            'expenses': ('money.fields.CurrencyField', [], {'default': '0.0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'number': ('django.db.models.fields.PositiveSmallIntegerField', [], {}),
+            'period': ('django.db.models.fields.CharField', [], {'max_length': '5'}),
+            'year': ('django.db.models.fields.PositiveSmallIntegerField', [], {})
+        }
+    }
+
+    complete_apps = ['money']
\ No newline at end of file
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+from money.fields import Money
+
+
+UNCATEGORIZED_INDEX = 'money_movementrollup_uncategorized_uniq'
+
+
+# Rows per INSERT, below the number of parameters SQLite takes
+INSERT_BATCH = 100
+
+
+def rebuild_rollups(orm, bank_accounts=None):
+    """
+    Recalculates the rollups from the movements, for the given bank
+    accounts or for all of them, as MovementRollup.objects.rebuild does
+    with the models of the time of the migration.
+    """
+    movements = orm['money.Movement'].objects.all()
+    rollups = orm['money.MovementRollup'].objects.all()
+    if bank_accounts is not None:
+        movements = movements.filter(bank_account__in=bank_accounts)
+        rollups = rollups.filter(bank_account__in=bank_accounts)
+    rollups.delete()
+
+    totals = {}
+    for bank_account_id, category_id, day, amount in movements.order_by(
+            ).values_list('bank_account', 'category', 'date',
+                          'amount').iterator():
+        iso_year, iso_week = day.isocalendar()[:2]
+        for period in (('week', iso_year, iso_week),
+                       ('month', day.year, day.month)):
+            row = totals.setdefault(
+                (bank_account_id, category_id) + period, [0, 0, 0])
+            row[0 if amount < 0 else 1] += abs(amount)
+            row[2] += 1
+
+    rows = [
+        orm['money.MovementRollup'](bank_account_id=bank_account_id,
+            category_id=category_id, period=period, year=year,
+            number=number, expenses=Money.from_pence(expenses),
+            earnings=Money.from_pence(earnings), count=count)
+        for (bank_account_id, category_id, period, year, number), (
+            expenses, earnings, count) in totals.items()
+    ]
+    for i in range(0, len(rows), INSERT_BATCH):
+        orm['money.MovementRollup'].objects.bulk_create(
+            rows[i:i + INSERT_BATCH])
+
+
+class Migration(SchemaMigration):
+    """
+    Makes the rollups of the uncategorized movements unique too. The
+    unique constraint on the rollups doesn't cover them, as their category
+    is NULL, so two movements creating the same rollup at once could end up
+    with two rows. MySQL has no partial indexes, so it's left out.
+    """
+
+    def forwards(self, orm):
+        if db.backend_name not in ('postgres', 'sqlite3'):
+            return
+        if not db.dry_run:
+            self.merge_duplicates(orm)
+        db.execute(
+            'CREATE UNIQUE INDEX %s ON %s (%s, %s, %s, %s) '
+            'WHERE %s IS NULL' % (
+                db.quote_name(UNCATEGORIZED_INDEX),
+                db.quote_name('money_movementrollup'),
+                db.quote_name('bank_account_id'), db.quote_name('period'),
+                db.quote_name('year'), db.quote_name('number'),
+                db.quote_name('category_id')))
+
+    def backwards(self, orm):
+        if db.backend_name not in ('postgres', 'sqlite3'):
+            return
+        db.execute('DROP INDEX %s' % db.quote_name(UNCATEGORIZED_INDEX))
+
+    def merge_duplicates(self, orm):
+        # Every update after the copies were made went to all of them, so
+        # their right totals can't be told from the rows themselves. The
+        # rollups of the affected accounts are rebuilt from the movements
+        accounts = orm['money.MovementRollup'].objects.filter(
+            category__isnull=True).values(
+            'bank_account', 'period', 'year', 'number').annotate(
+            rows=models.Count('id')).filter(rows__gt=1).values_list(
+            'bank_account', flat=True)
+        accounts = sorted(set(accounts))
+        if accounts:
+            rebuild_rollups(orm, accounts)
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'money.bankaccount': {
+            'Meta': {'object_name': 'BankAccount'},
+            'current_balance': ('money.fields.CurrencyField', [], {'default': '0.0'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'entity': ('django.db.models.fields.CharField', [], {'default': '(\'lloyds\', "Lloyd\'s")', 'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'initial_balance': ('money.fields.CurrencyField', [], {'default': '0.0'}),
+            'last_digits': ('django.db.models.fields.CharField', [], {'max_length': '4'}),
+            'owner': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'bank_accounts'", 'to': "orm['auth.User']"})
+        },
+        'money.categorysuggestion': {
+            'Meta': {'object_name': 'CategorySuggestion'},
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['money.MovementCategory']"}),
+            'expression': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'money.importjob': {
+            'Meta': {'ordering': "('created',)", 'object_name': 'ImportJob'},
+            'bank_account': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'import_jobs'", 'to': "orm['money.BankAccount']"}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'rows_imported': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'rows_parsed': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'rows_rejected': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'statement': ('django.db.models.fields.files.FileField', [], {'max_length': '100'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'pending'", 'max_length': '10'})
+        },
+        'money.movement': {
+            'Meta': {'ordering': "('date',)", 'object_name': 'Movement'},
+            'amount': ('money.fields.CurrencyField', [], {}),
+            'bank_account': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'movements'", 'to': "orm['money.BankAccount']"}),
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'movements'", 'null': 'True', 'to': "orm['money.MovementCategory']"}),
+            'current_balance': ('money.fields.CurrencyField', [], {'null': 'True', 'blank': 'True'}),
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'fingerprint': ('django.db.models.fields.CharField', [], {'max_length': '40', 'unique': 'True', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'money.movementcategory': {
+            'Meta': {'object_name': 'MovementCategory'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        'money.movementrollup': {
+            'Meta': {'unique_together': "(('bank_account', 'category', 'period', 'year', 'number'),)", 'object_name': 'MovementRollup'},
+            'bank_account': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'rollups'", 'to': "orm['money.BankAccount']"}),
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'rollups'", 'null': 'True', 'to': "orm['money.MovementCategory']"}),
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'earnings': ('money.fields.CurrencyField', [], {'default': '0.0'}),
+            'expenses': ('money.fields.CurrencyField', [], {'default': '0.0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'number': ('django.db.models.fields.PositiveSmallIntegerField', [], {}),
+            'period': ('django.db.models.fields.CharField', [], {'max_length': '5'}),
+            'year': ('django.db.models.fields.PositiveSmallIntegerField', [], {})
+        }
+    }
+
+    complete_apps = ['money']
\ No newline at end of file
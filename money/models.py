@@ -1,11 +1,13 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, router, transaction
 from django.db.models import signals
 from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
-from money.fields import CurrencyField
-from money.managers import MovementManager, SuggestionManager
+from money.caching import invalidate_movements, invalidate_categories
+from money.fields import CurrencyField, Money
+from money.managers import (BankAccountManager, MovementManager,
+                            RollupManager, SuggestionManager)
 
 
 AVAILABLE_ENTITIES = [
@@ -46,17 +48,15 @@ class BankAccount(models.Model):
     )
     initial_balance = CurrencyField(
         verbose_name=_(u'Initial balance'),
-        decimal_places=2,
-        max_digits=7,
         default=0.0,
     )
     current_balance = CurrencyField(
         verbose_name=_(u'Current balance'),
-        decimal_places=2,
-        max_digits=7,
         default=0.0,
     )
 
+    objects = BankAccountManager()
+
     class Meta:
         verbose_name = _(u'Bank Account')
         verbose_name_plural = _(u'Bank Accounts')
@@ -115,19 +115,25 @@ class Movement(models.Model):
     )
     amount = CurrencyField(
         verbose_name=_(u'Amount'),
-        decimal_places=2,
-        max_digits=7,
     )
     current_balance = CurrencyField(
         verbose_name=_(u'Current balance'),
-        decimal_places=2,
-        max_digits=7,
         blank=True,
         null=True,
     )
     date = models.DateField(
         verbose_name=_(u'Date'),
     )
+    fingerprint = models.CharField(
+        verbose_name=_(u'Fingerprint'),
+        help_text=_(u'Hash of the statement row the movement was '
+                    u'imported from'),
+        max_length=40,
+        unique=True,
+        blank=True,
+        null=True,
+        editable=False,
+    )
 
     objects = MovementManager()
 
@@ -136,6 +142,17 @@ class Movement(models.Model):
         verbose_name_plural = _(u'Movements')
         ordering = ('date', )
 
+    def save(self, *args, **kwargs):
+        # The account balance is updated by prepare_movement before the
+        # insert, so without a transaction around them a failed insert
+        # would leave the balance changed
+        using = kwargs.get("using") or router.db_for_write(
+            Movement, instance=self)
+        if transaction.is_managed(using=using):
+            return super(Movement, self).save(*args, **kwargs)
+        with transaction.commit_on_success(using=using):
+            return super(Movement, self).save(*args, **kwargs)
+
     def delete(self, *args, **kwargs):
         raise InvalidOperationError("Delete not allowed for this model")
 
@@ -147,6 +164,69 @@ class Movement(models.Model):
         )
 
 
+class MovementRollup(models.Model):
+    """
+    Totals of the movements of an account in a category for a given week
+    or month, so period statistics don't need to go through the movements.
+    Weeks are ISO weeks, so the year is the ISO year for them.
+    """
+    PERIODS = [
+        ('week', _(u'Week')),
+        ('month', _(u'Month')),
+    ]
+
+    bank_account = models.ForeignKey(
+        BankAccount,
+        verbose_name=_(u'Bank account'),
+        related_name='rollups',
+    )
+    category = models.ForeignKey(
+        MovementCategory,
+        verbose_name=_(u'Category'),
+        blank=True,
+        null=True,
+        related_name='rollups',
+    )
+    period = models.CharField(
+        verbose_name=_(u'Period'),
+        max_length=5,
+        choices=PERIODS,
+    )
+    year = models.PositiveSmallIntegerField(
+        verbose_name=_(u'Year'),
+    )
+    number = models.PositiveSmallIntegerField(
+        verbose_name=_(u'Number'),
+        help_text=_(u'Number of the week or the month inside the year'),
+    )
+    expenses = CurrencyField(
+        verbose_name=_(u'Expenses'),
+        default=0.0,
+    )
+    earnings = CurrencyField(
+        verbose_name=_(u'Earnings'),
+        default=0.0,
+    )
+    count = models.PositiveIntegerField(
+        verbose_name=_(u'Number of movements'),
+        default=0,
+    )
+
+    objects = RollupManager()
+
+    class Meta:
+        verbose_name = _(u'Movement rollup')
+        verbose_name_plural = _(u'Movement rollups')
+        unique_together = (
+            ('bank_account', 'category', 'period', 'year', 'number'),
+        )
+
+    def __unicode__(self):
+        return u'%s - %s %d/%d' % (
+            self.bank_account.last_digits, self.period, self.number,
+            self.year)
+
+
 class CategorySuggestion(models.Model):
     expression = models.CharField(
         verbose_name=_(u'Expression'),
@@ -167,15 +247,160 @@ class CategorySuggestion(models.Model):
         return u"%s - %s" % (self.expression, self.category.name)
 
 
+class ImportJob(models.Model):
+    """
+    Statement uploaded for being imported in background by the
+    run_import_jobs command.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, _(u'Pending')),
+        (RUNNING, _(u'Running')),
+        (DONE, _(u'Done')),
+        (FAILED, _(u'Failed')),
+    ]
+
+    bank_account = models.ForeignKey(
+        BankAccount,
+        verbose_name=_(u'Bank account'),
+        related_name='import_jobs',
+    )
+    statement = models.FileField(
+        verbose_name=_(u'Statement'),
+        upload_to='statements/%Y/%m',
+    )
+    status = models.CharField(
+        verbose_name=_(u'Status'),
+        max_length=10,
+        choices=STATUSES,
+        default=PENDING,
+    )
+    rows_parsed = models.PositiveIntegerField(
+        verbose_name=_(u'Parsed rows'),
+        default=0,
+    )
+    rows_imported = models.PositiveIntegerField(
+        verbose_name=_(u'Imported rows'),
+        default=0,
+    )
+    rows_rejected = models.PositiveIntegerField(
+        verbose_name=_(u'Rejected rows'),
+        default=0,
+    )
+    error = models.TextField(
+        verbose_name=_(u'Error'),
+        blank=True,
+    )
+    created = models.DateTimeField(
+        verbose_name=_(u'Created'),
+        auto_now_add=True,
+    )
+    finished = models.DateTimeField(
+        verbose_name=_(u'Finished'),
+        blank=True,
+        null=True,
+    )
+    heartbeat = models.DateTimeField(
+        verbose_name=_(u'Heartbeat'),
+        help_text=_(u'Last time the worker running the job reported '
+                    u'progress'),
+        blank=True,
+        null=True,
+    )
+
+    class Meta:
+        verbose_name = _(u'Import job')
+        verbose_name_plural = _(u'Import jobs')
+        ordering = ('created', )
+
+    def __unicode__(self):
+        return u'%s - %s' % (self.statement.name, self.status)
+
+
+@receiver(signals.pre_save, sender=Movement)
+def prepare_movement(sender, instance, raw, **kwargs):
+    """
+    Pre-save signal for remembering the stored values of a movement that
+    is going to be modified, so its rollups can be fixed afterwards, or for
+    updating the bank account balance when it's created, so the resulting
+    balance can be stored in the same insert. New movements aren't looked
+    up, except the ones from fixtures, which come with their id and may be
+    there already
+    """
+    instance._previous = None
+    if instance.pk is not None and (raw or not instance._state.adding):
+        previous = Movement.objects.filter(pk=instance.pk).values_list(
+            "bank_account", "category", "date", "amount")
+        if previous:
+            bank_account_id, category_id, day, amount = previous[0]
+            instance._previous = (bank_account_id, category_id, day,
+                Money.from_pence(amount))
+            return
+
+    balance = BankAccount.objects.add_to_balance(
+        instance.bank_account_id, instance.amount)
+    if not instance.current_balance:
+        instance.current_balance = balance
+
+    # Keep the already loaded account up to date too
+    bank_account = getattr(instance, "_bank_account_cache", None)
+    if bank_account is not None:
+        bank_account.current_balance = balance
+
+
+@receiver(signals.post_save, sender=Movement)
+def update_rollups(sender, instance, created, **kwargs):
+    """
+    Post-save signal for keeping the rollups of the movement's periods
+    up to date
+    """
+    current = (instance.bank_account_id, instance.category_id,
+               instance.date, instance.amount)
+    previous = getattr(instance, "_previous", None)
+    if not created and previous in (None, current):
+        return
+    if not created:
+        bank_account_id, category_id, day, amount = previous
+        MovementRollup.objects.add(
+            bank_account_id, category_id, day, amount, -1)
+    MovementRollup.objects.add(*current)
+
+
 @receiver(signals.post_save, sender=Movement)
-def register_payment(sender, instance, created, **kwargs):
+@receiver(signals.post_delete, sender=Movement)
+def invalidate_movements_cache(sender, instance, **kwargs):
+    """
+    Signal for discarding whatever was cached from the movements
+    of the account and month of the movement, like its rendered rows
+    """
+    months = [(instance.bank_account_id, instance.date.year,
+               instance.date.month)]
+    previous = getattr(instance, "_previous", None)
+    if previous is not None:
+        bank_account_id, category_id, day, amount = previous
+        months.append((bank_account_id, day.year, day.month))
+    invalidate_movements(months)
+
+
+@receiver(signals.post_save, sender=MovementCategory)
+@receiver(signals.post_delete, sender=MovementCategory)
+def invalidate_categories_cache(sender, instance, **kwargs):
+    """
+    Signal for discarding whatever was cached with the categories, as
+    every rendered row has all of them in its select
+    """
+    invalidate_categories()
+
+
+@receiver(signals.post_save, sender=CategorySuggestion)
+@receiver(signals.post_delete, sender=CategorySuggestion)
+@receiver(signals.post_save, sender=MovementCategory)
+def invalidate_suggestions(sender, instance, **kwargs):
     """
-    Post save signal for updating the bank account balance once we
-    create a movement
+    Signal for discarding the compiled suggestions once any of the
+    rules (or the categories they point to) changes
     """
-    if created:
-        instance.bank_account.current_balance += instance.amount
-        instance.bank_account.save()
-        if not instance.current_balance:
-            instance.current_balance = instance.bank_account.current_balance
-            instance.save()
+    CategorySuggestion.objects.invalidate()
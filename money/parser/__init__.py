@@ -1,34 +1,309 @@
+import cPickle as pickle
 import csv
+from datetime import date
+import hashlib
+from itertools import islice
+import tempfile
 
-from money.models import Movement
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils.encoding import smart_str
 
+from money.caching import invalidate_movements
+from money.fields import Money
+from money.models import (BankAccount, Movement, MovementRollup,
+                          CategorySuggestion)
 
-def parse_csv(raw_csv, parser, header_lines=0, reverse_order=False):
-    reader = csv.reader(raw_csv, delimiter=',', quotechar='"')
-    rows = []
 
+IMPORT_BATCH_SIZE = 500
+CSV_CHUNK_SIZE = IMPORT_BATCH_SIZE
+
+
+def to_pence(amount):
+    """
+    Converts an amount, as a float or as the string of a statement, into
+    integer pence. None stays None.
+    """
+    if amount is None:
+        return None
+    return int(round(float(amount) * 100))
+
+
+class MovementColumns(object):
+    """
+    Parsed rows of a statement as one list per field instead of one dict
+    per row: dates as ordinals, amounts and balances in integer pence (the
+    balance may be None), interned descriptions, the suggested categories
+    and the ids the statement gives to the transactions, if any.
+    """
+    FIELDS = ("dates", "amounts", "balances", "descriptions", "categories",
+              "references")
+
+    def __init__(self, dates=None, amounts=None, balances=None,
+                 descriptions=None, categories=None, references=None):
+        self.dates = dates or []
+        self.amounts = amounts or []
+        self.balances = balances or []
+        self.descriptions = descriptions or []
+        self.categories = categories or []
+        self.references = references or [None] * len(self.dates)
+
+    @classmethod
+    def from_rows(cls, rows):
+        columns = cls()
+        for row in rows:
+            columns.dates.append(row["date"].toordinal())
+            columns.amounts.append(to_pence(row["amount"]))
+            columns.balances.append(to_pence(row["balance"]))
+            columns.descriptions.append(row["description"])
+            columns.categories.append(row["category"])
+            columns.references.append(row.get("reference"))
+        return columns
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return MovementColumns(*[getattr(self, field)[index]
+                                     for field in self.FIELDS])
+        return self.row(index)
+
+    def row(self, index):
+        """
+        The row at the given position in the form parse_row returns it.
+        """
+        balance = self.balances[index]
+        row = {
+            "date": date.fromordinal(self.dates[index]),
+            "amount": self.amounts[index] / 100.0,
+            "balance": None if balance is None else balance / 100.0,
+            "description": self.descriptions[index],
+            "category": self.categories[index],
+        }
+        if self.references[index] is not None:
+            row["reference"] = self.references[index]
+        return row
+
+    def extend(self, other):
+        for field in self.FIELDS:
+            getattr(self, field).extend(getattr(other, field))
+
+    def reverse(self):
+        for field in self.FIELDS:
+            getattr(self, field).reverse()
+
+
+def _read_csv(raw_csv, header_lines):
+    reader = csv.reader(raw_csv, delimiter=',', quotechar='"')
     for row in reader:
         if reader.line_num > header_lines and row:
-            rows.append(parser.parse_row(row))
+            yield row
+
+
+def _read_rows(raw, parser, header_lines):
+    # Parsers for other formats than CSV read their own rows
+    read_rows = getattr(parser, "read_rows", None)
+    if read_rows is None:
+        return _read_csv(raw, header_lines)
+    return read_rows(raw, header_lines)
+
+
+def _batches(data, size):
+    data = iter(data)
+    while True:
+        batch = list(islice(data, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _reversed_batches(data, size):
+    """
+    Same as _batches but starting from the end, with every batch reversed
+    too. The batches are spilled to a temporary file while reading, so only
+    one of them is kept in memory at a time.
+    """
+    spill = tempfile.TemporaryFile()
+    try:
+        offsets = []
+        for batch in _batches(data, size):
+            offsets.append(spill.tell())
+            pickle.dump(batch, spill, pickle.HIGHEST_PROTOCOL)
+        for offset in reversed(offsets):
+            spill.seek(offset)
+            batch = pickle.load(spill)
+            batch.reverse()
+            yield batch
+    finally:
+        spill.close()
+
+
+def parse_csv(raw_csv, parser, header_lines=0, reverse_order=False):
+    # parse_row leaves checking whether the suggestions changed to us
+    CategorySuggestion.objects.matcher()
+    rows = [parser.parse_row(row)
+            for row in _read_rows(raw_csv, parser, header_lines)]
     if reverse_order:
         rows.reverse()
     return rows
 
 
-def import_movements(data, bank_account):
+def iter_csv(raw_csv, parser, header_lines=0, reverse_order=False,
+             chunk_size=CSV_CHUNK_SIZE):
+    """
+    Streaming version of parse_csv: yields the parsed rows in lists of
+    chunk_size rows, so the memory used doesn't depend on the size of the
+    file. With reverse_order the raw rows are spilled to disk and parsed
+    once the end of the file has been reached.
+    """
+    for batch in _csv_batches(raw_csv, parser, header_lines, reverse_order,
+                              chunk_size):
+        CategorySuggestion.objects.matcher()
+        yield [parser.parse_row(row) for row in batch]
+
+
+def iter_columns(raw_csv, parser, header_lines=0, reverse_order=False,
+                 chunk_size=CSV_CHUNK_SIZE):
+    """
+    Same as iter_csv, but every chunk is parsed at once by the parser into
+    a MovementColumns.
+    """
+    for batch in _csv_batches(raw_csv, parser, header_lines, reverse_order,
+                              chunk_size):
+        yield parser.parse_batch(batch)
+
+
+def _csv_batches(raw_csv, parser, header_lines, reverse_order, chunk_size):
+    rows = _read_rows(raw_csv, parser, header_lines)
+    if reverse_order:
+        return _reversed_batches(rows, chunk_size)
+    return _batches(rows, chunk_size)
+
+
+def movement_fingerprint(bank_account_id, ordinal, amount, description,
+                         balance, occurrence=0, reference=None):
+    """
+    Hash identifying a statement row once imported into an account, made
+    of its date ordinal, its amount in pence and its description, plus the
+    balance the statement gives after it. Rows without one get instead how
+    many identical rows come before them in the statement, as the balance
+    computed when importing depends on what was there already. Rows the
+    statement gives an id, like OFX ones, are identified by it alone.
+    """
+    if reference is not None:
+        return hashlib.sha1("%d|id|%s" % (
+            bank_account_id, smart_str(reference))).hexdigest()
+    if balance is None:
+        return hashlib.sha1("%d|%d|%d|%s|#%d" % (
+            bank_account_id, ordinal, amount, smart_str(description),
+            occurrence)).hexdigest()
+    return hashlib.sha1("%d|%d|%d|%s|%s" % (
+        bank_account_id, ordinal, amount, smart_str(description),
+        balance)).hexdigest()
+
+
+@transaction.commit_on_success
+def import_movements(data, bank_account, batch_size=IMPORT_BATCH_SIZE,
+                     repair=True):
+    """
+    Imports the parsed rows, a MovementColumns or a list of dicts as
+    parse_csv returns them, into the given bank account, skipping the ones
+    that were already imported. Works in batches: one lookup of the
+    fingerprints of the batch in their unique index and one bulk insert
+    for the new rows, while the running balance and the rollups are
+    computed in memory and applied at the end. Importing rows older than
+    the last movement of the account, or out of order, repairs the
+    balances after them, unless repair is False, as when the chunks of a
+    statement are imported one by one and repaired once at the end.
+    """
+    if not isinstance(data, MovementColumns):
+        data = MovementColumns.from_rows(data)
+
+    # Locking the account keeps concurrent imports into it serialized, so
+    # the running balances are computed from the right starting point and
+    # no one else inserts the same fingerprints meanwhile. The amounts are
+    # stored in pence, so the values read need no conversion
+    balance = BankAccount.objects.select_for_update().filter(
+        pk=bank_account.pk).values_list("current_balance", flat=True)[0]
+    latest = Movement.objects.filter(bank_account=bank_account).aggregate(
+        latest=Max("date"))["latest"]
+    earliest = previous = None
+    in_order = True
+    total = 0
+    rollups = {}
+    days = {}
+    occurrences = {}
+
     rejected = []
     accepted = 0
-    for row in data:
-        obj, created = Movement.objects.get_or_create(
-            bank_account=bank_account,
-            description=row["description"],
-            amount=row["amount"],
-            date=row["date"],
-            category=row["category"],
-            current_balance=row["balance"],
-        )
-        if created:
-            accepted += 1
-        else:
-            rejected.append(row)
+    for start in xrange(0, len(data), batch_size):
+        batch = data[start:start + batch_size]
+        rows = zip(batch.dates, batch.amounts, batch.balances,
+                   batch.descriptions, batch.categories)
+
+        fingerprints = []
+        for (ordinal, amount, row_balance, description, category), \
+                reference in zip(rows, batch.references):
+            occurrence = 0
+            if row_balance is None and reference is None:
+                key = (ordinal, amount, description)
+                occurrence = occurrences.get(key, 0)
+                occurrences[key] = occurrence + 1
+            fingerprints.append(movement_fingerprint(bank_account.pk,
+                ordinal, amount, description, row_balance, occurrence,
+                reference))
+        existing = set(Movement.objects.filter(
+            fingerprint__in=fingerprints).values_list(
+            "fingerprint", flat=True).order_by())
+
+        movements = []
+        for i, (ordinal, amount, row_balance, description, category) in \
+                enumerate(rows):
+            current_balance = balance + amount
+            if row_balance is not None:
+                current_balance = row_balance
+            fingerprint = fingerprints[i]
+            if fingerprint in existing:
+                rejected.append(batch.row(i))
+                continue
+            existing.add(fingerprint)
+
+            day = days.get(ordinal)
+            if day is None:
+                day = days[ordinal] = date.fromordinal(ordinal)
+            balance += amount
+            total += amount
+            if earliest is not None and ordinal < previous:
+                in_order = False
+            earliest = min(earliest or ordinal, ordinal)
+            previous = ordinal
+            MovementRollup.objects.collect(rollups, category and category.pk,
+                day, amount)
+            movements.append(Movement(
+                bank_account=bank_account,
+                description=description,
+                amount=Money.from_pence(amount),
+                date=day,
+                category=category,
+                current_balance=Money.from_pence(current_balance),
+                fingerprint=fingerprint,
+            ))
+        Movement.objects.bulk_create(movements)
+        accepted += len(movements)
+
+    if accepted:
+        BankAccount.objects.filter(pk=bank_account.pk).update(
+            current_balance=F("current_balance") + total)
+        bank_account.current_balance = Money.from_pence(balance)
+        MovementRollup.objects.apply(bank_account.pk, rollups)
+        # Bulk inserts don't send the save signals
+        invalidate_movements([(bank_account.pk, year, number)
+            for _, period, year, number in rollups if period == "month"])
+        if repair and (not in_order or (latest is not None and
+                                        date.fromordinal(earliest) < latest)):
+            # Older than what was there, or not sorted by date, so some
+            # balances were computed in the wrong order
+            Movement.objects.repair_balances(bank_account.pk,
+                date.fromordinal(earliest))
     return accepted, rejected
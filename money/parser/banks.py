@@ -1,9 +1,20 @@
 from datetime import date
 
 from money.models import CategorySuggestion
+from money.parser import MovementColumns, to_pence
 
 
 class LloydsParser:
+	# Statements are exported newest first, so they are read backwards
+	NEWEST_FIRST = True
+
+	# Dates are written day first, in the QIF statements too
+	DAY_FIRST = True
+
+	# Statements have many movements per day, so every date string is
+	# only parsed once
+	MAX_DATES = 10000
+	_ordinals = {}
 
 	@staticmethod
 	def parse_row(row):
@@ -19,9 +30,40 @@ class LloydsParser:
 			data["amount"] = - float(row[5])
 		if row[6]:
 			data["amount"] = float(row[6])
-		data["category"] = CategorySuggestion.objects.suggest(data["description"])
+		data["category"] = CategorySuggestion.objects.suggest(
+			data["description"], refresh=False)
 		return data
 
+	@classmethod
+	def parse_batch(cls, rows):
+		"""
+		Parses a block of rows at once into a MovementColumns.
+		"""
+		ordinals = cls._ordinals
+		if len(ordinals) >= cls.MAX_DATES:
+			ordinals.clear()
+
+		columns = MovementColumns()
+		dates, amounts = columns.dates, columns.amounts
+		balances, descriptions = columns.balances, columns.descriptions
+		for row in rows:
+			ordinal = ordinals.get(row[0])
+			if ordinal is None:
+				day, month, year = row[0].split("/")
+				ordinal = ordinals[row[0]] = date(
+					int(year), int(month), int(day)).toordinal()
+			dates.append(ordinal)
+			descriptions.append(intern(row[4]))
+			balances.append(to_pence(row[7]))
+			if row[6]:
+				amounts.append(to_pence(row[6]))
+			else:
+				amounts.append(-to_pence(row[5]))
+		columns.references = [None] * len(dates)
+		columns.categories = CategorySuggestion.objects.suggest_many(
+			descriptions)
+		return columns
+
 
 ENTITY_TO_PARSER = {
 	"lloyds": LloydsParser,
@@ -0,0 +1,173 @@
+from datetime import date
+import re
+from xml.sax.saxutils import unescape
+
+from money.models import CategorySuggestion
+from money.parser import MovementColumns, to_pence
+
+
+class StatementParser(object):
+	"""
+	Base for the parsers of statement formats other than CSV. Subclasses
+	define a read_rows classmethod reading the file incrementally, which
+	yields every transaction as a (date ordinal, amount, description,
+	account number, reference) tuple, with the amount as written in the
+	file and the id the statement gives to the transaction, or None.
+	"""
+	# Transactions aren't in any particular order in these formats, so
+	# they're imported as they come and the balances repaired if needed
+	NEWEST_FIRST = False
+
+	@staticmethod
+	def parse_row(row):
+		ordinal, amount, description, account_number, reference = row
+		data = {
+			"date": date.fromordinal(ordinal),
+			"account_number": account_number,
+			"description": description,
+			"balance": None,
+			"amount": float(amount),
+			"category": CategorySuggestion.objects.suggest(description,
+				refresh=False),
+		}
+		if reference is not None:
+			data["reference"] = reference
+		return data
+
+	@staticmethod
+	def parse_batch(rows):
+		"""
+		Parses a block of rows at once into a MovementColumns.
+		"""
+		columns = MovementColumns()
+		for ordinal, amount, description, account_number, reference in rows:
+			columns.dates.append(ordinal)
+			columns.amounts.append(to_pence(amount))
+			columns.balances.append(None)
+			columns.descriptions.append(intern(description))
+			columns.references.append(reference)
+		columns.categories = CategorySuggestion.objects.suggest_many(
+			columns.descriptions)
+		return columns
+
+
+class OFXParser(StatementParser):
+	"""
+	OFX statements, both the SGML (1.x) and the XML (2.x) ones. Only the
+	transactions are looked at: the file is read in blocks and every
+	<STMTTRN> is parsed as soon as it's complete, so just one block and a
+	transaction are kept in memory. SGML leaves have no closing tags, so
+	values are read up to the next tag or line break. The <FITID> of the
+	transactions is their reference.
+	"""
+	READ_SIZE = 64 * 1024
+	TRANSACTION = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.I | re.S)
+	ACCOUNT = re.compile(r"<ACCTID>\s*([^<\r\n]+?)\s*(?=[<\r\n])", re.I)
+	FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+	@classmethod
+	def read_rows(cls, raw, header_lines=0):
+		buf = ""
+		account_number = None
+		while True:
+			data = raw.read(cls.READ_SIZE)
+			buf += data
+			if account_number is None:
+				match = cls.ACCOUNT.search(buf)
+				if match:
+					account_number = match.group(1)
+
+			end = 0
+			for match in cls.TRANSACTION.finditer(buf):
+				yield cls.transaction(match.group(1), account_number)
+				end = match.end()
+			buf = buf[end:]
+			# Whatever can't be part of a transaction yet to come is dropped
+			start = buf.upper().find("<STMTTRN>")
+			if start < 0:
+				start = buf.rfind("<")
+			buf = buf[start:] if start >= 0 else ""
+
+			if not data:
+				return
+
+	@classmethod
+	def transaction(cls, block, account_number):
+		fields = dict((tag.upper(), unescape(value.strip()))
+			for tag, value in cls.FIELD.findall(block))
+		posted = fields["DTPOSTED"]
+		ordinal = date(int(posted[:4]), int(posted[4:6]),
+			int(posted[6:8])).toordinal()
+		description = fields.get("NAME") or fields.get("MEMO", "")
+		return (ordinal, fields["TRNAMT"], description, account_number,
+			fields.get("FITID") or None)
+
+
+class QIFParser(StatementParser):
+	"""
+	QIF statements, read line by line. Every transaction is a group of
+	lines starting with a field code, ended by a "^" line. The format has
+	no ids for the transactions nor balances, so identical ones of the same
+	day are only told apart by their order. The dates have the day first,
+	as the banks here write them, unless DAY_FIRST says otherwise.
+	"""
+	DAY_FIRST = True
+
+	@classmethod
+	def read_rows(cls, raw, header_lines=0):
+		fields = {}
+		for line in raw:
+			line = line.rstrip("\r\n")
+			if not line or line.startswith("!"):
+				continue
+			if line.startswith("^"):
+				if "D" in fields:
+					yield cls.transaction(fields)
+				fields = {}
+			else:
+				fields.setdefault(line[0], line[1:].strip())
+
+	@classmethod
+	def transaction(cls, fields):
+		amount = (fields.get("T") or fields["U"]).replace(",", "")
+		description = fields.get("P") or fields.get("M", "")
+		return (cls.parse_date(fields["D"]), amount, description, None, None)
+
+	@classmethod
+	def parse_date(cls, value):
+		first, second, year = [
+			int(part) for part in re.split(r"[/'.-]", value.replace(" ", ""))]
+		if year < 100:
+			year += 2000 if year < 70 else 1900
+		day, month = (first, second) if cls.DAY_FIRST else (second, first)
+		return date(year, month, day).toordinal()
+
+
+class MonthFirstQIFParser(QIFParser):
+	DAY_FIRST = False
+
+
+# How many bytes are looked at for telling the format of a statement
+DETECT_SIZE = 1024
+
+
+def detect_parser(raw, default):
+	"""
+	Returns the parser for a statement from its first bytes: OFXParser, a
+	QIF parser or the given default one for anything else, like CSV. The
+	dates of QIF statements are read in the order of the DAY_FIRST of the
+	default parser, as banks write them the same in all their formats. The
+	file is left where it was.
+	"""
+	position = raw.tell()
+	head = raw.read(DETECT_SIZE)
+	raw.seek(position)
+
+	head = head.lstrip("\xef\xbb\xbf \t\r\n")
+	if head.startswith("OFXHEADER") or "<OFX>" in head.upper():
+		return OFXParser
+	if head.startswith("!"):
+		if getattr(default, "DAY_FIRST", True):
+			return QIFParser
+		return MonthFirstQIFParser
+	return default
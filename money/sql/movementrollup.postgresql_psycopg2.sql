@@ -0,0 +1,3 @@
+-- Same as migration 0007, for the databases created by syncdb, like the
+-- test ones: the unique constraint doesn't cover the NULL categories
+CREATE UNIQUE INDEX money_movementrollup_uncategorized_uniq ON money_movementrollup (bank_account_id, period, year, number) WHERE category_id IS NULL;
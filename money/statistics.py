@@ -0,0 +1,114 @@
+"""
+Breakdown of the movements per category and period, as shown by the
+statistics page.
+"""
+from datetime import timedelta
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.utils.translation import ugettext as _
+
+from money.caching import cache_timeout, movements_version, shared_cache
+from money.models import Movement
+
+
+PERIODS = ("week", "month", "year")
+
+
+def period_start(day, period):
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+def next_period(start, period):
+    if period == "week":
+        return start + timedelta(days=7)
+    if period == "month":
+        if start.month == 12:
+            return start.replace(year=start.year + 1, month=1)
+        return start.replace(month=start.month + 1)
+    return start.replace(year=start.year + 1)
+
+
+def period_label(start, period):
+    if period == "week":
+        return "%d-W%02d" % start.isocalendar()[:2]
+    if period == "month":
+        return start.strftime("%Y-%m")
+    return str(start.year)
+
+
+def breakdown(period, date_from=None, date_to=None, bank_accounts=None):
+    """
+    Pivot of the expenses, earnings and number of movements per category
+    (rows) and period (columns), from a single grouped query. All the
+    periods between the first and the last one are included, even if they
+    don't have any movement, so they can be charted as they are.
+    """
+    movements = Movement.objects.all()
+    if date_from is not None:
+        movements = movements.filter(date__gte=date_from)
+    if date_to is not None:
+        movements = movements.filter(date__lte=date_to)
+    if bank_accounts:
+        movements = movements.filter(bank_account__in=bank_accounts)
+    totals = movements.period_totals(period)
+
+    starts = [row[0] for row in totals]
+    first = last = None
+    if date_from is not None or starts:
+        first = period_start(date_from or min(starts), period)
+    if date_to is not None or starts:
+        last = period_start(date_to or max(starts), period)
+    columns = {}
+    while first is not None and last is not None and first <= last:
+        columns[first] = len(columns)
+        first = next_period(first, period)
+
+    categories = {}
+    for start, category_id, name, expenses, earnings, count in totals:
+        category = categories.get(category_id)
+        if category is None:
+            category = categories[category_id] = {
+                "id": category_id,
+                "name": name if category_id is not None else _("None"),
+                "expenses": [0.0] * len(columns),
+                "earnings": [0.0] * len(columns),
+                "count": [0] * len(columns),
+            }
+        column = columns[start]
+        category["expenses"][column] = float(expenses)
+        category["earnings"][column] = float(earnings)
+        category["count"][column] = count
+
+    return {
+        "period": period,
+        "periods": [period_label(start, period)
+                    for start in sorted(columns)],
+        "categories": sorted(categories.values(),
+                             key=lambda category: category["name"]),
+    }
+
+
+def cached_breakdown(period, date_from=None, date_to=None,
+                     bank_accounts=None):
+    """
+    The breakdown already serialized as JSON, kept in the cache until the
+    movements change.
+    """
+    if not shared_cache():
+        return json.dumps(breakdown(period, date_from, date_to,
+                                    bank_accounts))
+    params = (period, date_from, date_to, sorted(bank_accounts or []))
+    key = "money:statistics:%s:%s" % (
+        movements_version(), hashlib.md5(repr(params)).hexdigest())
+    data = cache.get(key)
+    if data is None:
+        data = json.dumps(breakdown(period, date_from, date_to,
+                                    bank_accounts))
+        cache.set(key, data, cache_timeout())
+    return data
@@ -1,14 +1,57 @@
 from django import template
+from django.core.cache import cache
 
-from money.forms import InlineCategoryForm
+from money.caching import ROWS_TIMEOUT, cache_timeout
+from money.forms import CategoryChoices, InlineCategoryForm
 
 register = template.Library()
 
 
-@register.inclusion_tag("money/category_inline.html")
-def inline_edit(category, movement):
+@register.inclusion_tag("money/category_inline.html", takes_context=True)
+def inline_edit(context, category, movement):
+    # The categories are loaded only once for the whole list
+    categories = context.render_context.get(CategoryChoices)
+    if categories is None:
+        categories = context.render_context[CategoryChoices] = \
+            CategoryChoices()
+
     form = InlineCategoryForm({
         "category": category,
-        "movement": movement.pk}, instance=movement)
+        "movement": movement.pk}, instance=movement, categories=categories)
 
     return {"form": form}
+
+
+class CachedRowsNode(template.Node):
+
+    def __init__(self, nodelist, block):
+        self.nodelist = nodelist
+        self.block = template.Variable(block)
+
+    def render(self, context):
+        block = self.block.resolve(context)
+        if block.html is not None:
+            return block.html
+        html = self.nodelist.render(context)
+        if block.key is not None:
+            cache.set(block.key, html, cache_timeout(ROWS_TIMEOUT))
+        return html
+
+
+@register.tag
+def cached_rows(parser, token):
+    """
+    Renders the contents for a RowBlock only if they aren't in the cache
+    already, storing them there otherwise:
+
+        {% cached_rows block %}
+            {% for movement in block.movements %}...{% endfor %}
+        {% endcached_rows %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            "%r tag requires a single argument" % bits[0])
+    nodelist = parser.parse(("endcached_rows", ))
+    parser.delete_first_token()
+    return CachedRowsNode(nodelist, bits[1])
@@ -1,4 +1,18 @@
 from money.tests.models import (BankAccountModelTest, MovementModelTest,
                                 IntenseMovementModelTest, MovementManagerTest,
-                                MovementCategoryModelTest, MovementCategorySuggestionTest)
-from money.tests.parser import SimpleCSVParserTest, SimpleCSVImporterTest
+                                MovementTransactionTest,
+                                MovementCategoryModelTest, MovementCategorySuggestionTest,
+                                MovementRollupTest, ApplySuggestionsTest,
+                                BalanceRepairTest)
+from money.tests.parser import (SimpleCSVParserTest, SimpleCSVImporterTest,
+                                StatementFormatsTest)
+from money.tests.views import (MovementsPaginationTest, MovementsListRenderingTest,
+                               MovementsRowsCacheTest, MovementsCategoriesTest)
+from money.tests.jobs import ImportJobTest, ImportStatementsTest
+from money.tests.benchmark import BenchmarkTest, ExplainMovementsTest
+from money.tests.metrics import RequestMetricsTest
+from money.tests.fields import MoneyTest, CurrencyFieldTest
+from money.tests.statistics import StatisticsTest
+from money.tests.export import ExportTest, ExportConnectionTest
+from money.tests.routers import ReplicaRouterTest, ReplicaMirrorTest
+from money.tests.pool import ConnectionPoolTest
@@ -0,0 +1,78 @@
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase, TransactionTestCase
+
+from money.benchmark import Benchmark, compare, is_throwaway
+from money.models import (BankAccount, Movement, MovementCategory,
+                          MovementRollup, CategorySuggestion)
+
+
+class BenchmarkTest(TestCase):
+
+    def test_run(self):
+        suggestions = CategorySuggestion.objects.count()
+        benchmark = Benchmark(50, rules=5)
+        results = benchmark.run()
+        self.assertEqual(set(results), set(["parse_row", "suggest",
+            "parse_csv", "parse_columns", "import_movements", "aggregates"]))
+        self.assertEqual(Movement.objects.filter(
+            bank_account=benchmark.bank_account).count(), 50)
+
+        benchmark.cleanup()
+        self.assertFalse(BankAccount.objects.filter(
+            description="Benchmark").exists())
+        self.assertFalse(MovementCategory.objects.filter(
+            name__startswith="Benchmark").exists())
+        self.assertEqual(suggestions, CategorySuggestion.objects.count())
+        self.assertFalse(User.objects.filter(username="benchmark").exists())
+        self.assertFalse(MovementRollup.objects.exists())
+
+    def test_databases(self):
+        databases = {
+            "live": {"NAME": "casterly"},
+            "test": {"NAME": "test_casterly"},
+            "file": {"NAME": "/tmp/test_casterly.db"},
+            "memory": {"NAME": ":memory:"},
+        }
+        connections.databases.update(databases)
+        try:
+            self.assertFalse(is_throwaway("live"))
+            self.assertTrue(is_throwaway("test"))
+            self.assertTrue(is_throwaway("file"))
+            self.assertTrue(is_throwaway("memory"))
+
+            # Commands exit when they fail
+            stderr = StringIO()
+            self.assertRaises(SystemExit, call_command, "benchmark",
+                sizes="10", database="live", stdout=StringIO(), stderr=stderr)
+            self.assertIn("live is not a test database", stderr.getvalue())
+        finally:
+            for alias in databases:
+                del connections.databases[alias]
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command("benchmark", sizes="20", rules=2, stdout=stdout)
+        self.assertIn("20 rows  import_movements", stdout.getvalue())
+        self.assertFalse(BankAccount.objects.exists())
+
+    def test_compare(self):
+        baseline = {"1000": {"parse_row": 1.0, "suggest": 2.0}}
+        results = {"1000": {"parse_row": 1.1, "suggest": 2.6,
+                            "aggregates": 5.0},
+                   "100000": {"parse_row": 90.0}}
+        self.assertEqual(compare(results, baseline, 0.2),
+                         [("1000", "suggest", 2.6, 2.0)])
+
+
+class ExplainMovementsTest(TransactionTestCase):
+
+    def test_rolled_back(self):
+        stdout = StringIO()
+        call_command("explain_movements", rows=500, stdout=stdout)
+        self.assertIn("Page of an account", stdout.getvalue())
+        self.assertEqual(0, Movement.objects.count())
+        self.assertEqual(0, BankAccount.objects.count())
@@ -0,0 +1,90 @@
+import csv
+from datetime import date
+import json
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.test import TestCase, TransactionTestCase
+
+from money.export import (iter_rows, export_csv, export_jsonl,
+                          filter_movements)
+from money.models import Movement, MovementCategory
+
+
+class ExportTest(TestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def setUp(self):
+        self.salary = MovementCategory.objects.create(name="Salary")
+        for movement in Movement.objects.filter(amount=1567.0):
+            movement.category = self.salary
+            movement.save()
+
+    def test_chunks(self):
+        expected = list(Movement.objects.order_by("date", "id"))
+        rows = iter_rows(Movement.objects.all(), chunk_size=5)
+        with self.assertNumQueries(5):
+            rows = list(rows)
+        self.assertEqual([movement.pk for movement in expected],
+                         [row[0] for row in rows])
+        self.assertEqual((1, 1, date(2011, 12, 25), u"Christmas presents",
+                          None, -134.3), rows[0][:6])
+
+    def test_csv(self):
+        chunks = list(export_csv(Movement.objects.all(), chunk_size=10))
+        self.assertEqual(3, len(chunks))
+        rows = list(csv.reader(StringIO("".join(chunks))))
+        self.assertEqual(24, len(rows))
+        self.assertEqual(["id", "bank_account", "date", "description",
+                          "category", "amount", "current_balance"], rows[0])
+        self.assertEqual(["3", "1", "2011-12-31", "Salary December",
+                          "Salary", "1567.00"], rows[3][:6])
+
+    def test_jsonl(self):
+        lines = "".join(export_jsonl(filter_movements(
+            categories=[self.salary.pk]))).splitlines()
+        self.assertEqual(3, len(lines))
+        data = json.loads(lines[0])
+        self.assertEqual("2011-12-31", data["date"])
+        self.assertEqual("1567.00", data["amount"])
+        self.assertEqual("Salary", data["category"])
+
+    def test_filters(self):
+        self.assertEqual(11, len(list(iter_rows(filter_movements(
+            [1], date(2012, 1, 1), date(2012, 1, 31))))))
+        self.assertEqual([], list(iter_rows(filter_movements([2]))))
+
+    def test_view(self):
+        response = self.client.get(reverse("movements_export"),
+            {"format": "jsonl", "account": 1, "from": "2012-02-01"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("application/x-ndjson", response["Content-Type"])
+        self.assertEqual(9, len(response.content.splitlines()))
+
+        for params in ({"format": "xml"}, {"from": "yesterday"},
+                       {"account": "one"}):
+            response = self.client.get(reverse("movements_export"), params)
+            self.assertEqual(400, response.status_code)
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command("export_movements", categories=[self.salary.pk],
+                     date_from="2012-01-01", stdout=stdout)
+        self.assertEqual(3, len(stdout.getvalue().splitlines()))
+
+
+class ExportConnectionTest(TransactionTestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def test_closed(self):
+        for connection in connections.all():
+            connection.close()
+
+        response = self.client.get(reverse("movements_export"))
+        self.assertEqual(24, len(response.content.splitlines()))
+        # Django closes the connections before a streamed response is read
+        self.assertEqual([None] * len(connections.all()),
+                         [connection.connection
+                          for connection in connections.all()])
@@ -0,0 +1,91 @@
+import cPickle as pickle
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from money.fields import Money
+from money.models import BankAccount, Movement
+from money.tests.models import EXAMPLE_BANK_ACCOUNT
+
+
+class MoneyTest(TestCase):
+
+    def test_coerce(self):
+        self.assertEqual(1250, Money.coerce(12.5).pence)
+        self.assertEqual(29, Money.coerce(0.285).pence)
+        self.assertEqual(-1, Money.coerce("-0.005").pence)
+        self.assertEqual(1050, Money.coerce(Decimal("10.50")).pence)
+        # Integers are pounds too, only from_pence takes pence
+        self.assertEqual(105000, Money.coerce(1050).pence)
+        self.assertEqual(1050, Money.from_pence(1050).pence)
+        self.assertEqual(1050, Money.from_pence(Decimal("1050")).pence)
+
+    def test_arithmetic(self):
+        self.assertEqual(Money(1300), Money(1250) + 0.5)
+        self.assertEqual(Money(1200), 12.5 - Money(50))
+        self.assertEqual(Money(-2500), -Money(1250) * 2)
+        self.assertEqual(Money(1250), abs(Money(-1250)))
+        self.assertEqual(Money(30), sum([Money(10)] * 3))
+        self.assertTrue(Money(-1) < 0)
+        self.assertFalse(Money(0))
+
+    def test_comparisons(self):
+        self.assertEqual(12.5, Money(1250))
+        self.assertEqual(Decimal("12.50"), Money(1250))
+        self.assertNotEqual(None, Money(0))
+        self.assertNotEqual("twelve", Money(1250))
+        self.assertEqual(12, Money(1200))
+        self.assertEqual(hash(12.5), hash(Money(1250)))
+        self.assertEqual(hash(12), hash(Money(1200)))
+        self.assertIn(12, set([Money(1200)]))
+
+    def test_text(self):
+        self.assertEqual(u"12.50", unicode(Money(1250)))
+        self.assertEqual(u"-0.05", unicode(Money(-5)))
+        self.assertEqual("12.50", "%0.2f" % Money(1250))
+        self.assertEqual(Money(1250), pickle.loads(pickle.dumps(Money(1250))))
+
+
+class CurrencyFieldTest(TestCase):
+
+    def setUp(self):
+        super(CurrencyFieldTest, self).setUp()
+        self.user = User.objects.create(
+            username="foouser", email="foo@example.com")
+        data = EXAMPLE_BANK_ACCOUNT.copy()
+        data["owner"] = self.user
+        self.bank_account = BankAccount.objects.create(**data)
+
+    def test_storage(self):
+        movement = Movement.objects.create(bank_account=self.bank_account,
+            description="Coffee", amount=-2.35, date=date(2012, 1, 1))
+        self.assertEqual([(-235, 1765)], list(Movement.objects.values_list(
+            "amount", "current_balance")))
+        movement = Movement.objects.get(pk=movement.pk)
+        self.assertIsInstance(movement.amount, Money)
+        self.assertEqual(-2.35, movement.amount)
+        self.assertEqual(1, Movement.objects.filter(amount__lt=-2.3).count())
+
+    def test_integers(self):
+        bank_account = BankAccount.objects.create(owner=self.user,
+            description="Savings", initial_balance=100)
+        bank_account = BankAccount.objects.get(pk=bank_account.pk)
+        self.assertEqual(Money(10000), bank_account.initial_balance)
+        bank_account.initial_balance = 5
+        self.assertEqual(Money(500), bank_account.initial_balance)
+        movement = Movement.objects.create(bank_account=self.bank_account,
+            description="Salary", amount=1650, date=date(2012, 1, 1))
+        self.assertEqual([(165000, 167000)], list(
+            Movement.objects.values_list("amount", "current_balance")))
+        self.assertEqual(Money(167000),
+                         Movement.objects.get(pk=movement.pk).current_balance)
+
+    def test_exact_totals(self):
+        for i in range(100):
+            Movement.objects.create(bank_account=self.bank_account,
+                description="Sweets", amount=0.1, date=date(2012, 1, 1))
+        self.assertEqual(Money(3000), BankAccount.objects.get(
+            pk=self.bank_account.pk).current_balance)
+        self.assertEqual(Money(1000), Movement.objects.balance())
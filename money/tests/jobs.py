@@ -0,0 +1,270 @@
+from datetime import date, timedelta
+import json
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import timezone
+
+from money.jobs import (claim_import_jobs, run_import_job, parse_statement,
+                        import_statements, JOB_TIMEOUT)
+from money.models import BankAccount, Movement, ImportJob
+from money.tests.models import EXAMPLE_BANK_ACCOUNT
+from money.tests.parser import (LLOYDS_SIMPLE_EXAMPLE_PAY_ROW,
+                                LLOYDS_SIMPLE_EXAMPLE_EARN_ROW,
+                                OFX_SGML_STATEMENT, QIF_STATEMENT)
+
+
+LLOYDS_STATEMENT = ("Transaction Date,Transaction Type,Sort Code,"
+    "Account Number,Transaction Description,Debit Amount,Credit Amount,"
+    "Balance" + LLOYDS_SIMPLE_EXAMPLE_EARN_ROW + LLOYDS_SIMPLE_EXAMPLE_PAY_ROW)
+
+
+class ImportJobTest(TestCase):
+
+    def setUp(self):
+        super(ImportJobTest, self).setUp()
+        self.user = User.objects.create(
+            username="foouser", email="foo@example.com")
+        data = EXAMPLE_BANK_ACCOUNT.copy()
+        data["owner"] = self.user
+        data["entity"] = "lloyds"
+        self.bank_account = BankAccount.objects.create(**data)
+
+        self.media_root = tempfile.mkdtemp()
+        self.statement_field = ImportJob._meta.get_field("statement")
+        self.storage = self.statement_field.storage
+        self.statement_field.storage = FileSystemStorage(self.media_root)
+
+    def tearDown(self):
+        self.statement_field.storage = self.storage
+        shutil.rmtree(self.media_root)
+        self.bank_account.delete()
+        self.user.delete()
+        super(ImportJobTest, self).tearDown()
+
+    def create_job(self, content=LLOYDS_STATEMENT):
+        job = ImportJob(bank_account=self.bank_account)
+        job.statement.save("statement.csv", ContentFile(content))
+        return job
+
+    def test_upload(self):
+        response = self.client.post(reverse("upload_estatement"), {
+            "bank_account": self.bank_account.pk,
+            "estatement": SimpleUploadedFile("statement.csv",
+                                             LLOYDS_STATEMENT),
+        })
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, "%s?job=%d" % (
+            reverse("upload_estatement"), job.pk))
+        self.assertEqual(ImportJob.PENDING, job.status)
+        self.assertEqual(self.bank_account, job.bank_account)
+        self.assertEqual(0, Movement.objects.count())
+
+    def test_run(self):
+        job = self.create_job()
+        self.assertEqual([job.pk], claim_import_jobs())
+        self.assertEqual([], claim_import_jobs())
+
+        self.assertEqual(ImportJob.DONE, run_import_job(job.pk))
+        job = ImportJob.objects.get(pk=job.pk)
+        self.assertEqual(ImportJob.DONE, job.status)
+        self.assertEqual(2, job.rows_parsed)
+        self.assertEqual(2, job.rows_imported)
+        self.assertEqual(0, job.rows_rejected)
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(["Christmas presents", "Tickets"],
+            [movement.description for movement in Movement.objects.all()])
+
+        job = self.create_job()
+        run_import_job(job.pk)
+        response = self.client.get(
+            reverse("import_job_progress", args=[job.pk]))
+        self.assertEqual({
+            "id": job.pk,
+            "status": ImportJob.DONE,
+            "rows_parsed": 2,
+            "rows_imported": 0,
+            "rows_rejected": 2,
+            "error": "",
+        }, json.loads(response.content))
+
+    def test_run_ofx(self):
+        job = self.create_job(OFX_SGML_STATEMENT)
+        self.assertEqual(ImportJob.DONE, run_import_job(job.pk))
+        self.assertEqual(2, ImportJob.objects.get(pk=job.pk).rows_imported)
+        # Newest first in the file, so the balances had to be repaired
+        self.assertEqual([(u"SALARY", 1667.0), (u"M&S SIMPLY FOOD", 1654.5)],
+            [(movement.description, movement.current_balance)
+             for movement in Movement.objects.order_by("date", "id")])
+
+    def test_repaired_once(self):
+        repairs = []
+        repair_balances = Movement.objects.repair_balances
+
+        def counted(*args, **kwargs):
+            repairs.append(args)
+            return repair_balances(*args, **kwargs)
+
+        Movement.objects.repair_balances = counted
+        try:
+            job = self.create_job(OFX_SGML_STATEMENT.replace(
+                "<STMTTRN>", "<STMTTRN>\n<DTPOSTED>20120110\n"
+                "<TRNAMT>-4.50\n<FITID>3\n<NAME>CAFE\n</STMTTRN>\n"
+                "<STMTTRN>", 1))
+            self.assertEqual(ImportJob.DONE, run_import_job(job.pk,
+                                                            chunk_size=1))
+        finally:
+            del Movement.objects.repair_balances
+        # Every chunk is older than the one before
+        self.assertEqual([(self.bank_account.pk, date(2011, 12, 25))],
+                         repairs)
+        self.assertEqual([1667.0, 1654.5, 1650.0], [movement.current_balance
+            for movement in Movement.objects.order_by("date", "id")])
+
+    def test_failed(self):
+        job = self.create_job(LLOYDS_STATEMENT + "\nwrong,row")
+        self.assertEqual(ImportJob.FAILED, run_import_job(job.pk))
+        job = ImportJob.objects.get(pk=job.pk)
+        self.assertEqual(u"ValueError: need more than 1 value to unpack",
+                         job.error)
+        # The traceback is mailed to the admins instead
+        self.assertEqual(1, len(mail.outbox))
+        self.assertIn("Traceback", mail.outbox[0].body)
+
+    def test_stale(self):
+        stale, alive = self.create_job(), self.create_job()
+        self.assertEqual([stale.pk, alive.pk], claim_import_jobs())
+        ImportJob.objects.filter(pk=stale.pk).update(
+            heartbeat=timezone.now() - timedelta(seconds=JOB_TIMEOUT + 1))
+
+        self.assertEqual([], claim_import_jobs())
+        stale = ImportJob.objects.get(pk=stale.pk)
+        self.assertEqual(ImportJob.FAILED, stale.status)
+        self.assertEqual(u"The import stopped responding", stale.error)
+        self.assertEqual(ImportJob.RUNNING,
+                         ImportJob.objects.get(pk=alive.pk).status)
+
+        # A worker that was only slow doesn't overwrite it
+        self.assertEqual(ImportJob.FAILED, run_import_job(stale.pk))
+        self.assertEqual(0, ImportJob.objects.get(pk=stale.pk).rows_parsed)
+        self.assertEqual(ImportJob.DONE, run_import_job(alive.pk))
+
+
+class ImportStatementsTest(TestCase):
+
+    def setUp(self):
+        super(ImportStatementsTest, self).setUp()
+        self.user = User.objects.create(
+            username="foouser", email="foo@example.com")
+        data = EXAMPLE_BANK_ACCOUNT.copy()
+        data["owner"] = self.user
+        data["entity"] = "lloyds"
+        data["last_digits"] = "0000"
+        self.bank_account = BankAccount.objects.create(**data)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        self.bank_account.delete()
+        self.user.delete()
+        super(ImportStatementsTest, self).tearDown()
+
+    def write_statement(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as statement:
+            statement.write(content)
+        return path
+
+    def test_parse_and_import(self):
+        newer = self.write_statement("newer.csv", LLOYDS_STATEMENT.replace(
+            "2011", "2012").replace("/01/2012", "/02/2012"))
+        older = self.write_statement("older.csv", LLOYDS_STATEMENT)
+
+        path, bank_account_id, newer_rows, seconds = parse_statement(newer)
+        self.assertEqual(newer, path)
+        self.assertEqual(self.bank_account.pk, bank_account_id)
+        self.assertEqual(2, len(newer_rows))
+        _, _, older_rows, _ = parse_statement(older)
+
+        results = import_statements(self.bank_account.pk,
+            [(newer, newer_rows), (older, older_rows)])
+        self.assertEqual([(older, 2, 0), (newer, 2, 0)],
+            [result[:3] for result in results])
+        self.assertEqual(
+            [date(2011, 12, 25), date(2012, 1, 6)],
+            [movement.date for movement in Movement.objects.order_by("id")][:2])
+
+    def test_empty_statement(self):
+        path = self.write_statement("full.csv", LLOYDS_STATEMENT)
+        _, _, rows, _ = parse_statement(path)
+        empty = self.write_statement("empty.csv",
+                                     LLOYDS_STATEMENT.split("\n")[0])
+        _, _, empty_rows, _ = parse_statement(empty)
+        self.assertEqual(0, len(empty_rows))
+
+        results = import_statements(self.bank_account.pk,
+            [(empty, empty_rows), (path, rows)])
+        self.assertEqual([(empty, 0, 0), (path, 2, 0)],
+                         [result[:3] for result in results])
+
+    def test_command(self):
+        self.write_statement("older.csv", LLOYDS_STATEMENT)
+        self.write_statement("newer.csv", LLOYDS_STATEMENT.replace(
+            "2011", "2012").replace("/01/2012", "/02/2012"))
+        self.write_statement("unknown.csv",
+            LLOYDS_STATEMENT.replace("0000000", "1234567"))
+        self.write_statement("notes.txt", "Not a statement")
+
+        stdout, stderr = StringIO(), StringIO()
+        call_command("import_statements", self.directory, processes=1,
+                     stdout=stdout, stderr=stderr)
+        self.assertEqual(4, Movement.objects.filter(
+            bank_account=self.bank_account).count())
+        self.assertIn("older.csv: 2 imported, 0 rejected", stdout.getvalue())
+        self.assertIn("4 rows from 3 files", stdout.getvalue())
+        self.assertIn("unknown.csv: unknown bank account", stderr.getvalue())
+
+    def test_command_formats(self):
+        self.bank_account.last_digits = "1234"
+        self.bank_account.save()
+        self.write_statement("statement.OFX", OFX_SGML_STATEMENT)
+        self.write_statement("statement.qif", QIF_STATEMENT)
+
+        stdout, stderr = StringIO(), StringIO()
+        call_command("import_statements", self.directory, processes=1,
+                     stdout=stdout, stderr=stderr)
+        self.assertEqual(2, Movement.objects.filter(
+            bank_account=self.bank_account).count())
+        self.assertIn("statement.OFX: 2 imported, 0 rejected",
+                      stdout.getvalue())
+        # QIF statements don't tell their account
+        self.assertIn("statement.qif: unknown bank account", stderr.getvalue())
+
+    def test_parse_ofx(self):
+        self.bank_account.last_digits = "1234"
+        self.bank_account.save()
+        path = self.write_statement("statement.ofx", OFX_SGML_STATEMENT)
+        _, bank_account_id, rows, _ = parse_statement(path)
+        self.assertEqual(self.bank_account.pk, bank_account_id)
+        self.assertEqual(["2", "1"], rows.references)
+
+        # QIF statements don't say which account they are from
+        path = self.write_statement("statement.qif", QIF_STATEMENT)
+        self.assertEqual(None, parse_statement(path)[1])
+
+    def test_unknown_account(self):
+        path = self.write_statement("unknown.csv",
+            LLOYDS_STATEMENT.replace("0000000", "1234567"))
+        statement_path, bank_account_id, rows, _ = parse_statement(path)
+        self.assertEqual((path, None, 0),
+                         (statement_path, bank_account_id, len(rows)))
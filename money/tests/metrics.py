@@ -0,0 +1,49 @@
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from casterly.metrics import Histogram, registry
+
+
+class RequestMetricsTest(TestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def setUp(self):
+        super(RequestMetricsTest, self).setUp()
+        registry.reset()
+
+    def test_histogram(self):
+        histogram = Histogram((1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+        self.assertEqual([
+            'm_bucket{v="x",le="1.0"} 2',
+            'm_bucket{v="x",le="5.0"} 3',
+            'm_bucket{v="x",le="+Inf"} 4',
+            'm_sum{v="x"} 14.5',
+            'm_count{v="x"} 4',
+        ], histogram.render("m", 'v="x"'))
+
+    def test_requests(self):
+        self.client.get(reverse("movements_list"))
+        self.client.get(reverse("movements_list"), {"cursor": "wrong"})
+        self.client.get(reverse("admin:index"))
+
+        seconds, queries, sql_seconds = registry.histograms[
+            ("movements_list", "2xx")]
+        self.assertEqual(1, sum(seconds.counts))
+        self.assertTrue(queries.sum > 0)
+        self.assertTrue(sql_seconds.sum <= seconds.sum)
+        self.assertIn(("movements_list", "4xx"), registry.histograms)
+        self.assertIn(("admin", "2xx"), registry.histograms)
+
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(200, response.status_code)
+        self.assertIn('casterly_request_queries_count{view="movements_list",'
+                      'status="2xx"} 1', response.content)
+        self.assertIn('# TYPE casterly_request_seconds histogram',
+                      response.content)
+
+    def test_metrics_access(self):
+        response = self.client.get(reverse("metrics"),
+                                   REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(403, response.status_code)
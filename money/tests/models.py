@@ -1,10 +1,17 @@
 from datetime import date
+from decimal import Decimal
+from StringIO import StringIO
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import transaction, IntegrityError
+from django.test import TestCase, TransactionTestCase
 
+from money import managers
+from money.caching import invalidate_suggestions
 from money.models import (BankAccount, Movement, MovementCategory,
-                          CategorySuggestion, InvalidOperationError)
+                          MovementRollup, CategorySuggestion,
+                          InvalidOperationError)
 
 
 EXAMPLE_BANK_ACCOUNT = {
@@ -159,6 +166,61 @@ class MovementModelTest(TestCase):
         )
         self.assertEqual(-2.5, self.bank_account.current_balance)
 
+    def test_stale_bank_account(self):
+        stale_bank_account = BankAccount.objects.get(pk=self.bank_account.pk)
+        Movement.objects.create(
+            bank_account=self.bank_account,
+            description=u"Beers",
+            amount=-12.5,
+            date=date(2012, 5, 30),
+        )
+        movement = Movement.objects.create(
+            bank_account=stale_bank_account,
+            description=u"Dinner",
+            amount=-22.5,
+            date=date(2012, 5, 31),
+        )
+        self.assertEqual(-15.0, movement.current_balance)
+        self.assertEqual(-15.0, stale_bank_account.current_balance)
+        self.assertEqual(-15.0, BankAccount.objects.get(
+            pk=self.bank_account.pk).current_balance)
+        self.assertEqual(-15.0, Movement.objects.get(
+            pk=movement.pk).current_balance)
+
+    def test_single_write(self):
+        # The balance update and reading it back (Postgres does both at
+        # once), the movement insert and the rollups of its week and month
+        with self.assertNumQueries(7):
+            Movement.objects.create(
+                bank_account=self.bank_account,
+                description=u"Dinner",
+                amount=-22.5,
+                date=date(2012, 5, 31),
+            )
+
+
+class MovementTransactionTest(TransactionTestCase):
+    """
+    Saving a movement outside a transaction, as scripts and tasks do
+    """
+    def setUp(self):
+        super(MovementTransactionTest, self).setUp()
+        data = EXAMPLE_BANK_ACCOUNT.copy()
+        data["owner"] = User.objects.create(
+            username="foouser", email="foo@example.com")
+        self.bank_account = BankAccount.objects.create(**data)
+
+    def test_failed_insert(self):
+        Movement.objects.create(bank_account=self.bank_account,
+            description=u"Groceries", amount=-12.5, date=date(2012, 1, 6),
+            fingerprint="a" * 40)
+        movement = Movement(bank_account=self.bank_account,
+            description=u"Groceries", amount=-12.5, date=date(2012, 1, 6),
+            fingerprint="a" * 40)
+        self.assertRaises(IntegrityError, movement.save)
+        self.assertEqual(7.5, BankAccount.objects.get(
+            pk=self.bank_account.pk).current_balance)
+
 
 class IntenseMovementModelTest(TestCase):
     def setUp(self):
@@ -478,6 +540,229 @@ class MovementCategorySuggestionTest(TestCase):
         sug_category = CategorySuggestion.objects.suggest("Pub")
         self.assertIsNone(sug_category)
 
+    def test_suggestion_order(self):
+        CategorySuggestion.objects.create(
+            expression="food", category=self.c2)
+        CategorySuggestion.objects.create(
+            expression="fast", category=self.c1)
+
+        sug_category = CategorySuggestion.objects.suggest("fast food")
+        self.assertEqual(self.c2.id, sug_category.id)
+        sug_category = CategorySuggestion.objects.suggest("fast lane")
+        self.assertEqual(self.c1.id, sug_category.id)
+
+    def test_suggestion_expressions(self):
+        CategorySuggestion.objects.create(
+            expression="TFL|OYSTER", category=self.c1)
+        CategorySuggestion.objects.create(
+            expression="(SAINSBURY|TESCO)'?S", category=self.c2)
+
+        sug_category = CategorySuggestion.objects.suggest("OYSTER TOPUP")
+        self.assertEqual(self.c1.id, sug_category.id)
+        sug_category = CategorySuggestion.objects.suggest("TESCO'S STORES")
+        self.assertEqual(self.c2.id, sug_category.id)
+
+    def test_many_suggestions(self):
+        for i in range(250):
+            CategorySuggestion.objects.create(
+                expression="(SHOP)%d$" % i, category=self.c1)
+        CategorySuggestion.objects.create(
+            expression="SHOP", category=self.c3)
+
+        sug_category = CategorySuggestion.objects.suggest("SHOP249")
+        self.assertEqual(self.c1.id, sug_category.id)
+        sug_category = CategorySuggestion.objects.suggest("SHOP")
+        self.assertEqual(self.c3.id, sug_category.id)
+
+    def test_suggestion_cache(self):
+        suggestion = CategorySuggestion.objects.create(
+            expression="food", category=self.c2)
+        CategorySuggestion.objects.suggest("some food")
+
+        with self.assertNumQueries(0):
+            sug_category = CategorySuggestion.objects.suggest("more food")
+        self.assertEqual(self.c2.id, sug_category.id)
+
+        suggestion.category = self.c3
+        suggestion.save()
+        sug_category = CategorySuggestion.objects.suggest("some food")
+        self.assertEqual(self.c3.id, sug_category.id)
+
+        suggestion.delete()
+        self.assertIsNone(CategorySuggestion.objects.suggest("some food"))
+
+    def test_suggestion_version(self):
+        CategorySuggestion.objects.create(
+            expression="food", category=self.c2)
+        CategorySuggestion.objects.suggest("some food")
+
+        # Changed by another process, whose signals don't reach this one
+        CategorySuggestion.objects.filter(expression="food").update(
+            category=self.c3)
+        invalidate_suggestions()
+        sug_category = CategorySuggestion.objects.suggest("some food")
+        self.assertEqual(self.c3.id, sug_category.id)
+
+    def test_independent_expressions(self):
+        CategorySuggestion.objects.create(
+            expression="(?i)tesco", category=self.c1)
+        CategorySuggestion.objects.create(
+            expression="(\\w)\\1", category=self.c2)
+        CategorySuggestion.objects.create(
+            expression="amazon", category=self.c3)
+
+        sug_category = CategorySuggestion.objects.suggest("TESCO METRO")
+        self.assertEqual(self.c1.id, sug_category.id)
+        sug_category = CategorySuggestion.objects.suggest("PIZZA")
+        self.assertEqual(self.c2.id, sug_category.id)
+        self.assertIsNone(CategorySuggestion.objects.suggest("AMAZON"))
+
+    def test_combined_expressions(self):
+        for expression, category in (("food", self.c2), ("fast", self.c1),
+                                     ("(?i)tesco", self.c3),
+                                     ("^(PUB|BAR)S?$", self.c1),
+                                     ("CAFE", self.c2)):
+            CategorySuggestion.objects.create(expression=expression,
+                                              category=category)
+
+        # Both before and after the one with flags are a single pattern
+        self.assertEqual(3, len(CategorySuggestion.objects.matcher().patterns))
+        for description, category in (("fast food", self.c2),
+                                      ("fast lane", self.c1),
+                                      ("TESCO CAFE", self.c3),
+                                      ("PUBS", self.c1),
+                                      ("PUB CAFE", self.c2)):
+            self.assertEqual(category.id,
+                CategorySuggestion.objects.suggest(description).id)
+        self.assertIsNone(CategorySuggestion.objects.suggest("PUB LUNCH"))
+
+
+class ApplySuggestionsTest(TestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def setUp(self):
+        CategorySuggestion.objects.all().delete()
+        self.salary = MovementCategory.objects.create(name="Salary")
+        self.home = MovementCategory.objects.create(name="Home")
+        self.django = MovementCategory.objects.create(name="DjangoCon")
+        self.suggestions = [
+            CategorySuggestion.objects.create(
+                expression="^Salary", category=self.salary),
+            CategorySuggestion.objects.create(
+                expression="Flat|Salary", category=self.home),
+            CategorySuggestion.objects.create(
+                expression="Django(Con)?", category=self.django),
+        ]
+
+    def rollups(self):
+        # Incremental updates leave empty rollups behind, unlike rebuilding
+        return sorted(MovementRollup.objects.exclude(count=0).values_list(
+            "bank_account", "category", "period", "year", "number",
+            "expenses", "earnings", "count"))
+
+    def assertApplied(self, results):
+        self.assertEqual(zip(self.suggestions, [3, 2, 2]), results)
+        self.assertEqual(
+            [u"Salary December", u"Salary January", u"Salary February"],
+            [movement.description for movement in
+             Movement.objects.filter(category=self.salary).order_by("pk")])
+        self.assertEqual(2, Movement.objects.filter(category=self.home,
+            description__startswith="Flat rental").count())
+        self.assertEqual(2, Movement.objects.filter(
+            category=self.django).count())
+        self.assertEqual(16, Movement.objects.filter(category=None).count())
+
+        rollups = self.rollups()
+        MovementRollup.objects.rebuild()
+        self.assertEqual(self.rollups(), rollups)
+
+    def test_apply(self):
+        self.assertApplied(CategorySuggestion.objects.apply_to_movements(
+            chunk_size=5))
+
+    def test_apply_in_python(self):
+        vendors = managers.REGEX_VENDORS
+        managers.REGEX_VENDORS = ()
+        try:
+            results = CategorySuggestion.objects.apply_to_movements(
+                chunk_size=5)
+        finally:
+            managers.REGEX_VENDORS = vendors
+        self.assertApplied(results)
+
+    def test_only_uncategorized(self):
+        movement = Movement.objects.get(description="Salary January")
+        movement.category = self.django
+        movement.save()
+
+        results = CategorySuggestion.objects.apply_to_movements(
+            CategorySuggestion.objects.filter(pk=self.suggestions[1].pk))
+        self.assertEqual([(self.suggestions[1], 4)], results)
+        self.assertEqual(self.django, Movement.objects.get(
+            description="Salary January").category)
+
+        results = CategorySuggestion.objects.apply_to_movements(
+            bank_accounts=[])
+        self.assertEqual([0, 0, 0], [count for _, count in results])
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command("apply_suggestions", str(self.suggestions[2].pk),
+                     account=[1], stdout=stdout)
+        self.assertEqual("Django(Con)? - DjangoCon: 2 movements\n"
+                         "2 movements categorized\n", stdout.getvalue())
+
+
+class BalanceRepairTest(TestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def setUp(self):
+        Movement.objects.repair_balances(1)
+
+    def balances(self):
+        return [movement.current_balance.pence for movement in
+                Movement.objects.order_by("date", "id")]
+
+    def test_running_balances(self):
+        balance = 10000
+        for movement in Movement.objects.order_by("date", "id"):
+            balance += movement.amount.pence
+            self.assertEqual(balance, movement.current_balance.pence)
+        self.assertEqual(0, Movement.objects.repair_balances(1))
+
+    def test_backdated_movement(self):
+        before = self.balances()
+        Movement.objects.create(bank_account_id=1, date=date(2011, 12, 1),
+            description="Forgotten", amount=-10.0)
+
+        # Reading the previous balance and the initial one, 5 chunks, and
+        # for the first chunk an update for the new movement and another
+        # one for the rest, which move by the same amount
+        with self.assertNumQueries(13):
+            changed = Movement.objects.repair_balances(
+                1, date(2011, 12, 1), chunk_size=5)
+        self.assertEqual(24, changed)
+        self.assertEqual([9000] + [balance - 1000 for balance in before],
+                         self.balances())
+
+    def test_since(self):
+        Movement.objects.filter(date__gte=date(2012, 2, 1)).update(
+            current_balance=None)
+        Movement.objects.filter(date__lt=date(2012, 1, 15)).update(
+            current_balance=0)
+        self.assertEqual(9, Movement.objects.repair_balances(
+            1, date(2012, 2, 1)))
+        self.assertEqual(8, Movement.objects.filter(
+            current_balance=0).count())
+
+    def test_command(self):
+        Movement.objects.filter(pk=10).update(current_balance=0)
+        stdout = StringIO()
+        call_command("repair_balances", "1", since="2012-01-01",
+                     stdout=stdout)
+        self.assertEqual("Bank account 1: 1 balances repaired\n",
+                         stdout.getvalue())
+
 
 class MovementManagerTest(TestCase):
     # expenses/earnings/benefits in a date range
@@ -501,6 +786,26 @@ class MovementManagerTest(TestCase):
         self.assertEqual(5002.76, Movement.objects.earnings())
         self.assertEqual(1970.6, Movement.objects.balance())
 
+    def test_summary(self):
+        with self.assertNumQueries(1):
+            summary = Movement.objects.summary()
+        self.assertEqual(Decimal("3032.16"), summary["expenses"])
+        self.assertEqual(Decimal("5002.76"), summary["earnings"])
+        self.assertEqual(Decimal("1970.60"), summary["balance"])
+        self.assertEqual(23, summary["count"])
+
+        summary = Movement.objects.per_month(2012, 2).summary()
+        self.assertEqual(Decimal("1550.34"), summary["expenses"])
+        self.assertEqual(Decimal("1567"), summary["earnings"])
+        self.assertEqual(Decimal("16.66"), summary["balance"])
+        self.assertEqual(9, summary["count"])
+
+        summary = Movement.objects.per_month(2010, 1).summary()
+        self.assertEqual(Decimal("0"), summary["expenses"])
+        self.assertEqual(Decimal("0"), summary["earnings"])
+        self.assertEqual(Decimal("0"), summary["balance"])
+        self.assertEqual(0, summary["count"])
+
     def test_movements_per_month(self):
         bank_account = BankAccount.objects.get(pk=1)
 
@@ -589,4 +894,81 @@ class MovementManagerTest(TestCase):
 
         self.assertEqual(97.3, Movement.objects.per_week(2012, 9).expenses())
         self.assertEqual(1567, Movement.objects.per_week(2012, 9).earnings())
-        self.assertEqual(1469.7, Movement.objects.per_week(2012, 9).balance())
\ No newline at end of file
+        self.assertEqual(1469.7, Movement.objects.per_week(2012, 9).balance())
+
+
+class MovementRollupTest(TestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def assertRollupsEqual(self, expected):
+        self.assertEqual(expected, sorted(MovementRollup.objects.values_list(
+            "category", "period", "year", "number", "expenses", "earnings",
+            "count")))
+
+    def test_rollups_from_movements(self):
+        self.assertEqual(23, MovementRollup.objects.filter(
+            period="month").summary()["count"])
+        self.assertEqual(23, MovementRollup.objects.filter(
+            period="week").summary()["count"])
+
+        with self.assertNumQueries(1):
+            summary = Movement.objects.per_month(2012, 1).summary()
+        self.assertEqual(Decimal("1304.96"), summary["expenses"])
+        self.assertEqual(Decimal("1868.76"), summary["earnings"])
+        self.assertEqual(Decimal("563.80"), summary["balance"])
+        self.assertEqual(11, summary["count"])
+
+        self.assertEqual(Decimal("939.35"), Movement.objects.filter(
+            bank_account=1).per_week(2012, 2).summary()["expenses"])
+        self.assertEqual(0, Movement.objects.filter(
+            bank_account=2).per_week(2012, 2).summary()["count"])
+
+    def test_rollups_only_for_periods(self):
+        queryset = Movement.objects.per_month(2012, 1)
+        rollups = MovementRollup.objects.filter(period="month")
+        months = rollups.filter(year=2012, number=1)
+        uncategorized = months.filter(category=None).count()
+        # Made up totals, so the summaries tell where they were read from
+        rollups.update(count=1000)
+
+        self.assertEqual(1000 * months.count(),
+                         queryset.all().summary()["count"])
+        self.assertEqual(1000 * uncategorized,
+                         queryset.filter(category=None).summary()["count"])
+        self.assertEqual(queryset.filter(amount__lt=0).count(),
+                         queryset.filter(amount__lt=0).summary()["count"])
+        self.assertEqual(queryset.exclude(category=None).count(),
+                         queryset.exclude(category=None).summary()["count"])
+        self.assertEqual(0, queryset.per_month(2012, 2).summary()["count"])
+        self.assertEqual(0, queryset.per_month(2012, 2).count())
+
+    def test_uncategorized_rollups_unique(self):
+        rollup = MovementRollup.objects.filter(category=None)[0]
+        rollup.pk = None
+        sid = transaction.savepoint()
+        self.assertRaises(IntegrityError, rollup.save)
+        transaction.savepoint_rollback(sid)
+
+    def test_category_change(self):
+        category = MovementCategory.objects.create(name="Flat")
+        movement = Movement.objects.get(description="Flat rental January")
+        movement.category = category
+        movement.save()
+
+        queryset = Movement.objects.per_month(2012, 1)
+        self.assertEqual(800.0, queryset.filter(category=category).expenses())
+        self.assertEqual(504.96, queryset.filter(category=None).expenses())
+        self.assertEqual(1304.96, queryset.expenses())
+
+    def test_rebuild(self):
+        category = MovementCategory.objects.create(name="Flat")
+        movement = Movement.objects.get(description="Flat rental January")
+        movement.category = category
+        movement.save()
+
+        expected = sorted(MovementRollup.objects.values_list(
+            "category", "period", "year", "number", "expenses", "earnings",
+            "count"))
+        MovementRollup.objects.all().delete()
+        call_command("rebuild_rollups", stdout=StringIO())
+        self.assertRollupsEqual(expected)
@@ -4,9 +4,14 @@ from datetime import date
 from django.contrib.auth.models import User
 from django.test import TestCase
 
-from money.models import BankAccount, Movement
-from money.parser import parse_csv, import_movements
+from money import managers
+from money.models import (BankAccount, Movement, MovementCategory,
+                          CategorySuggestion)
+from money.parser import (parse_csv, iter_csv, iter_columns,
+                          import_movements, movement_fingerprint)
 from money.parser.banks import LloydsParser
+from money.parser.formats import (OFXParser, QIFParser, MonthFirstQIFParser,
+                                  detect_parser)
 from money.tests.models import EXAMPLE_BANK_ACCOUNT
 
 
@@ -16,6 +21,60 @@ LLOYDS_SIMPLE_EXAMPLE_PAY_ROW = """
 LLOYDS_SIMPLE_EXAMPLE_EARN_ROW = """
 06/01/2012,TFR,'00-00-00,0000000,Tickets,,134.3,200"""
 
+OFX_SGML_STATEMENT = """OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+
+<OFX>
+<BANKMSGSRSV1><STMTTRNRS><STMTRS>
+<CURDEF>GBP
+<BANKACCTFROM>
+<BANKID>000000
+<ACCTID>00001234
+<ACCTTYPE>CHECKING
+</BANKACCTFROM>
+<BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20120106120000.000[0:GMT]
+<TRNAMT>-12.50
+<FITID>2
+<NAME>M&amp;S SIMPLY FOOD
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20111225
+<TRNAMT>1567.00
+<FITID>1
+<NAME>
+<MEMO>SALARY
+</STMTTRN>
+</BANKTRANLIST>
+</STMTRS></STMTTRNRS></BANKMSGSRSV1>
+</OFX>
+"""
+
+OFX_XML_STATEMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<?OFX OFXHEADER="200" VERSION="211"?>
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKACCTFROM><ACCTID>00001234</ACCTID>
+</BANKACCTFROM><BANKTRANLIST><STMTTRN><TRNTYPE>DEBIT</TRNTYPE>\
+<DTPOSTED>20120106</DTPOSTED><TRNAMT>-12.50</TRNAMT>\
+<NAME>M&amp;S SIMPLY FOOD</NAME></STMTTRN></BANKTRANLIST></STMTRS>\
+</STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+QIF_STATEMENT = """!Type:Bank
+D25/12/2011
+T1,567.00
+PSALARY
+^
+D6/1'12
+T-12.50
+PM&S SIMPLY FOOD
+MGroceries
+^
+"""
+
 
 class SimpleCSVParserTest(TestCase):
 
@@ -108,6 +167,67 @@ class SimpleCSVParserTest(TestCase):
         self.assertEqual(134.3, row['amount'])
         self.assertEqual(200, row['balance'])
 
+    def test_chunks(self):
+        raw_csv = (LLOYDS_SIMPLE_EXAMPLE_PAY_ROW +
+                   LLOYDS_SIMPLE_EXAMPLE_EARN_ROW * 2)
+        chunks = list(iter_csv(
+            cStringIO.StringIO(raw_csv), parser=LloydsParser, chunk_size=2))
+        self.assertEqual([2, 1], [len(chunk) for chunk in chunks])
+        self.assertEqual(
+            parse_csv(cStringIO.StringIO(raw_csv), parser=LloydsParser),
+            chunks[0] + chunks[1])
+
+    def test_reversed_chunks(self):
+        raw_csv = (LLOYDS_SIMPLE_EXAMPLE_PAY_ROW +
+                   LLOYDS_SIMPLE_EXAMPLE_EARN_ROW * 2)
+        chunks = list(iter_csv(
+            cStringIO.StringIO(raw_csv), parser=LloydsParser,
+            reverse_order=True, chunk_size=2))
+        self.assertEqual([1, 2], [len(chunk) for chunk in chunks])
+        self.assertEqual(
+            parse_csv(cStringIO.StringIO(raw_csv), parser=LloydsParser,
+                      reverse_order=True),
+            chunks[0] + chunks[1])
+        self.assertEqual("Christmas presents", chunks[1][1]["description"])
+
+    def test_columns(self):
+        raw_csv = (LLOYDS_SIMPLE_EXAMPLE_PAY_ROW +
+                   LLOYDS_SIMPLE_EXAMPLE_EARN_ROW * 2)
+        chunks = list(iter_columns(
+            cStringIO.StringIO(raw_csv), parser=LloydsParser,
+            reverse_order=True, chunk_size=2))
+        self.assertEqual([1, 2], [len(chunk) for chunk in chunks])
+        columns = chunks[0]
+        columns.extend(chunks[1])
+
+        rows = parse_csv(cStringIO.StringIO(raw_csv), parser=LloydsParser,
+                         reverse_order=True)
+        for row in rows:
+            del row["account_number"]
+        self.assertEqual(rows, [columns[i] for i in range(len(columns))])
+        self.assertEqual([date(2012, 1, 6).toordinal()] * 2 +
+                         [date(2011, 12, 25).toordinal()], columns.dates)
+        self.assertEqual([13430, 13430, -13430], columns.amounts)
+        self.assertEqual([20000] * 3, columns.balances)
+        self.assertIs(columns.descriptions[0], columns.descriptions[1])
+
+    def test_suggestions_version(self):
+        category = MovementCategory.objects.create(name="Leisure")
+        CategorySuggestion.objects.create(expression="Tickets",
+                                          category=category)
+        reads = []
+        version = managers.suggestions_version
+        managers.suggestions_version = lambda: reads.append(1) or version()
+        try:
+            chunks = list(iter_csv(cStringIO.StringIO(
+                LLOYDS_SIMPLE_EXAMPLE_EARN_ROW * 3), parser=LloydsParser,
+                chunk_size=2))
+        finally:
+            managers.suggestions_version = version
+        # Once per chunk, not once per row
+        self.assertEqual(2, len(reads))
+        self.assertEqual(category, chunks[1][0]["category"])
+
 
 class SimpleCSVImporterTest(TestCase):
     def setUp(self):
@@ -191,3 +311,223 @@ class SimpleCSVImporterTest(TestCase):
         self.assertEqual(data[0]["description"], rejected[0]["description"])
         self.assertEqual(data[0]["amount"], rejected[0]["amount"])
         self.assertEqual(data[0]["date"], rejected[0]["date"])
+
+    def test_fingerprints(self):
+        data = parse_csv(
+            cStringIO.StringIO(LLOYDS_SIMPLE_EXAMPLE_PAY_ROW),
+            parser=LloydsParser,
+        )
+        import_movements(data, self.bank_account)
+        movement = Movement.objects.get()
+        self.assertEqual(movement_fingerprint(self.bank_account.pk,
+            date(2011, 12, 25).toordinal(), -13430, u"Christmas presents",
+            20000), movement.fingerprint)
+
+        # Changing the category doesn't make the row look new
+        movement.category = MovementCategory.objects.create(name="Gifts")
+        movement.save()
+        imported, rejected = import_movements(data, self.bank_account)
+        self.assertEqual(0, imported)
+        self.assertEqual(1, len(rejected))
+
+        # But the same row is new for another account
+        other = BankAccount.objects.create(owner=self.user,
+            description="Other", last_digits="1111", entity="lloyds")
+        imported, rejected = import_movements(data, other)
+        self.assertEqual(1, imported)
+        other.delete()
+
+    def test_account_balance(self):
+        data = parse_csv(
+            cStringIO.StringIO(
+                LLOYDS_SIMPLE_EXAMPLE_PAY_ROW + LLOYDS_SIMPLE_EXAMPLE_EARN_ROW),
+            parser=LloydsParser,
+        )
+        import_movements(data, self.bank_account)
+        self.assertEqual(340.0, self.bank_account.current_balance)
+        self.assertEqual(340.0, BankAccount.objects.get(
+            pk=self.bank_account.pk).current_balance)
+
+        data = parse_csv(
+            cStringIO.StringIO(LLOYDS_SIMPLE_EXAMPLE_EARN_ROW),
+            parser=LloydsParser,
+        )
+        data[0]["balance"] = None
+        data[0]["description"] = "Refund"
+        import_movements(data, self.bank_account)
+        self.assertEqual(474.3, BankAccount.objects.get(
+            pk=self.bank_account.pk).current_balance)
+        self.assertEqual(474.3, Movement.objects.get(
+            description="Refund").current_balance)
+
+    def test_older_statement(self):
+        def rows(*movements):
+            return [{"date": day, "amount": amount, "description": description,
+                     "balance": None, "category": None}
+                    for day, amount, description in movements]
+
+        self.bank_account.current_balance = 100.0
+        self.bank_account.save()
+        import_movements(rows((date(2012, 2, 1), -10.0, "Cinema"),
+                              (date(2012, 2, 5), 20.0, "Refund")),
+                         self.bank_account)
+        import_movements(rows((date(2012, 1, 15), -5.0, "Coffee")),
+                         self.bank_account)
+        self.assertEqual([95.0, 85.0, 105.0], [
+            movement.current_balance for movement in
+            Movement.objects.order_by("date", "id")])
+        self.assertEqual(105.0, BankAccount.objects.get(
+            pk=self.bank_account.pk).current_balance)
+
+    def test_reimport_without_balances(self):
+        def rows(*movements):
+            return [{"date": day, "amount": amount, "description": description,
+                     "balance": None, "category": None}
+                    for day, amount, description in movements]
+
+        data = rows((date(2012, 2, 1), -2.5, "Coffee"),
+                    (date(2012, 2, 1), -2.5, "Coffee"))
+        self.assertEqual((2, []), import_movements(data, self.bank_account))
+        imported, rejected = import_movements(data, self.bank_account)
+        self.assertEqual(0, imported)
+        self.assertEqual(2, len(rejected))
+        self.assertEqual(2, Movement.objects.count())
+
+        # A third coffee that day is a new movement, whatever the balance
+        data += rows((date(2012, 2, 1), -2.5, "Coffee"),
+                     (date(2012, 2, 2), 10.0, "Refund"))
+        imported, rejected = import_movements(data, self.bank_account)
+        self.assertEqual(2, imported)
+        self.assertEqual(2, len(rejected))
+        self.assertEqual(342.5, BankAccount.objects.get(
+            pk=self.bank_account.pk).current_balance)
+
+    def test_import_columns(self):
+        columns = LloydsParser.parse_batch([
+            row.split(",") for row in (LLOYDS_SIMPLE_EXAMPLE_PAY_ROW +
+                LLOYDS_SIMPLE_EXAMPLE_EARN_ROW).strip().split("\n")])
+        self.assertEqual((2, []),
+                         import_movements(columns, self.bank_account))
+        self.assertEqual(
+            [(date(2011, 12, 25), -134.3, 200), (date(2012, 1, 6), 134.3, 200)],
+            [(movement.date, movement.amount, movement.current_balance)
+             for movement in Movement.objects.order_by("date")])
+        self.assertEqual(340.0, BankAccount.objects.get(
+            pk=self.bank_account.pk).current_balance)
+
+        imported, rejected = import_movements(columns, self.bank_account)
+        self.assertEqual(0, imported)
+        self.assertEqual("Tickets", rejected[1]["description"])
+
+    def test_batches(self):
+        data = parse_csv(
+            cStringIO.StringIO(
+                LLOYDS_SIMPLE_EXAMPLE_PAY_ROW + LLOYDS_SIMPLE_EXAMPLE_EARN_ROW +
+                LLOYDS_SIMPLE_EXAMPLE_PAY_ROW),
+            parser=LloydsParser,
+        )
+        # The balance and the last date, one lookup and one insert per
+        # batch, the account update, and creating the rollups of two weeks
+        # and two months
+        with self.assertNumQueries(14):
+            imported, rejected = import_movements(
+                data, self.bank_account, batch_size=2)
+        self.assertEqual(2, Movement.objects.count())
+        self.assertEqual(2, imported)
+        self.assertEqual(1, len(rejected))
+        self.assertEqual(data[2]["description"], rejected[0]["description"])
+        self.assertEqual(340.0, BankAccount.objects.get(
+            pk=self.bank_account.pk).current_balance)
+        self.assertEqual(134.3, Movement.objects.per_month(2011, 12).expenses())
+        self.assertEqual(134.3, Movement.objects.per_week(2012, 1).earnings())
+
+
+class StatementFormatsTest(TestCase):
+
+    def rows(self, parser, statement):
+        return [parser.parse_row(row) for row in parser.read_rows(
+            cStringIO.StringIO(statement))]
+
+    def assertStatementRows(self, rows):
+        self.assertEqual(date(2012, 1, 6), rows[0]["date"])
+        self.assertEqual(-12.5, rows[0]["amount"])
+        self.assertEqual("M&S SIMPLY FOOD", rows[0]["description"])
+        self.assertIsNone(rows[0]["balance"])
+
+    def test_ofx(self):
+        rows = self.rows(OFXParser, OFX_SGML_STATEMENT)
+        self.assertEqual(2, len(rows))
+        self.assertStatementRows(rows)
+        self.assertEqual("00001234", rows[0]["account_number"])
+        self.assertEqual("2", rows[0]["reference"])
+        self.assertEqual(date(2011, 12, 25), rows[1]["date"])
+        self.assertEqual(1567.0, rows[1]["amount"])
+        self.assertEqual("SALARY", rows[1]["description"])
+
+        rows = self.rows(OFXParser, OFX_XML_STATEMENT)
+        self.assertEqual(1, len(rows))
+        self.assertStatementRows(rows)
+
+    def test_ofx_small_reads(self):
+        # Tags and transactions split between reads
+        class SmallReadsParser(OFXParser):
+            READ_SIZE = 7
+
+        self.assertEqual(self.rows(OFXParser, OFX_SGML_STATEMENT),
+                         self.rows(SmallReadsParser, OFX_SGML_STATEMENT))
+        self.assertEqual(self.rows(OFXParser, OFX_XML_STATEMENT),
+                         self.rows(SmallReadsParser, OFX_XML_STATEMENT))
+
+    def test_qif(self):
+        rows = self.rows(QIFParser, QIF_STATEMENT)
+        self.assertEqual(2, len(rows))
+        self.assertEqual(date(2011, 12, 25), rows[0]["date"])
+        self.assertEqual(1567.0, rows[0]["amount"])
+        self.assertStatementRows(rows[1:])
+
+    def test_columns(self):
+        columns = list(iter_columns(cStringIO.StringIO(QIF_STATEMENT),
+                                    parser=QIFParser))[0]
+        self.assertEqual([156700, -1250], columns.amounts)
+        self.assertEqual([None, None], columns.balances)
+        self.assertEqual([None, None], columns.references)
+        self.assertEqual([date(2011, 12, 25).toordinal(),
+                          date(2012, 1, 6).toordinal()], columns.dates)
+
+    def test_detect(self):
+        for statement, parser in ((OFX_SGML_STATEMENT, OFXParser),
+                                  (OFX_XML_STATEMENT, OFXParser),
+                                  ("\xef\xbb\xbf" + QIF_STATEMENT, QIFParser),
+                                  (LLOYDS_SIMPLE_EXAMPLE_PAY_ROW, LloydsParser)):
+            raw = cStringIO.StringIO(statement)
+            raw.read(3)
+            raw.seek(0)
+            self.assertIs(parser, detect_parser(raw, LloydsParser))
+            self.assertEqual(0, raw.tell())
+
+        class MonthFirstParser(LloydsParser):
+            DAY_FIRST = False
+
+        parser = detect_parser(cStringIO.StringIO(QIF_STATEMENT),
+                               MonthFirstParser)
+        self.assertIs(MonthFirstQIFParser, parser)
+        self.assertEqual(date(2012, 6, 1), self.rows(parser,
+            QIF_STATEMENT.replace("25/12/2011", "12/25/2011"))[1]["date"])
+
+    def test_reimport(self):
+        user = User.objects.create(username="foouser")
+        bank_account = BankAccount.objects.create(owner=user,
+            description="Current", last_digits="1234")
+        for parser, statement in ((OFXParser, OFX_SGML_STATEMENT),
+                                  (QIFParser, QIF_STATEMENT)):
+            columns = list(iter_columns(cStringIO.StringIO(statement),
+                                        parser=parser))[0]
+            imported, rejected = import_movements(columns, bank_account)
+            self.assertEqual((2, 0), (imported, len(rejected)))
+            imported, rejected = import_movements(columns, bank_account)
+            self.assertEqual((0, 2), (imported, len(rejected)))
+
+        # The id of an OFX transaction is enough to know it
+        self.assertEqual(movement_fingerprint(bank_account.pk, 0, 0, u"",
+            None, reference="2"), Movement.objects.filter(
+            description="M&S SIMPLY FOOD").order_by("id")[0].fingerprint)
@@ -0,0 +1,109 @@
+import time
+
+from django.db import connections
+from django.test import TestCase
+from django.utils import unittest
+
+from casterly.db import pool
+from casterly.db.pool import ConnectionPool
+
+
+POOLED_ALIASES = [
+    alias for alias in connections
+    if connections.databases[alias]["ENGINE"] ==
+    "casterly.db.pooled_postgresql"]
+
+
+class Connection(object):
+
+    def __init__(self, works=True):
+        self.works = works
+        self.closed = False
+
+
+class ConnectionPoolTest(TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool(
+            check=lambda connection: connection.works,
+            reset=lambda connection: not connection.closed,
+            close=lambda connection: setattr(connection, "closed", True),
+            size=2, max_idle=60, check_after=10)
+        self.key = ("test", time.time())
+
+    def tearDown(self):
+        # The pools belong to the process, so other tests would see it
+        pool._pools.pop(self.key, None)
+
+    def age(self, seconds):
+        self.pool.idle = [(connection, returned - seconds)
+                          for connection, returned in self.pool.idle]
+
+    def test_reuse(self):
+        self.assertEqual(None, self.pool.get())
+        first, second, third = Connection(), Connection(), Connection()
+        for connection in (first, second, third):
+            self.pool.put(connection)
+        self.assertTrue(third.closed)
+
+        self.assertIs(second, self.pool.get())
+        self.assertIs(first, self.pool.get())
+        self.assertEqual(None, self.pool.get())
+        self.assertEqual({"hits": 2, "misses": 2, "discarded": 0,
+                          "overflow": 1}, self.pool.counts)
+
+    def test_discard(self):
+        broken, closed = Connection(works=False), Connection()
+        self.pool.put(broken)
+        closed.closed = True
+        self.pool.put(closed)
+        self.assertEqual(1, len(self.pool.idle))
+
+        # Only checked after being idle for a while
+        self.assertIs(broken, self.pool.get())
+        self.pool.put(broken)
+        self.age(20)
+        self.assertEqual(None, self.pool.get())
+        self.assertTrue(broken.closed)
+
+        stale, connection = Connection(), Connection()
+        self.pool.put(stale)
+        self.age(120)
+        self.pool.put(connection)
+        self.assertTrue(stale.closed)
+        self.assertEqual([connection], [c for c, _ in self.pool.idle])
+        self.assertEqual(3, self.pool.counts["discarded"])
+
+    def test_forked(self):
+        connection = Connection()
+        self.pool.put(connection)
+        self.pool.pid = -1
+        self.assertEqual(None, self.pool.get())
+        self.assertFalse(connection.closed)
+        self.assertEqual(1, self.pool.counts["misses"])
+
+    def test_render(self):
+        pooled = pool.get_pool(self.key, check=None, reset=None,
+            close=None, labels={"alias": "test", "database": "pool"})
+        pooled.counts["hits"] = 3
+        self.assertIn('# TYPE casterly_db_pool_hits_total counter\n',
+                      pool.render())
+        self.assertIn('casterly_db_pool_hits_total{alias="test",'
+                      'database="pool"} 3\n', pool.render())
+
+    @unittest.skipUnless(POOLED_ALIASES, "No pooled PostgreSQL database")
+    def test_postgres(self):
+        connection = connections[POOLED_ALIASES[0]]
+        connection.close()
+        connection.pool.clear()
+        hits = connection.pool.counts["hits"]
+
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_backend_pid()")
+        pid = cursor.fetchone()[0]
+        connection.close()
+
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_backend_pid()")
+        self.assertEqual(pid, cursor.fetchone()[0])
+        self.assertEqual(hits + 1, connection.pool.counts["hits"])
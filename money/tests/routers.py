@@ -0,0 +1,103 @@
+import json
+import time
+
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from casterly.routers import (ReplicaRouter, ReplicaPinMiddleware,
+                              replica_reads, PIN_COOKIE)
+from money.caching import cache_timeout
+from money.models import Movement, MovementCategory
+from money.views import movements_export
+
+
+@override_settings(REPLICA_DATABASE="replica", REPLICA_PIN_SECONDS=5)
+class ReplicaRouterTest(TestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.middleware = ReplicaPinMiddleware()
+        self.request(RequestFactory().get("/"))
+
+    def request(self, request):
+        self.middleware.process_request(request)
+        return request
+
+    def test_replica_reads(self):
+        self.assertEqual("default", Movement.objects.all().db)
+        with replica_reads():
+            self.assertEqual("replica", Movement.objects.all().db)
+            self.assertEqual(5, cache_timeout(60))
+        self.assertEqual("default", self.router.db_for_read(Movement))
+        self.assertEqual(60, cache_timeout(60))
+
+        with override_settings(REPLICA_DATABASE=None):
+            with replica_reads():
+                self.assertEqual("default", Movement.objects.all().db)
+
+    def test_pinned_after_write(self):
+        with replica_reads():
+            self.assertEqual("default", self.router.db_for_write(Movement))
+            self.assertEqual("default", Movement.objects.all().db)
+
+        response = self.middleware.process_response(
+            RequestFactory().get("/"), HttpResponse())
+        cookie = response.cookies[PIN_COOKIE]
+        self.assertEqual(5, cookie["max-age"])
+
+        factory = RequestFactory()
+        factory.cookies[PIN_COOKIE] = cookie.value
+        self.request(factory.get("/"))
+        with replica_reads():
+            self.assertEqual("default", Movement.objects.all().db)
+
+        factory.cookies[PIN_COOKIE] = repr(time.time() - 1)
+        self.request(factory.get("/"))
+        with replica_reads():
+            self.assertEqual("replica", Movement.objects.all().db)
+
+    def test_pin_cookie(self):
+        category = MovementCategory.objects.create(name="Home")
+        response = self.client.post(reverse("movements_categories"),
+            json.dumps({7: category.pk}), content_type="application/json")
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_pinned_export(self):
+        factory = RequestFactory()
+        factory.cookies[PIN_COOKIE] = repr(time.time() + 5)
+        request = self.request(factory.get(reverse("movements_export")))
+        response = self.middleware.process_response(
+            request, movements_export(request))
+        # Generated after the middleware is done, but still from the primary
+        self.assertEqual(Movement.objects.count() + 1,
+                         len(response.content.splitlines()))
+
+
+@override_settings(REPLICA_DATABASE="replica")
+class ReplicaMirrorTest(TransactionTestCase):
+
+    def setUp(self):
+        if ("replica" not in connections.databases or
+                connections["default"].settings_dict["NAME"] == ":memory:"):
+            self.skipTest("No replica alias mirroring a test database that "
+                          "two connections can share")
+        self.replica = connections["replica"]
+        self.replica.use_debug_cursor = True
+
+    def tearDown(self):
+        self.replica.use_debug_cursor = None
+
+    def test_read(self):
+        category = MovementCategory.objects.create(name="Holidays")
+        # A new request, so the write above doesn't pin the reads
+        ReplicaPinMiddleware().process_request(RequestFactory().get("/"))
+        queries = len(self.replica.queries)
+        with replica_reads():
+            self.assertEqual([category], list(
+                MovementCategory.objects.filter(name="Holidays")))
+        self.assertEqual(queries + 1, len(self.replica.queries))
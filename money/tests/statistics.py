@@ -0,0 +1,65 @@
+from datetime import date
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from money.models import Movement, MovementCategory
+from money.statistics import breakdown, cached_breakdown
+
+
+class StatisticsTest(TestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def test_breakdown(self):
+        category = MovementCategory.objects.create(name="Salary")
+        for movement in Movement.objects.filter(amount=1567.0):
+            movement.category = category
+            movement.save()
+
+        with self.assertNumQueries(1):
+            data = breakdown("month")
+        self.assertEqual(["2011-12", "2012-01", "2012-02"], data["periods"])
+        uncategorized, salary = data["categories"]
+        self.assertEqual(None, uncategorized["id"])
+        self.assertEqual([176.86, 1304.96, 1550.34], uncategorized["expenses"])
+        self.assertEqual([0.0, 301.76, 0.0], uncategorized["earnings"])
+        self.assertEqual([1567.0] * 3, salary["earnings"])
+        self.assertEqual([1, 1, 1], salary["count"])
+
+        # Periods without movements are included too
+        data = breakdown("week", date(2011, 12, 12), date(2012, 1, 1), [1])
+        self.assertEqual(["2011-W50", "2011-W51", "2011-W52"], data["periods"])
+        self.assertEqual([0, 1, 2], [sum(counts) for counts in zip(
+            *[category["count"] for category in data["categories"]])])
+
+        data = breakdown("year")
+        self.assertEqual(["2011", "2012"], data["periods"])
+        self.assertEqual([3, 20], [sum(counts) for counts in zip(
+            *[category["count"] for category in data["categories"]])])
+
+    def test_cache(self):
+        data = cached_breakdown("month")
+        with self.assertNumQueries(0):
+            self.assertEqual(data, cached_breakdown("month"))
+
+        movement = Movement.objects.all()[0]
+        movement.category = MovementCategory.objects.create(name="Presents")
+        movement.save()
+        self.assertNotEqual(data, cached_breakdown("month"))
+
+    def test_views(self):
+        response = self.client.get(reverse("statistics"), {"period": "week"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(11, len(response.context["statistics"]["periods"]))
+
+        response = self.client.get(reverse("statistics_data"),
+            {"period": "year", "from": "2012-01-01"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(["2012"], json.loads(response.content)["periods"])
+
+        response = self.client.get(reverse("statistics_data"),
+            {"period": "day"})
+        self.assertEqual(400, response.status_code)
+        response = self.client.get(reverse("statistics"), {"from": "soon"})
+        self.assertEqual(400, response.status_code)
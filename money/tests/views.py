@@ -0,0 +1,209 @@
+import json
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import Client
+
+from money import caching
+from money.models import Movement, MovementCategory, MovementRollup
+
+
+class MovementsPaginationTest(TestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def test_pages(self):
+        expected = list(Movement.objects.order_by("date", "id"))
+        movements, cursor = Movement.objects.page(size=10)
+        self.assertEqual(expected[:10], movements)
+        self.assertEqual((expected[9].date, expected[9].pk), cursor)
+
+        movements, cursor = Movement.objects.page(cursor, size=10)
+        self.assertEqual(expected[10:20], movements)
+        movements, cursor = Movement.objects.page(cursor, size=10)
+        self.assertEqual(expected[20:], movements)
+        self.assertIsNone(cursor)
+
+    def test_same_date_pages(self):
+        expected = list(Movement.objects.order_by("date", "id"))
+        seen = []
+        cursor = None
+        while True:
+            movements, cursor = Movement.objects.page(cursor, size=1)
+            seen.extend(movements)
+            if cursor is None:
+                break
+        self.assertEqual(expected, seen)
+
+    def test_list(self):
+        response = self.client.get(reverse("movements_list"))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(23, len(response.context["movements"]))
+        self.assertIsNone(response.context["next_cursor"])
+
+        response = self.client.get(reverse("movements_list"),
+            {"cursor": "wrong"})
+        self.assertEqual(400, response.status_code)
+
+    def test_rows(self):
+        response = self.client.get(reverse("movements_rows"),
+            {"account": 1, "cursor": "2012-02-14.0"})
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.content)
+        self.assertIsNone(data["next"])
+        self.assertEqual(
+            [u"DjangoCon tickets", u"DjangoCon hotel", u"Dinner and beers",
+             u"Shopping at Amazon", u"Salary February"],
+            [row["description"] for row in data["rows"]])
+        self.assertEqual(-120.0, data["rows"][0]["amount"])
+        self.assertEqual("2012-02-14", data["rows"][0]["date"])
+
+
+class MovementsListRenderingTest(TestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def test_queries(self):
+        category = MovementCategory.objects.create(name="Flat")
+        movement = Movement.objects.get(description="Flat rental January")
+        movement.category = category
+        movement.save()
+
+        # One query for the movements and another one for the categories
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("movements_list"))
+        self.assertContains(response, '<option value="None">', count=23)
+        self.assertContains(response,
+            '<option value="%d" selected="selected">Flat</option>' %
+            category.pk, count=1)
+
+
+class MovementsRowsCacheTest(TestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def setUp(self):
+        cache.clear()
+
+    def rendered_blocks(self):
+        response = self.client.get(reverse("movements_list"))
+        return dict((block.month, block.html is None)
+                    for block in response.context["blocks"])
+
+    def test_cached_rows(self):
+        self.assertTrue(all(self.rendered_blocks().values()))
+        # Only the movements, the rows come from the cache
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("movements_list"))
+        self.assertContains(response, "Flat rental January")
+        self.assertFalse(any(self.rendered_blocks().values()))
+
+    def test_changed_month(self):
+        self.rendered_blocks()
+        movement = Movement.objects.get(description="Flat rental January")
+        movement.description = "Flat rental"
+        movement.save()
+
+        rendered = self.rendered_blocks()
+        month = (movement.bank_account_id, 2012, 1)
+        self.assertTrue(rendered.pop(month))
+        self.assertFalse(any(rendered.values()))
+        response = self.client.get(reverse("movements_list"))
+        self.assertContains(response, "<td>Flat rental</td>")
+
+    def test_changed_categories(self):
+        self.rendered_blocks()
+        MovementCategory.objects.create(name="Flat")
+        self.assertTrue(all(self.rendered_blocks().values()))
+        response = self.client.get(reverse("movements_list"))
+        self.assertContains(response, ">Flat</option>", count=23)
+
+    def test_changed_elsewhere(self):
+        self.rendered_blocks()
+        # Another process changes a movement, which only reaches this one
+        # through the version in the cache
+        movement = Movement.objects.get(description="Flat rental January")
+        Movement.objects.filter(pk=movement.pk).update(
+            description="Flat rental")
+        cache.delete(caching.MONTH_VERSION_KEY % (
+            movement.bank_account_id, 2012, 1))
+        response = self.client.get(reverse("movements_list"))
+        self.assertContains(response, "<td>Flat rental</td>")
+
+    def test_process_cache(self):
+        shared = caching.cache
+        caching.cache = LocMemCache("movements", {})
+        try:
+            self.assertTrue(all(self.rendered_blocks().values()))
+            Movement.objects.filter(description="Flat rental January"
+                                    ).update(description="Flat rental")
+            self.assertTrue(all(self.rendered_blocks().values()))
+            response = self.client.get(reverse("movements_list"))
+        finally:
+            caching.cache = shared
+        self.assertContains(response, "<td>Flat rental</td>")
+
+
+class MovementsCategoriesTest(TestCase):
+    fixtures = ["test_fixtures.json"]
+
+    def setUp(self):
+        self.home = MovementCategory.objects.create(name="Home")
+        self.events = MovementCategory.objects.create(name="Events")
+
+    def post(self, data, client=None):
+        return (client or self.client).post(reverse("movements_categories"),
+            json.dumps(data), content_type="application/json")
+
+    def rollups(self):
+        return sorted(MovementRollup.objects.exclude(count=0).values_list(
+            "category", "period", "year", "number", "expenses", "earnings",
+            "count"))
+
+    def test_batch(self):
+        balances = dict(Movement.objects.values_list("pk", "current_balance"))
+        response = self.post({7: self.home.pk, 18: self.home.pk,
+                              19: self.events.pk, 1: None, 2: 12345,
+                              999: self.home.pk})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({
+            "7": "updated", "18": "updated", "19": "updated",
+            "1": "unchanged", "2": "invalid", "999": "missing",
+        }, json.loads(response.content)["results"])
+
+        self.assertEqual([7, 18], sorted(Movement.objects.filter(
+            category=self.home).values_list("pk", flat=True)))
+        self.assertEqual([19], list(Movement.objects.filter(
+            category=self.events).values_list("pk", flat=True)))
+        self.assertEqual(balances, dict(
+            Movement.objects.values_list("pk", "current_balance")))
+
+        rollups = self.rollups()
+        MovementRollup.objects.rebuild()
+        self.assertEqual(self.rollups(), rollups)
+
+    def test_back_to_none(self):
+        self.post({7: self.home.pk})
+        self.assertEqual({"7": "updated"},
+            json.loads(self.post({7: None}).content)["results"])
+        self.assertIsNone(Movement.objects.get(pk=7).category)
+        self.assertEqual(0, MovementRollup.objects.filter(
+            category=self.home).summary()["count"])
+
+    def test_invalid_requests(self):
+        self.assertEqual(405, self.client.get(
+            reverse("movements_categories")).status_code)
+        self.assertEqual(400, self.client.post(reverse("movements_categories"),
+            "{", content_type="application/json").status_code)
+        self.assertEqual(400, self.post([7, 1]).status_code)
+        self.assertEqual(400, self.post({"x": 1}).status_code)
+        self.assertEqual(403, self.post({7: self.home.pk},
+            Client(enforce_csrf_checks=True)).status_code)
+
+    def test_inline_edit(self):
+        response = self.client.post(reverse("inline_category_edit"),
+            {"movement": 7, "category": self.home.pk})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.home, Movement.objects.get(pk=7).category)
+        response = self.client.post(reverse("inline_category_edit"),
+            {"movement": 999, "category": self.home.pk})
+        self.assertEqual(404, response.status_code)
@@ -3,6 +3,12 @@ from django.conf.urls import patterns, include, url
 
 urlpatterns = patterns('money.views',
     url(r'^movements/$', 'movements_list', name='movements_list'),
+    url(r'^movements/rows/$', 'movements_rows', name='movements_rows'),
+    url(r'^movements/export/$', 'movements_export', name='movements_export'),
     url(r'^movement/edit/category/$', 'inline_category_edit', name='inline_category_edit'),
+    url(r'^movements/categories/$', 'movements_categories', name='movements_categories'),
+    url(r'^statistics/$', 'statistics', name='statistics'),
+    url(r'^statistics/data/$', 'statistics_data', name='statistics_data'),
     url(r'^upload/$', 'upload_estatement', name='upload_estatement'),
+    url(r'^upload/(?P<job_id>\d+)/$', 'import_job_progress', name='import_job_progress'),
 )
\ No newline at end of file
@@ -1,44 +1,234 @@
+from datetime import datetime
+import json
+
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect, HttpResponse, HttpResponseForbidden
-from django.shortcuts import render
+from django.db import connections, transaction
+from django.http import (HttpResponseRedirect, HttpResponse,
+	HttpResponseForbidden, HttpResponseBadRequest, Http404)
+from django.shortcuts import render, get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
+from casterly.routers import replica_reads, replica_alias, pinned_to_primary
+from money.caching import row_blocks
+from money.export import FORMATS as EXPORT_FORMATS, filter_movements
 from money.forms import UploadCSVstatementForm
-from money.models import Movement, MovementCategory
+from money.models import Movement, ImportJob
+from money.statistics import PERIODS, cached_breakdown
+
+
+def _encode_cursor(cursor):
+	if cursor is None:
+		return None
+	day, pk = cursor
+	return "%s.%d" % (day.strftime("%Y-%m-%d"), pk)
+
+
+def _decode_cursor(value):
+	"""
+	Cursors are sent as "YYYY-MM-DD.id"; raises ValueError for
+	anything else
+	"""
+	if not value:
+		return None
+	day, pk = value.split(".")
+	return datetime.strptime(day, "%Y-%m-%d").date(), int(pk)
+
+
+def _movements_page(request):
+	movements = Movement.objects.select_related("category")
+	if request.GET.get("account"):
+		movements = movements.filter(bank_account=request.GET["account"])
+	return movements.page(_decode_cursor(request.GET.get("cursor")))
 
 
+@replica_reads()
 def movements_list(request):
-	movements = Movement.objects.all()
+	try:
+		movements, cursor = _movements_page(request)
+	except ValueError:
+		return HttpResponseBadRequest("Invalid page", content_type="text/plain")
 	return render(request, "money/movements_list.html", {
 		"movements": movements,
+		"blocks": row_blocks(movements),
+		"account": request.GET.get("account", ""),
+		"next_cursor": _encode_cursor(cursor),
+	})
+
+
+@replica_reads()
+def movements_rows(request):
+	try:
+		movements, cursor = _movements_page(request)
+	except ValueError:
+		return HttpResponseBadRequest("Invalid page", content_type="text/plain")
+	rows = [{
+		"id": movement.pk,
+		"bank_account": movement.bank_account_id,
+		"date": movement.date.strftime("%Y-%m-%d"),
+		"description": movement.description,
+		"category": movement.category_id,
+		"amount": movement.amount,
+		"current_balance": movement.current_balance,
+	} for movement in movements]
+	# The amounts are Money, which are written as numbers
+	return HttpResponse(json.dumps({
+		"rows": rows,
+		"next": _encode_cursor(cursor),
+	}, default=float), content_type="application/json")
+
+
+def _statistics_params(request):
+	"""
+	Period, date range and bank accounts of a statistics request; raises
+	ValueError for wrong values
+	"""
+	period = request.GET.get("period", "month")
+	if period not in PERIODS:
+		raise ValueError("Unknown period %s" % period)
+	date_from, date_to = _date_range(request)
+	bank_accounts = [int(pk) for pk in request.GET.getlist("account")]
+	return period, date_from, date_to, bank_accounts
+
+
+def _date_range(request):
+	return [datetime.strptime(request.GET[key], "%Y-%m-%d").date()
+		if request.GET.get(key) else None for key in ("from", "to")]
+
+
+@replica_reads()
+def statistics(request):
+	try:
+		params = _statistics_params(request)
+	except ValueError:
+		return HttpResponseBadRequest("Invalid filter", content_type="text/plain")
+	return render(request, "money/statistics.html", {
+		"statistics": json.loads(cached_breakdown(*params)),
+		"periods": PERIODS,
+		"period": params[0],
+		"date_from": request.GET.get("from", ""),
+		"date_to": request.GET.get("to", ""),
 	})
 
 
+@replica_reads()
+def statistics_data(request):
+	try:
+		params = _statistics_params(request)
+	except ValueError:
+		return HttpResponseBadRequest("Invalid filter", content_type="text/plain")
+	return HttpResponse(cached_breakdown(*params),
+		content_type="application/json")
+
+
 def upload_estatement(request):
 	form = UploadCSVstatementForm()
 
 	if request.method == "POST":
 		form = UploadCSVstatementForm(request.POST, request.FILES)
 		if form.is_valid():
-			form.save()
-			return HttpResponseRedirect(reverse('movements_list'))
+			job = form.save()
+			return HttpResponseRedirect("%s?job=%d" % (
+				reverse('upload_estatement'), job.pk))
 
+	job = None
+	if request.GET.get("job", "").isdigit():
+		job = ImportJob.objects.filter(pk=request.GET["job"])
+		job = job[0] if job else None
 	return render(request, "money/upload_estatement.html", {
 		"form": form,
+		"job": job,
 	})
 
 
+def import_job_progress(request, job_id):
+	job = get_object_or_404(ImportJob, pk=job_id)
+	return HttpResponse(json.dumps({
+		"id": job.pk,
+		"status": job.status,
+		"rows_parsed": job.rows_parsed,
+		"rows_imported": job.rows_imported,
+		"rows_rejected": job.rows_rejected,
+		"error": job.error,
+	}), content_type="application/json")
+
+
+def _replica_stream(chunks, pinned):
+	# The chunks are generated once the view has returned, when the
+	# middleware has already reset whether the request is pinned, and
+	# request_finished has already closed the connections, so the one
+	# opened to read them is closed here
+	with replica_reads(pinned=pinned):
+		alias = replica_alias()
+		try:
+			for chunk in chunks:
+				yield chunk
+		finally:
+			if not transaction.is_managed(using=alias):
+				transaction.commit_unless_managed(using=alias)
+				connections[alias].close()
+
+
+@replica_reads()
+def movements_export(request):
+	"""
+	Streams the movements of the given accounts, dates and categories as
+	CSV or JSON Lines, which are generated while they are sent.
+	"""
+	try:
+		export, content_type = EXPORT_FORMATS[request.GET.get("format", "csv")]
+		date_from, date_to = _date_range(request)
+		movements = filter_movements(
+			[int(pk) for pk in request.GET.getlist("account")],
+			date_from, date_to,
+			[int(pk) for pk in request.GET.getlist("category")])
+	except (KeyError, ValueError):
+		return HttpResponseBadRequest("Invalid filter", content_type="text/plain")
+	response = HttpResponse(
+		_replica_stream(export(movements), pinned_to_primary()),
+		content_type=content_type)
+	response["Content-Disposition"] = 'attachment; filename="movements.%s"' % (
+		request.GET.get("format", "csv"))
+	return response
+
+
 @csrf_exempt  # TOOD very very wrong, temporary fix
 def inline_category_edit(request):
 	if request.is_ajax:
-		category_id = request.POST["category"]
-		movement_id = request.POST["movement"]
-
-		movement = Movement.objects.get(pk=movement_id)
-		if category_id == 'None':
-			movement.category = None
-		else:
-			movement.category = MovementCategory.objects.get(pk=category_id)
-		movement.save()
+		try:
+			movement_id = int(request.POST["movement"])
+			category_id = request.POST["category"]
+			category_id = None if category_id == "None" else int(category_id)
+		except (KeyError, ValueError):
+			return HttpResponseBadRequest("Invalid category",
+				content_type="text/plain")
+		result = Movement.objects.set_categories({movement_id: category_id})
+		if result[movement_id] == "missing":
+			raise Http404
+		if result[movement_id] == "invalid":
+			return HttpResponseBadRequest("Invalid category",
+				content_type="text/plain")
 		return HttpResponse("Ok", content_type="text/plain")
 	return HttpResponseForbidden()
+
+
+@require_POST
+def movements_categories(request):
+	"""
+	Changes the categories of many movements at once. The body is a JSON
+	object with the category id (or null) of every movement id, and the
+	response has the result of each one, as given by
+	Movement.objects.set_categories.
+	"""
+	try:
+		data = json.loads(request.body)
+		categories = dict(
+			(int(pk), None if category is None else int(category))
+			for pk, category in data.items())
+	except (ValueError, TypeError, AttributeError):
+		return HttpResponseBadRequest("Invalid categories",
+			content_type="text/plain")
+	results = Movement.objects.set_categories(categories)
+	return HttpResponse(json.dumps({
+		"results": dict((str(pk), result) for pk, result in results.items()),
+	}), content_type="application/json")